@@ -0,0 +1,52 @@
+"""
+Benchmark of the time to first token of stream_answer against generate_answer, which returns
+only once the whole completion has arrived. Runs against the local fake Cohere server.
+
+Usage:
+    python benchmarks/bench_answer_streaming.py --questions 20 --token-delay 0.02
+"""
+import os
+import sys
+import time
+import argparse
+import statistics
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from fake_cohere import start_server
+from ragqnabot.answergen import generate_answer, stream_answer, get_cohere_client
+
+DOCS = [{"text": "The pipeline caches embeddings on disk."}, {"text": "Only changed chunks are upserted."}]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--questions", type=int, default=20, help="The number of questions per variant")
+    parser.add_argument("--token-delay", type=float, default=0.02, help="The delay in seconds between two words")
+    args = parser.parse_args()
+
+    server, base_url = start_server(token_delay=args.token_delay)
+    client = get_cohere_client("fake", base_url=base_url)
+    try:
+        blocking = []
+        for _ in range(args.questions):
+            start = time.perf_counter()
+            generate_answer("How are embeddings reused?", DOCS, client=client)
+            blocking.append(time.perf_counter() - start)
+
+        first_token, complete = [], []
+        for _ in range(args.questions):
+            start = time.perf_counter()
+            for i, _ in enumerate(stream_answer("How are embeddings reused?", DOCS, client=client)):
+                if i == 0:
+                    first_token.append(time.perf_counter() - start)
+            complete.append(time.perf_counter() - start)
+    finally:
+        server.shutdown()
+
+    print(f"generate_answer  first output after {statistics.median(blocking) * 1000:8.1f} ms (median)")
+    print(f"stream_answer    first token after  {statistics.median(first_token) * 1000:8.1f} ms (median), "
+          f"complete after {statistics.median(complete) * 1000:8.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
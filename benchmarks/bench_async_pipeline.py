@@ -0,0 +1,112 @@
+"""
+Load test of AsyncQueryPipeline against the synchronous path (similarity_search + generate_answer
+run from a pool of threads), with local stand-ins for Pinecone and Cohere:
+
+- the index is a LocalIndex whose queries sleep for --index-latency ms, like a network round trip;
+- answers come from the fake Cohere server in benchmarks/fake_cohere.py, run in a child process.
+
+Both paths run a closed loop of --users concurrent users until --queries queries are answered, and
+report the throughput and latency percentiles.
+
+Usage:
+    python benchmarks/bench_async_pipeline.py --users 64 --queries 640
+"""
+import os
+import sys
+import time
+import random
+import asyncio
+import argparse
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from fake_cohere import start_server_process
+from fake_pinecone import LatencyIndex
+from ragqnabot import AsyncQueryPipeline, VectorStore, generate_answer, get_cohere_client
+
+TOPICS = ["invoices", "latency", "the index", "embeddings", "refunds", "the cache", "deployments", "backups"]
+
+
+def make_queries(count):
+    rng = random.Random(0)
+    return [f"What does the document say about {rng.choice(TOPICS)} in section {i}?" for i in range(count)]
+
+
+def summarize(name, latencies, elapsed):
+    latencies = np.array(latencies) * 1000
+    p50, p95, p99 = np.percentile(latencies, [50, 95, 99])
+    print(f"{name:6s} {len(latencies) / elapsed:8.1f} QPS   p50 {p50:7.1f} ms   p95 {p95:7.1f} ms   p99 {p99:7.1f} ms")
+
+
+def run_sync(vectorstore, index, client, queries, users):
+    latencies = []
+
+    def ask(query):
+        start = time.perf_counter()
+        generate_answer(query, vectorstore.similarity_search(index, query, k=3), client=client)
+        latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=users) as executor:
+        list(executor.map(ask, queries))
+    return latencies, time.perf_counter() - start
+
+
+async def run_async(pipeline, queries, users):
+    latencies = []
+    remaining = iter(queries)
+
+    async def user():
+        for query in remaining:
+            start = time.perf_counter()
+            await pipeline.answer(query)
+            latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(user() for _ in range(users)))
+    return latencies, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=64, help="The number of concurrent users")
+    parser.add_argument("--queries", type=int, default=640, help="The number of queries per path")
+    parser.add_argument("--chunks", type=int, default=20000, help="The number of vectors in the index")
+    parser.add_argument("--index-latency", type=float, default=30, help="The simulated index round trip in ms")
+    parser.add_argument("--token-delay", type=float, default=0.01, help="The delay in seconds between two generated words")
+    args = parser.parse_args()
+
+    # Start the server before the model is loaded, so the child process stays small.
+    server, base_url = start_server_process(token_delay=args.token_delay)
+    try:
+        vectorstore = VectorStore()
+        dimension = vectorstore.embeddings.shape[1]
+        rng = np.random.default_rng(0)
+        index = LatencyIndex(args.index_latency / 1000, dimension=dimension)
+        index.upsert(vectors=[(f"chunk-{i}", vector, {"text": f"Chunk {i} of the synthetic corpus."})
+                              for i, vector in enumerate(rng.standard_normal((args.chunks, dimension), dtype=np.float32))])
+
+        queries = make_queries(args.queries)
+        vectorstore.model.encode(queries[:8])  # Warm up
+
+        client = get_cohere_client("fake", base_url=base_url, max_connections=args.users)
+        latencies, elapsed = run_sync(vectorstore, index, client, queries, args.users)
+        summarize("sync", latencies, elapsed)
+
+        async def run():
+            async with AsyncQueryPipeline(vectorstore, index, cohere_api="fake", base_url=base_url,
+                                          max_concurrency=args.users, max_connections=args.users) as pipeline:
+                result = await run_async(pipeline, queries, args.users)
+                batcher = pipeline.batcher
+                return result, batcher.embedded / max(batcher.batches, 1)
+
+        (latencies, elapsed), batch_size = asyncio.run(run())
+        summarize("async", latencies, elapsed)
+        print(f"async path embedded {batch_size:.1f} queries per encode call on average")
+    finally:
+        server.terminate()
+
+
+if __name__ == "__main__":
+    main()
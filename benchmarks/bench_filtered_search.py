@@ -0,0 +1,107 @@
+"""
+Benchmark of metadata-filtered and namespaced LocalIndex queries: the filters evaluated by the
+index against post-filtering an over-fetched unfiltered result, the approach available before
+filters were pushed down.
+
+The corpus is split over --tenants namespaces of --documents documents each. Every chunk carries a
+"doc_id", a "page" and an "ingested_at" time. For every query shape the latency and the recall@k
+against an exact search over the matching chunks are reported, in exact and in IVF mode.
+
+Usage:
+    python benchmarks/bench_filtered_search.py --vectors 200000 --tenants 20 --documents 50
+"""
+import os
+import sys
+import time
+import argparse
+import numpy as np
+from ragqnabot import LocalIndex
+from ragqnabot.metadatafilter import matches_filter
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from bench_quantized_storage import make_vectors
+
+
+def make_metadata(i, args):
+    tenant = i % args.tenants
+    document = (i // args.tenants) % args.documents
+    return f"tenant-{tenant}", {"text": f"Chunk {i}", "doc_id": f"docs/report-{document}.pdf", "page": i % 97,
+                                "ingested_at": 1700000000 + (i % 365) * 86400}
+
+
+def truth(vectors, metadatas, namespaces, query, namespace, filter, top_k):
+    rows = np.array([row for row, metadata in enumerate(metadatas)
+                     if namespace in (None, namespaces[row]) and matches_filter(metadata, filter)], dtype=np.int64)
+    best = rows[np.argsort(-(vectors[rows] @ query), kind="stable")[:top_k]]
+    return {f"chunk-{row}" for row in best}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--vectors", type=int, default=200000, help="The number of vectors")
+    parser.add_argument("--dimension", type=int, default=384, help="The vector dimension")
+    parser.add_argument("--latent-dimension", type=int, default=48, help="The intrinsic dimension of the vectors")
+    parser.add_argument("--tenants", type=int, default=20, help="The number of namespaces")
+    parser.add_argument("--documents", type=int, default=50, help="The number of documents per tenant")
+    parser.add_argument("--queries", type=int, default=50, help="The number of timed queries per shape")
+    parser.add_argument("--top-k", type=int, default=10, help="The k of recall@k")
+    parser.add_argument("--overfetch", type=int, default=10, help="The over-fetch factor of post-filtering")
+    args = parser.parse_args()
+
+    vectors = make_vectors(args.vectors, args.dimension, args.latent_dimension, np.random.default_rng(0))
+    queries = make_vectors(args.queries, args.dimension, args.latent_dimension, np.random.default_rng(1))
+    namespaces, metadatas = zip(*(make_metadata(i, args) for i in range(args.vectors)))
+
+    # (name, namespace, filter): the post-filtering baseline searches an index holding every chunk in its default namespace,
+    # where the shapes without a namespace are pushed down as well.
+    shapes = [
+        ("pages >= 10", None, {"page": {"$gte": 10}}),
+        ("tenant", "tenant-0", None),
+        ("tenant + document", "tenant-0", {"doc_id": "docs/report-0.pdf"}),
+        ("tenant + pages", "tenant-0", {"page": {"$lt": 10}}),
+        ("tenant + recent", "tenant-0", {"ingested_at": {"$gte": 1700000000 + 300 * 86400}}),
+        ("tenant + docs + pages", "tenant-0", {"doc_id": {"$in": ["docs/report-0.pdf", "docs/report-1.pdf"]}, "page": {"$gte": 50}}),
+    ]
+    for mode in ("exact", "ivf"):
+        index = LocalIndex(dimension=args.dimension, mode=mode)
+        shared = LocalIndex(dimension=args.dimension, mode=mode)
+        for start in range(0, args.vectors, 10000):
+            end = min(start + 10000, args.vectors)
+            batch = [(f"chunk-{i}", vectors[i], {**metadatas[i], "tenant": namespaces[i]}) for i in range(start, end)]
+            shared.upsert(batch)
+            for namespace in set(namespaces[start:end]):
+                index.upsert([vector for vector in batch if vector[2]["tenant"] == namespace], namespace=namespace)
+        for _, namespace, filter in shapes:  # Trains the IVF clusters
+            (shared if namespace is None else index).query(queries[0], top_k=args.top_k, filter=filter, namespace=namespace or "")
+
+        start = time.perf_counter()
+        for query in queries:
+            shared.query(query, top_k=args.top_k)
+        print(f"{mode} mode, unfiltered: {(time.perf_counter() - start) / len(queries) * 1000:6.2f} ms")
+        for name, namespace, filter in shapes:
+            expected = [truth(vectors, metadatas, namespaces, query, namespace, filter, args.top_k) for query in queries]
+            count = sum(namespace in (None, namespaces[row]) and matches_filter(metadatas[row], filter) for row in range(args.vectors))
+            target = shared if namespace is None else index
+
+            start = time.perf_counter()
+            pushed = [{match["id"] for match in target.query(query, top_k=args.top_k, filter=filter, namespace=namespace or "")["matches"]}
+                      for query in queries]
+            pushed_ms = (time.perf_counter() - start) / len(queries) * 1000
+
+            start = time.perf_counter()
+            posted = []
+            for query in queries:
+                matches = shared.query(query, top_k=args.overfetch * args.top_k, include_metadata=True)["matches"]
+                matches = [match["id"] for match in matches
+                           if namespace in (None, match["metadata"]["tenant"]) and matches_filter(match["metadata"], filter)]
+                posted.append(set(matches[:args.top_k]))
+            posted_ms = (time.perf_counter() - start) / len(queries) * 1000
+
+            recall = lambda found: np.mean([len(a & b) / max(1, len(b)) for a, b in zip(found, expected)])
+            print(f"  {name:22s} {count:8d} chunks   pushed down {pushed_ms:6.2f} ms, recall@{args.top_k} {recall(pushed):.3f}"
+                  f"   post-filtered {posted_ms:6.2f} ms, recall@{args.top_k} {recall(posted):.3f}")
+        del index, shared
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,83 @@
+"""
+Benchmark of BM25Index on a synthetic corpus: indexing, saving, memory-mapped loading and search
+latency. Word frequencies follow a Zipf law, with common English words as the most frequent terms,
+and one chunk in a hundred mentions an identifier such as "ERR-004021" that appears nowhere else.
+Half of the queries ask about such an identifier, the other half about two ordinary terms.
+
+Usage:
+    python benchmarks/bench_lexical_search.py --chunks 1000000
+"""
+import time
+import argparse
+import tempfile
+import numpy as np
+from ragqnabot import BM25Index
+
+COMMON_WORDS = ["the", "of", "and", "to", "a", "in", "is", "for", "on", "that", "what", "does", "how", "with", "about"]
+PREFIXES = ["ERR", "SKU", "INC", "PN", "REQ"]
+
+
+def make_corpus(count, words_per_chunk, vocabulary_size, rng):
+    vocabulary = np.array(COMMON_WORDS + [f"term{i}" for i in range(vocabulary_size)])
+    ranks = np.minimum(rng.zipf(1.3, size=(count, words_per_chunk)), len(vocabulary)) - 1
+    texts = [" ".join(vocabulary[row]) for row in ranks]
+    for i in range(0, count, 100):
+        texts[i] += f" {PREFIXES[i // 100 % len(PREFIXES)]}-{i:06d}"
+    return texts, vocabulary
+
+
+def make_queries(count, vocabulary, chunks, rng):
+    queries = []
+    for i in range(count):
+        if i % 2:
+            chunk = int(rng.integers(chunks)) // 100 * 100
+            queries.append(f"What does {PREFIXES[chunk // 100 % len(PREFIXES)]}-{chunk:06d} mean?")
+        else:
+            terms = " ".join(rng.choice(vocabulary[len(COMMON_WORDS):2000], size=2))
+            queries.append(f"How is the {terms} configured in the index?")
+    return queries
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--chunks", type=int, default=1000000, help="The number of chunks")
+    parser.add_argument("--words", type=int, default=40, help="The number of words per chunk")
+    parser.add_argument("--vocabulary", type=int, default=200000, help="The number of distinct words")
+    parser.add_argument("--queries", type=int, default=200, help="The number of timed queries")
+    parser.add_argument("--top-k", type=int, default=20, help="The number of results per query")
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    texts, vocabulary = make_corpus(args.chunks, args.words, args.vocabulary, rng)
+
+    index = BM25Index()
+    start = time.perf_counter()
+    index.add((f"chunk-{i}" for i in range(args.chunks)), texts)
+    print(f"indexed {args.chunks} chunks in {time.perf_counter() - start:.1f}s")
+
+    with tempfile.TemporaryDirectory() as directory:
+        start = time.perf_counter()
+        index.save(directory)
+        print(f"saved in {time.perf_counter() - start:.2f}s")
+        del index
+
+        start = time.perf_counter()
+        index = BM25Index.load(directory)
+        print(f"loaded in {time.perf_counter() - start:.2f}s")
+
+        queries = make_queries(args.queries, vocabulary, args.chunks, rng)
+        for query in queries[:10]:  # Page in the posting lists of the common words
+            index.search(query, args.top_k)
+        latencies = []
+        for query in queries:
+            start = time.perf_counter()
+            index.search(query, args.top_k)
+            latencies.append(time.perf_counter() - start)
+
+        p50, p95, p99 = np.percentile(np.array(latencies) * 1000, [50, 95, 99])
+        print(f"search top {args.top_k}: p50 {p50:.2f} ms   p95 {p95:.2f} ms   p99 {p99:.2f} ms")
+        del index
+
+
+if __name__ == "__main__":
+    main()
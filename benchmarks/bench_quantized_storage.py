@@ -0,0 +1,94 @@
+"""
+Benchmark of the quantized LocalIndex storages against float32: memory per million chunks,
+recall@k of the approximate and of the re-scored search, and query latency.
+
+The vectors are synthetic but, like sentence embeddings, have a low intrinsic dimension: they are
+random projections of --latent-dimension dimensional points, plus a little noise, normalized.
+Every chunk carries a --text-length character text and a few metadata fields.
+
+Usage:
+    python benchmarks/bench_quantized_storage.py --vectors 200000
+"""
+import sys
+import time
+import random
+import argparse
+import numpy as np
+from ragqnabot import LocalIndex
+
+WORDS = ["invoice", "latency", "index", "vector", "refund", "cache", "deployment", "backup", "query", "token"]
+
+
+def make_vectors(count, dimension, latent_dimension, rng):
+    projection = rng.standard_normal((latent_dimension, dimension), dtype=np.float32)
+    vectors = rng.standard_normal((count, latent_dimension), dtype=np.float32) @ projection
+    vectors += 0.1 * rng.standard_normal((count, dimension), dtype=np.float32)
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+
+def make_metadata(i, text_length):
+    rng = random.Random(i)
+    text = " ".join(rng.choice(WORDS) for _ in range(text_length // 7))[:text_length]
+    return {"text": text, "start_index": i * text_length, "doc_id": f"docs/report-{i // 1000}.pdf"}
+
+
+def deep_size(value):
+    """Return the memory of a Python object and of the containers and values it holds."""
+    size = sys.getsizeof(value)
+    if isinstance(value, dict):
+        size += sum(deep_size(key) + deep_size(item) for key, item in value.items())
+    elif isinstance(value, (list, tuple)):
+        size += sum(deep_size(item) for item in value)
+    return size
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--vectors", type=int, default=200000, help="The number of vectors")
+    parser.add_argument("--dimension", type=int, default=384, help="The vector dimension")
+    parser.add_argument("--latent-dimension", type=int, default=48, help="The intrinsic dimension of the vectors")
+    parser.add_argument("--text-length", type=int, default=500, help="The number of characters per chunk text")
+    parser.add_argument("--queries", type=int, default=100, help="The number of timed queries")
+    parser.add_argument("--top-k", type=int, default=10, help="The k of recall@k")
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    vectors = make_vectors(args.vectors, args.dimension, args.latent_dimension, rng)
+    queries = make_vectors(args.queries, args.dimension, args.latent_dimension, np.random.default_rng(1))
+    per_million = 1e6 / args.vectors
+
+    # The (id, list of floats, metadata dict) tuples of VectorStore.vectors, measured on a sample
+    sample = [(f"chunk-{i}", vectors[i].tolist(), make_metadata(i, args.text_length)) for i in range(1000)]
+    payload = sum(deep_size(vector) for vector in sample) / len(sample) * 1e6
+    print(f"{'vectors payload':16s} {payload / 2**20:9.0f} MB per million chunks (Python lists and dicts)")
+
+    results = {}
+    for storage in ("float32", "float16", "int8", "pq"):
+        index = LocalIndex(dimension=args.dimension, mode="exact", storage=storage, rescore=0)
+        for start in range(0, args.vectors, 10000):
+            end = min(start + 10000, args.vectors)
+            index.upsert([(f"chunk-{i}", vectors[i], make_metadata(i, args.text_length)) for i in range(start, end)])
+        index.query(queries[0], top_k=args.top_k)  # Trains the product quantizer
+
+        usage = index.memory_usage()
+        if storage == "float32":
+            usage["metadata"] = sum(deep_size(metadata) for *_, metadata in sample) / len(sample) * args.vectors
+            usage["total"] = usage["vectors"] + usage["metadata"]
+
+        line = f"{storage:16s} {usage['total'] * per_million / 2**20:9.0f} MB per million chunks"
+        line += f" ({(usage['vectors'] + usage['codes']) * per_million / 2**20:.0f} MB vectors)"
+        for rescore in ((0,) if storage == "float32" else (0, 4, 16)):
+            index.rescore = rescore
+            start = time.perf_counter()
+            matches = [{match["id"] for match in index.query(query, top_k=args.top_k)["matches"]} for query in queries]
+            latency = (time.perf_counter() - start) / len(queries) * 1000
+            if storage == "float32":
+                results["truth"] = matches
+            recall = np.mean([len(found & truth) / args.top_k for found, truth in zip(matches, results["truth"])])
+            line += f"   rescore {rescore:2d}: recall@{args.top_k} {recall:.3f}, {latency:5.1f} ms"
+        print(line)
+        del index
+
+
+if __name__ == "__main__":
+    main()
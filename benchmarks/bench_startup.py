@@ -0,0 +1,136 @@
+"""
+Benchmark of the startup of the CLI and the Streamlit app: the import time of the package and of
+single components, and the time to the first query of a session over a document, when the
+document is ingested from scratch and when it is restored from its SessionSnapshot.
+
+Every measurement runs in a fresh Python process, so nothing is served from modules imported
+earlier; the operating system's file cache is warm after the first repetition. The heavy
+libraries each import statement pulls in are listed next to its time. The embedding model must be
+in the local model cache.
+
+Usage:
+    python benchmarks/bench_startup.py --repeat 5 --format pdf --pages 50
+"""
+import os
+import sys
+import json
+import shutil
+import random
+import argparse
+import tempfile
+import subprocess
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from bench_suite import write_pdf, write_txt
+
+IMPORTS = [
+    "import ragqnabot",
+    "from ragqnabot import LocalIndex",
+    "from ragqnabot import DocumentLoader",
+    "from ragqnabot import VectorStore",
+    "from ragqnabot import stream_answer",
+    "from ragqnabot import *",
+]
+HEAVY_MODULES = ("torch", "sentence_transformers", "pinecone", "cohere", "pandas", "pytesseract", "PyPDF2", "bs4", "docx")
+
+# Runs in the child process: times one import statement.
+IMPORT_CHILD = """
+import sys, json, time
+start = time.perf_counter()
+exec(sys.argv[1])
+elapsed = time.perf_counter() - start
+print(json.dumps({"seconds": elapsed, "modules": [name for name in sys.argv[2].split(",") if name in sys.modules]}))
+"""
+
+# Runs in the child process: a session from the first import to the answer of the first search.
+SESSION_CHILD = """
+import sys, json, time
+start = time.perf_counter()
+from ragqnabot import DocumentLoader, DocumentSplitter, SessionSnapshot, VectorStore, setup_local_index
+imported = time.perf_counter()
+store = VectorStore()
+loaded = time.perf_counter()
+path, snapshot_dir, query = sys.argv[1:4]
+splitter = DocumentSplitter()
+snapshot = SessionSnapshot(snapshot_dir)
+restored = snapshot.restore(store, path, splitter)
+if not restored:
+    store.add_texts(splitter.split_segments(DocumentLoader(path).iter_segments()), doc_id=path)
+    snapshot.save(store, path, splitter)
+ingested = time.perf_counter()
+index = setup_local_index(store.iter_vectors(), dimension=store.embeddings.shape[1])
+store.similarity_search(index, query, k=3)
+answered = time.perf_counter()
+print(json.dumps({"restored": restored, "chunks": len(store.ids), "import": imported - start, "model": loaded - imported,
+                  "ingest": ingested - loaded, "first_query": answered - ingested, "total": answered - start}))
+"""
+
+
+def run_child(code, *args):
+    """Run code in a fresh interpreter and return the JSON object it prints last."""
+    output = subprocess.run([sys.executable, "-c", code, *args], check=True, capture_output=True, text=True).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def bench_imports(repeat):
+    results = {}
+    for statement in IMPORTS:
+        runs = [run_child(IMPORT_CHILD, statement, ",".join(HEAVY_MODULES)) for _ in range(repeat)]
+        results[statement] = {"ms": float(np.median([run["seconds"] for run in runs])) * 1000, "modules": runs[-1]["modules"]}
+        print(f"{statement:40s} {results[statement]['ms']:8.1f} ms   {', '.join(results[statement]['modules']) or '-'}")
+    return results
+
+
+def bench_sessions(args, directory):
+    rng = random.Random(args.seed)
+    path = os.path.join(directory, f"document.{args.format}")
+    if args.format == "pdf":
+        write_pdf(path, rng, args.pages)
+    else:
+        write_txt(path, rng, args.paragraphs)
+    snapshot_dir = os.path.join(directory, "snapshots")
+
+    results = {}
+    for name in ("ingest", "snapshot"):
+        runs = []
+        for _ in range(args.repeat):
+            if name == "ingest":
+                shutil.rmtree(snapshot_dir, ignore_errors=True)
+            runs.append(run_child(SESSION_CHILD, path, snapshot_dir, "How do I get a refund for an invoice?"))
+            # The last ingest run leaves behind the snapshot that the snapshot runs restore
+            assert runs[-1]["restored"] == (name == "snapshot")
+        results[name] = {stage: float(np.median([run[stage] for run in runs])) * 1000
+                         for stage in ("import", "model", "ingest", "first_query", "total")}
+        results[name]["chunks"] = runs[-1]["chunks"]
+        stages = "  ".join(f"{stage} {results[name][stage]:8.1f} ms" for stage in ("import", "model", "ingest", "first_query"))
+        print(f"{name:10s} {results[name]['chunks']:6d} chunks  {stages}  time to first query {results[name]['total']:8.1f} ms")
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeat", type=int, default=5, help="The number of runs per measurement; the median is reported")
+    parser.add_argument("--format", default="pdf", choices=("pdf", "txt"), help="The format of the session's document")
+    parser.add_argument("--pages", type=int, default=50, help="The number of pages of a PDF document")
+    parser.add_argument("--paragraphs", type=int, default=1000, help="The number of paragraphs of a text document")
+    parser.add_argument("--seed", type=int, default=0, help="The random seed of the document")
+    parser.add_argument("--output", help="A file to write the results to as JSON")
+    args = parser.parse_args()
+
+    print("Import time (median of fresh processes) and the heavy libraries imported:")
+    results = {"imports": bench_imports(args.repeat)}
+    print("\nTime to first query of a session:")
+    directory = tempfile.mkdtemp(prefix="ragqnabot-startup-")
+    try:
+        results["sessions"] = bench_sessions(args, directory)
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as file:
+            json.dump(results, file, indent=2)
+
+
+if __name__ == "__main__":
+    main()
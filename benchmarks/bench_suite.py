@@ -0,0 +1,433 @@
+"""
+Benchmark suite of the ingestion and query paths on synthetic corpora, runnable offline.
+
+A corpus of text, PDF, CSV, image and scanned PDF files of configurable size is generated, then every stage
+is timed on it:
+
+    load.<format>   DocumentLoader.iter_segments, per document (images and scans go through OCR)
+    split           DocumentSplitter.split_segments, per document
+    embed           VectorStore.add_texts, per document
+    upsert          VectorStore.sync_index, per document
+    search.dense    VectorStore.similarity_search, per query
+    search.hybrid   The same in hybrid mode, with a BM25Index
+    generate        stream_answer until the last token, per query
+    first_token     The time to the first streamed token, per query
+
+For every stage the throughput, the peak RSS of the process and the p50/p95/p99 latencies are
+reported. Pinecone is replaced by a LocalIndex with a simulated round-trip latency
+(fake_pinecone.py) and Cohere by a local fake server (fake_cohere.py). The embedding model must
+be in the local model cache.
+
+The results are written as JSON, so that runs on different commits can be compared:
+
+Usage:
+    python benchmarks/bench_suite.py --documents 20 --output results/$(git rev-parse --short HEAD).json
+    python benchmarks/bench_suite.py --documents 20 --baseline results/main.json
+    python benchmarks/bench_suite.py --compare results/main.json results/feature.json
+"""
+import io
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import argparse
+import platform
+import resource
+import tempfile
+import threading
+import subprocess
+import numpy as np
+from datetime import datetime, timezone
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from fake_cohere import start_server_process
+from fake_pinecone import LatencyIndex
+from ragqnabot import BM25Index, DocumentLoader, DocumentSplitter, OCREngine, VectorStore, get_cohere_client, stream_answer, telemetry
+
+FORMATS = ("txt", "pdf", "csv", "image", "scan")
+OCR_FORMATS = ("image", "scan")
+WORDS = ["invoice", "latency", "index", "vector", "refund", "cache", "deployment", "backup", "query", "token",
+         "customer", "shipment", "warranty", "contract", "server", "region", "quota", "payment", "report", "policy"]
+COMMON_WORDS = ["the", "of", "and", "to", "a", "in", "is", "for", "on", "that", "with", "as", "by", "at", "from"]
+# Metrics where a higher value is better; for all others a lower value is better
+HIGHER_IS_BETTER = ("throughput", "mb_per_sec")
+
+
+def make_sentence(rng):
+    words = [rng.choice(COMMON_WORDS) if rng.random() < 0.4 else rng.choice(WORDS) for _ in range(rng.randint(8, 20))]
+    if rng.random() < 0.05:
+        words.append(f"ERR-{rng.randint(0, 99999):05d}")
+    return " ".join(words).capitalize() + "."
+
+
+def make_paragraphs(rng, count):
+    return [" ".join(make_sentence(rng) for _ in range(rng.randint(3, 8))) for _ in range(count)]
+
+
+def write_txt(path, rng, paragraphs):
+    with open(path, "w", encoding="utf-8") as file:
+        file.write("\n\n".join(make_paragraphs(rng, paragraphs)))
+
+
+def write_pdf(path, rng, pages, lines_per_page=50):
+    """Write a PDF with a text layer, one Helvetica line of about 90 characters per row."""
+    def escape(text):
+        return text.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)")
+
+    objects = ["<< /Type /Catalog /Pages 2 0 R >>", None, "<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>"]
+    page_ids = []
+    for _ in range(pages):
+        text = " ".join(make_paragraphs(rng, 12))
+        lines = [text[i:i + 90] for i in range(0, min(len(text), 90 * lines_per_page), 90)]
+        stream = "BT /F1 10 Tf 40 800 Td 14 TL " + " ".join(f"({escape(line)}) '" for line in lines) + " ET"
+        objects.append(f"<< /Length {len(stream)} >>\nstream\n{stream}\nendstream")
+        objects.append(f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 595 842] /Resources << /Font << /F1 3 0 R >> >> "
+                       f"/Contents {len(objects)} 0 R >>")
+        page_ids.append(len(objects))
+    objects[1] = f"<< /Type /Pages /Kids [{' '.join(f'{i} 0 R' for i in page_ids)}] /Count {len(page_ids)} >>"
+
+    output = io.BytesIO()
+    output.write(b"%PDF-1.4\n")
+    offsets = []
+    for number, body in enumerate(objects, start=1):
+        offsets.append(output.tell())
+        output.write(f"{number} 0 obj\n{body}\nendobj\n".encode("latin-1"))
+    xref = output.tell()
+    output.write(f"xref\n0 {len(objects) + 1}\n0000000000 65535 f \n".encode("latin-1"))
+    output.write("".join(f"{offset:010d} 00000 n \n" for offset in offsets).encode("latin-1"))
+    output.write(f"trailer\n<< /Size {len(objects) + 1} /Root 1 0 R >>\nstartxref\n{xref}\n%%EOF\n".encode("latin-1"))
+    with open(path, "wb") as file:
+        file.write(output.getvalue())
+
+
+def write_csv(path, rng, rows):
+    import pandas as pd
+    pd.DataFrame({
+        "id": range(rows),
+        "product": [rng.choice(WORDS) for _ in range(rows)],
+        "description": [make_sentence(rng) for _ in range(rows)],
+        "price": [round(rng.uniform(1, 500), 2) for _ in range(rows)],
+        "date": [f"2024-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d}" for _ in range(rows)],
+    }).to_csv(path, index=False)
+
+
+def render_page(rng, lines=30):
+    """Render black text on white, like a page scanned at 150 DPI."""
+    from PIL import Image, ImageDraw, ImageFont
+    image = Image.new("L", (1240, 60 + 36 * lines), color=255)
+    draw = ImageDraw.Draw(image)
+    font = ImageFont.load_default(size=24)
+    text = " ".join(make_paragraphs(rng, 6))
+    for i in range(lines):
+        draw.text((40, 30 + 36 * i), text[i * 80:(i + 1) * 80], fill=0, font=font)
+    return image
+
+
+def write_image(path, rng):
+    """Write a PNG of one page, for OCR."""
+    render_page(rng).save(path)
+
+
+def write_scan(path, rng, pages):
+    """Write a PDF of page images without a text layer, like the output of a scanner."""
+    images = [render_page(rng, lines=45) for _ in range(pages)]
+    images[0].save(path, save_all=True, append_images=images[1:], resolution=150)
+
+
+def make_corpus(directory, args):
+    """Generate the corpus and return its files per format."""
+    rng = random.Random(args.seed)
+    writers = {
+        "txt": (".txt", lambda path: write_txt(path, rng, args.paragraphs)),
+        "pdf": (".pdf", lambda path: write_pdf(path, rng, args.pages)),
+        "csv": (".csv", lambda path: write_csv(path, rng, args.rows)),
+        "image": (".png", lambda path: write_image(path, rng)),
+        "scan": (".pdf", lambda path: write_scan(path, rng, args.scan_pages)),
+    }
+    corpus = {}
+    for name in args.formats:
+        extension, write = writers[name]
+        count = args.images if name in OCR_FORMATS else args.documents
+        corpus[name] = [os.path.join(directory, f"{name}-{i:04d}{extension}") for i in range(count)]
+        for path in corpus[name]:
+            write(path)
+    return corpus
+
+
+def make_queries(count, seed):
+    rng = random.Random(seed + 1)
+    queries = []
+    for i in range(count):
+        if i % 4 == 3:
+            queries.append(f"What does ERR-{rng.randint(0, 99999):05d} mean?")
+        else:
+            queries.append(f"What is the {rng.choice(WORDS)} policy for {rng.choice(WORDS)} in the {rng.choice(WORDS)} report?")
+    return queries
+
+
+def current_rss():
+    """Return the resident set size of the process in bytes."""
+    try:
+        with open("/proc/self/statm") as file:
+            return int(file.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except OSError:
+        # No /proc, e.g. on macOS: fall back to the peak of the whole process.
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if sys.platform == "darwin" else peak * 1024
+
+
+class Stage:
+    """
+    Measures one stage: the latency of every item, the total time, and the peak RSS, sampled by a
+    background thread every few milliseconds while the stage runs.
+    """
+
+    def __init__(self, name, unit, interval=0.005):
+        self.name = name
+        self.unit = unit
+        self.interval = interval
+        self.latencies = []
+        self.items = 0
+        self.bytes = 0
+        self.seconds = 0.0
+        self.peak_rss = 0
+        self._stop = threading.Event()
+        self._thread = None
+
+    def __enter__(self):
+        self.peak_rss = current_rss()
+        self._thread = threading.Thread(target=self._sample, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._stop.set()
+        self._thread.join()
+        self.peak_rss = max(self.peak_rss, current_rss())
+        return False
+
+    def time(self, function, *args, items=1, size=0, **kwargs):
+        """Call a function, recording its latency as one sample, and return its result."""
+        start = time.perf_counter()
+        result = function(*args, **kwargs)
+        self.add(time.perf_counter() - start, items, size)
+        return result
+
+    def add(self, seconds, items=1, size=0):
+        """Record the latency of one sample that processed the given number of items and bytes."""
+        self.latencies.append(seconds)
+        self.seconds += seconds
+        self.items += items
+        self.bytes += size
+
+    def _sample(self):
+        while not self._stop.wait(self.interval):
+            self.peak_rss = max(self.peak_rss, current_rss())
+
+    def result(self):
+        p50, p95, p99 = np.percentile(np.array(self.latencies) * 1000, [50, 95, 99]) if self.latencies else (None,) * 3
+        result = {
+            "unit": self.unit,
+            "samples": len(self.latencies),
+            "items": self.items,
+            "seconds": self.seconds,
+            "throughput": self.items / self.seconds if self.seconds else None,
+            "p50_ms": p50,
+            "p95_ms": p95,
+            "p99_ms": p99,
+            "peak_rss_mb": self.peak_rss / 2**20,
+        }
+        if self.bytes:
+            result["mb_per_sec"] = self.bytes / 2**20 / self.seconds
+        return result
+
+
+def print_stage(name, result):
+    throughput = f"{result['throughput']:10.1f} {result['unit']}/s" if result["throughput"] else " " * 10
+    line = f"{name:14s} {throughput:24s}"
+    if result["p50_ms"] is not None:
+        line += f"  p50 {result['p50_ms']:8.1f} ms  p95 {result['p95_ms']:8.1f} ms  p99 {result['p99_ms']:8.1f} ms"
+    print(f"{line}  peak RSS {result['peak_rss_mb']:7.0f} MB")
+
+
+def git_commit():
+    """Return the current commit and whether the tree has uncommitted changes, or (None, None) outside git."""
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    try:
+        commit = subprocess.run(["git", "rev-parse", "HEAD"], cwd=root, capture_output=True, text=True, check=True).stdout.strip()
+        dirty = bool(subprocess.run(["git", "status", "--porcelain", "--untracked-files=no"], cwd=root,
+                                    capture_output=True, text=True, check=True).stdout.strip())
+        return commit, dirty
+    except (OSError, subprocess.CalledProcessError):
+        return None, None
+
+
+def run(args):
+    stages = {}
+    skipped = {}
+    if shutil.which("tesseract") is None:
+        for name in set(OCR_FORMATS).intersection(args.formats):
+            skipped[f"load.{name}"] = "tesseract is not installed"
+        args.formats = [name for name in args.formats if name not in OCR_FORMATS]
+
+    # Start the server before the model is loaded, so the child process stays small.
+    server, base_url = start_server_process(token_delay=args.token_delay)
+    directory = tempfile.mkdtemp(prefix="ragqnabot-bench-")
+    try:
+        corpus = make_corpus(directory, args)
+        corpus_stats = {name: {"documents": len(paths), "bytes": sum(os.path.getsize(path) for path in paths)}
+                        for name, paths in corpus.items()}
+
+        telemetry.enable()
+        segments = {}
+        # Without a cache, so every run measures the OCR itself.
+        ocr = OCREngine(cache=None)
+        for name, paths in corpus.items():
+            with Stage(f"load.{name}", "documents") as stage:
+                for path in paths:
+                    segments[path] = stage.time(lambda: list(DocumentLoader(path, ocr=ocr).iter_segments()), size=os.path.getsize(path))
+            stages[stage.name] = stage.result()
+            print_stage(stage.name, stages[stage.name])
+        ocr.close()
+
+        splitter = DocumentSplitter(chunk_size=args.chunk_size, overlap=args.chunk_size // 5, mode=args.split_mode)
+        chunks = {}
+        with Stage("split", "chunks") as stage:
+            for path, document in segments.items():
+                size = sum(len(segment["text"].encode("utf-8")) for segment in document)
+                chunks[path] = stage.time(lambda: list(splitter.split_segments(document)), items=0, size=size)
+                stage.items += len(chunks[path])
+        stages[stage.name] = stage.result()
+        print_stage(stage.name, stages[stage.name])
+
+        vectorstore = VectorStore(lexical_index=BM25Index())
+        vectorstore.model.encode(["warm up"])
+        with Stage("embed", "chunks") as stage:
+            for path, document in chunks.items():
+                stage.time(vectorstore.add_texts, document, items=len(document), doc_id=path)
+        stages[stage.name] = stage.result()
+        print_stage(stage.name, stages[stage.name])
+
+        index = LatencyIndex(args.index_latency / 1000, dimension=vectorstore.embeddings.shape[1])
+        with Stage("upsert", "chunks") as stage:
+            for path, document in chunks.items():
+                stage.time(vectorstore.sync_index, index, items=len(document), doc_id=path)
+        stages[stage.name] = stage.result()
+        print_stage(stage.name, stages[stage.name])
+
+        queries = make_queries(args.queries, args.seed)
+        results = {}
+        for mode in ("dense", "hybrid"):
+            with Stage(f"search.{mode}", "queries") as stage:
+                for query in queries:
+                    results[query] = stage.time(vectorstore.similarity_search, index, query, k=args.top_k, mode=mode)
+            stages[stage.name] = stage.result()
+            print_stage(stage.name, stages[stage.name])
+
+        client = get_cohere_client("fake", base_url=base_url)
+        with Stage("generate", "queries") as generate, Stage("first_token", "queries") as first_token:
+            for query in queries:
+                start = time.perf_counter()
+                pieces = stream_answer(query, results[query], client=client)
+                first_token.time(next, pieces)
+                for _ in pieces:
+                    pass
+                generate.add(time.perf_counter() - start)
+        for stage in (generate, first_token):
+            stages[stage.name] = stage.result()
+            print_stage(stage.name, stages[stage.name])
+    finally:
+        server.terminate()
+        shutil.rmtree(directory, ignore_errors=True)
+
+    commit, dirty = git_commit()
+    return {
+        "meta": {
+            "commit": commit,
+            "dirty": dirty,
+            "timestamp": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+            "args": vars(args),
+        },
+        "corpus": corpus_stats,
+        "stages": stages,
+        "skipped": skipped,
+        "spans": telemetry.stats(),
+    }
+
+
+def compare(baseline, results, threshold):
+    """Print the change of every stage metric against a baseline, and return the regressions beyond the threshold."""
+    regressions = []
+    print(f"{'stage':14s} {'metric':12s} {'baseline':>12s} {'current':>12s} {'change':>8s}")
+    for name, stage in results["stages"].items():
+        old = baseline["stages"].get(name)
+        if old is None:
+            continue
+        for metric in ("throughput", "mb_per_sec", "p50_ms", "p95_ms", "p99_ms", "peak_rss_mb"):
+            if old.get(metric) is None or stage.get(metric) is None or not old[metric]:
+                continue
+            change = stage[metric] / old[metric] - 1
+            worse = -change if metric in HIGHER_IS_BETTER else change
+            flag = ""
+            # Tail latencies are noisy, so only the median and the throughput count as regressions.
+            if worse > threshold and metric in ("throughput", "mb_per_sec", "p50_ms"):
+                regressions.append((name, metric, change))
+                flag = "  REGRESSION"
+            print(f"{name:14s} {metric:12s} {old[metric]:12.2f} {stage[metric]:12.2f} {change:+8.1%}{flag}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--documents", type=int, default=10, help="The number of documents per format")
+    parser.add_argument("--images", type=int, default=5, help="The number of images and of scanned PDFs, which are slow to OCR")
+    parser.add_argument("--formats", default=",".join(FORMATS), help="The comma-separated formats of the corpus")
+    parser.add_argument("--paragraphs", type=int, default=200, help="The number of paragraphs per text document")
+    parser.add_argument("--pages", type=int, default=10, help="The number of pages per PDF")
+    parser.add_argument("--scan-pages", type=int, default=4, help="The number of pages per scanned PDF")
+    parser.add_argument("--rows", type=int, default=2000, help="The number of rows per CSV file")
+    parser.add_argument("--split-mode", default="characters", choices=("characters", "tokens"), help="The DocumentSplitter mode")
+    parser.add_argument("--chunk-size", type=int, default=1000, help="The chunk size in characters mode")
+    parser.add_argument("--queries", type=int, default=100, help="The number of queries")
+    parser.add_argument("--top-k", type=int, default=3, help="The number of chunks retrieved per query")
+    parser.add_argument("--index-latency", type=float, default=20, help="The simulated index round trip in ms")
+    parser.add_argument("--token-delay", type=float, default=0.005, help="The delay in seconds between two generated words")
+    parser.add_argument("--seed", type=int, default=0, help="The random seed of the corpus and the queries")
+    parser.add_argument("--output", help="A file to write the results to as JSON")
+    parser.add_argument("--baseline", help="A results file to compare this run to")
+    parser.add_argument("--compare", nargs=2, metavar=("BASELINE", "RESULTS"), help="Compare two results files without running")
+    parser.add_argument("--threshold", type=float, default=0.2,
+                        help="The relative slowdown of the throughput or median latency reported as a regression")
+    args = parser.parse_args()
+
+    if args.compare:
+        with open(args.compare[0], encoding="utf-8") as baseline_file, open(args.compare[1], encoding="utf-8") as results_file:
+            baseline, results = json.load(baseline_file), json.load(results_file)
+        sys.exit(1 if compare(baseline, results, args.threshold) else 0)
+
+    args.formats = [name.strip() for name in args.formats.split(",") if name.strip()]
+    unknown = set(args.formats).difference(FORMATS)
+    if unknown:
+        parser.error(f"unknown formats: {', '.join(sorted(unknown))}")
+
+    results = run(args)
+    for name, reason in results["skipped"].items():
+        print(f"{name:14s} skipped: {reason}")
+    if args.output:
+        os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+        with open(args.output, "w", encoding="utf-8") as file:
+            json.dump(results, file, indent=2)
+        print(f"Results written to {args.output}")
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as file:
+            baseline = json.load(file)
+        sys.exit(1 if compare(baseline, results, args.threshold) else 0)
+
+
+if __name__ == "__main__":
+    main()
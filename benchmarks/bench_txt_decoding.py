@@ -0,0 +1,68 @@
+"""
+Benchmark of DocumentLoader._load_txt against the previous implementation, which ran chardet
+over the whole file and then read it a second time.
+
+Usage:
+    python benchmarks/bench_txt_decoding.py --size-mb 50
+"""
+import os
+import time
+import random
+import argparse
+import tempfile
+import chardet
+from ragqnabot.datalaoder import DocumentLoader
+
+WORDS = ["error", "warning", "request", "latency", "index", "vector", "chunk", "query", "token", "answer"]
+
+
+def legacy_load_txt(path):
+    """The previous _load_txt: chardet over every byte, then a second full read."""
+    with open(path, 'rb') as file:
+        raw_data = file.read()
+        encoding = chardet.detect(raw_data)['encoding']
+    with open(path, 'r', encoding=encoding) as file:
+        return file.read()
+
+
+def write_corpus(path, size_bytes, non_ascii):
+    """Write a log-like corpus of about size_bytes bytes, optionally sprinkled with non-ASCII words."""
+    rng = random.Random(0)
+    words = WORDS + (["größe", "café", "naïve", "日本語"] if non_ascii else [])
+    with open(path, 'w', encoding='utf-8') as file:
+        written = 0
+        while written < size_bytes:
+            line = " ".join(rng.choice(words) for _ in range(12)) + "\n"
+            file.write(line)
+            written += len(line.encode('utf-8'))
+
+
+def best_of(function, path, repeat):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function(path)
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--size-mb", type=float, default=20, help="The corpus size in MB")
+    parser.add_argument("--repeat", type=int, default=3, help="The number of runs; the best one is reported")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        for name, non_ascii in (("ascii", False), ("utf-8", True)):
+            path = os.path.join(directory, f"{name}.txt")
+            write_corpus(path, int(args.size_mb * 1024 * 1024), non_ascii)
+
+            loader = DocumentLoader(path)
+            assert loader._load_txt() == legacy_load_txt(path)
+            legacy = best_of(legacy_load_txt, path, args.repeat)
+            current = best_of(lambda _: loader._load_txt(), path, args.repeat)
+            print(f"{name:>6} {args.size_mb:.0f} MB: legacy {legacy:.3f}s, current {current:.3f}s, speed-up {legacy / current:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,134 @@
+"""
+A local fake of the Cohere v2 chat API, for testing and benchmarking answer generation offline.
+
+The server answers POST /v2/chat with a fixed answer, emitting one word every --token-delay
+seconds. Streaming requests receive server-sent events as the real API sends them, so
+stream_answer can be tested end to end:
+
+    python benchmarks/fake_cohere.py --port 8765
+    COHERE_BASE_URL=http://127.0.0.1:8765 COHERE_API_KEY=fake python scripts/main.py
+"""
+import json
+import time
+import argparse
+import threading
+import multiprocessing
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+ANSWER = ("The document states that the retrieval pipeline embeds every chunk once, caches the "
+          "embeddings on disk and only upserts the chunks that changed since the last run.")
+
+
+class FakeCohereHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    answer = ANSWER
+    token_delay = 0.02
+
+    def do_POST(self):
+        try:
+            self._handle_chat()
+        except (BrokenPipeError, ConnectionResetError):
+            pass  # The client gave up, e.g. after a timeout
+
+    def _handle_chat(self):
+        body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+        if self.path.rstrip("/") != "/v2/chat":
+            self._send_json(404, {"message": f"Unknown path {self.path}"})
+        elif body.get("stream"):
+            self._stream()
+        else:
+            time.sleep(self.token_delay * len(self.answer.split()))
+            self._send_json(200, {
+                "id": "fake",
+                "finish_reason": "COMPLETE",
+                "message": {"role": "assistant", "content": [{"type": "text", "text": self.answer}]},
+            })
+
+    def _stream(self):
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        self._send_event({"type": "message-start", "id": "fake", "delta": {"message": {"role": "assistant"}}})
+        self._send_event({"type": "content-start", "index": 0, "delta": {"message": {"content": {"type": "text", "text": ""}}}})
+        words = self.answer.split(" ")
+        for i, word in enumerate(words):
+            time.sleep(self.token_delay)
+            text = word if i == 0 else " " + word
+            self._send_event({"type": "content-delta", "index": 0, "delta": {"message": {"content": {"text": text}}}})
+        self._send_event({"type": "content-end", "index": 0})
+        self._send_event({"type": "message-end", "delta": {"finish_reason": "COMPLETE"}})
+        self.wfile.write(b"0\r\n\r\n")
+        self.wfile.flush()
+
+    def _send_event(self, event):
+        data = f"event: {event['type']}\ndata: {json.dumps(event)}\n\n".encode("utf-8")
+        self.wfile.write(f"{len(data):x}\r\n".encode("ascii") + data + b"\r\n")
+        self.wfile.flush()
+
+    def _send_json(self, status, payload):
+        data = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class FakeCohereServer(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 1024
+
+
+def start_server(port=0, token_delay=0.02, answer=ANSWER):
+    """
+    Start the fake server in a background thread.
+
+    Returns:
+        Tuple[FakeCohereServer, str]: The server, to be shut down by the caller, and its base URL.
+    """
+    handler = type("Handler", (FakeCohereHandler,), {"token_delay": token_delay, "answer": answer})
+    server = FakeCohereServer(("127.0.0.1", port), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}"
+
+
+def _serve(port, token_delay, answer, ready):
+    server, base_url = start_server(port, token_delay, answer)
+    ready.send(base_url)
+    threading.Event().wait()
+
+
+def start_server_process(port=0, token_delay=0.02, answer=ANSWER):
+    """
+    Start the fake server in a child process, so that it does not compete for the GIL with the
+    client being benchmarked.
+
+    Returns:
+        Tuple[multiprocessing.Process, str]: The process, to be terminated by the caller, and the base URL.
+    """
+    receiver, sender = multiprocessing.Pipe(duplex=False)
+    process = multiprocessing.Process(target=_serve, args=(port, token_delay, answer, sender), daemon=True)
+    process.start()
+    return process, receiver.recv()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--port", type=int, default=8765, help="The port to listen on")
+    parser.add_argument("--token-delay", type=float, default=0.02, help="The delay in seconds between two words")
+    args = parser.parse_args()
+
+    server, base_url = start_server(args.port, args.token_delay)
+    print(f"Fake Cohere API listening on {base_url}")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,30 @@
+"""
+A local stand-in for a Pinecone index: a LocalIndex that sleeps on every request, like a network
+round trip, so that benchmarks exercise the index path without a Pinecone account.
+"""
+import time
+from ragqnabot import LocalIndex
+
+
+class LatencyIndex(LocalIndex):
+    """A LocalIndex that sleeps on every request, standing in for a remote Pinecone index."""
+
+    def __init__(self, latency, **kwargs):
+        super().__init__(**kwargs)
+        self.latency = latency
+
+    def upsert(self, *args, **kwargs):
+        time.sleep(self.latency)
+        return super().upsert(*args, **kwargs)
+
+    def query(self, *args, **kwargs):
+        time.sleep(self.latency)
+        return super().query(*args, **kwargs)
+
+    def fetch(self, *args, **kwargs):
+        time.sleep(self.latency)
+        return super().fetch(*args, **kwargs)
+
+    def delete(self, *args, **kwargs):
+        time.sleep(self.latency)
+        return super().delete(*args, **kwargs)
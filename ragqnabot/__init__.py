@@ -1,5 +1,62 @@
-from .answergen import generate_answer
-from .datalaoder import DocumentLoader
-from .datasplitter import DocumentSplitter
-from .vectorstore import VectorStore
-from .helpers import setup_pinecone, list_indexes
\ No newline at end of file
+import importlib
+from typing import TYPE_CHECKING
+from .telemetry import Telemetry, telemetry, profile
+
+# The public names and the submodules defining them. A submodule is only imported when one of its
+# names is first accessed, so `from ragqnabot import LocalIndex` does not import the document
+# loaders or the Cohere client. The telemetry module is imported eagerly: its `telemetry` object
+# shares the name of the module.
+_EXPORTS = {
+    "answergen": ["generate_answer", "stream_answer", "get_cohere_client", "agenerate_answer", "astream_answer", "create_async_cohere_client"],
+    "datalaoder": ["DocumentLoader"],
+    "ocr": ["OCREngine", "OCRCache", "preprocess_image"],
+    "bulkloader": ["BulkLoader"],
+    "datasplitter": ["DocumentSplitter"],
+    "vectorstore": ["VectorStore"],
+    "helpers": ["setup_pinecone", "setup_local_index", "upsert_vectors", "get_pinecone_client", "get_index", "list_indexes"],
+    "modelregistry": ["ModelRegistry", "get_model", "warm_up_model", "evict_model"],
+    "localindex": ["BaseIndex", "LocalIndex"],
+    "metadatafilter": ["MetadataIndex", "matches_filter"],
+    "quantization": ["ScalarQuantizer", "ProductQuantizer", "StringTable", "MetadataTable"],
+    "lexicalindex": ["BM25Index"],
+    "embeddingcache": ["EmbeddingCache"],
+    "answercache": ["SemanticAnswerCache"],
+    "asyncpipeline": ["AsyncQueryPipeline", "EmbeddingBatcher"],
+    "contextbuilder": ["ContextBuilder"],
+    "reranker": ["CrossEncoderReranker"],
+    "snapshot": ["SessionSnapshot"],
+}
+_MODULES = {name: module for module, names in _EXPORTS.items() for name in names}
+
+__all__ = [*_MODULES, "Telemetry", "telemetry", "profile"]
+
+def __getattr__(name):
+    module = _MODULES.get(name)
+    if module is None:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    value = getattr(importlib.import_module(f".{module}", __name__), name)
+    globals()[name] = value
+    return value
+
+def __dir__():
+    return sorted(set(globals()).union(__all__))
+
+if TYPE_CHECKING:
+    from .answergen import generate_answer, stream_answer, get_cohere_client, agenerate_answer, astream_answer, create_async_cohere_client
+    from .datalaoder import DocumentLoader
+    from .ocr import OCREngine, OCRCache, preprocess_image
+    from .bulkloader import BulkLoader
+    from .datasplitter import DocumentSplitter
+    from .vectorstore import VectorStore
+    from .helpers import setup_pinecone, setup_local_index, upsert_vectors, get_pinecone_client, get_index, list_indexes
+    from .modelregistry import ModelRegistry, get_model, warm_up_model, evict_model
+    from .localindex import BaseIndex, LocalIndex
+    from .metadatafilter import MetadataIndex, matches_filter
+    from .quantization import ScalarQuantizer, ProductQuantizer, StringTable, MetadataTable
+    from .lexicalindex import BM25Index
+    from .embeddingcache import EmbeddingCache
+    from .answercache import SemanticAnswerCache
+    from .asyncpipeline import AsyncQueryPipeline, EmbeddingBatcher
+    from .contextbuilder import ContextBuilder
+    from .reranker import CrossEncoderReranker
+    from .snapshot import SessionSnapshot
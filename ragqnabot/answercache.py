@@ -0,0 +1,204 @@
+import time
+import threading
+import numpy as np
+from collections import OrderedDict
+from ragqnabot.modelregistry import get_model
+from ragqnabot.telemetry import telemetry
+from typing import Any, Dict, List, Optional
+
+class SemanticAnswerCache:
+    """
+    An in-memory cache of generated answers, looked up by the similarity of the query embeddings.
+
+    A question that is close enough to one answered before, in the same scope (typically the index
+    name), is served from the cache without searching the index or calling the LLM. Entries expire
+    after a time to live, the least recently used entries are evicted beyond max_entries, and a
+    scope is invalidated when its index is re-ingested.
+    """
+
+    def __init__(self, threshold: float = 0.9, ttl: Optional[float] = 3600, max_entries: int = 1000,
+                 embedding_model_name: str = 'all-MiniLM-L6-v2', device: Optional[str] = None):
+        """
+        Initialize the SemanticAnswerCache.
+
+        Args:
+            threshold (float): The minimum cosine similarity between two queries for a cache hit. Default is 0.9.
+            ttl (Optional[float]): The time to live of an entry in seconds. None keeps entries until evicted. Default is 3600.
+            max_entries (int): The maximum number of entries over all scopes. Default is 1000.
+            embedding_model_name (str): The sentence transformer model used to embed queries. Default is 'all-MiniLM-L6-v2'.
+            device (Optional[str]): The device to run the model on. None lets SentenceTransformer pick one.
+        """
+        self.threshold = threshold
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.model = get_model(embedding_model_name, device)
+        self._dimension = self.model.get_sentence_embedding_dimension()
+        self._lock = threading.Lock()
+        self._scopes: Dict[str, Dict[str, Any]] = {}
+        self._lru = OrderedDict()  # (scope, slot) -> None, least recently used first
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+
+    def embed(self, query: str) -> np.ndarray:
+        """
+        Embed a query. The embedding can be passed to lookup, store and VectorStore.similarity_search
+        so that a query is only encoded once.
+
+        Args:
+            query (str): The query.
+
+        Returns:
+            np.ndarray: The float32 query embedding.
+        """
+        with telemetry.span("embed.query"):
+            return np.asarray(self.model.encode(query), dtype=np.float32)
+
+    def lookup(self, scope: str, query: str, embedding: Optional[np.ndarray] = None) -> Optional[Dict[str, Any]]:
+        """
+        Look up the answer to the most similar past query in a scope.
+
+        Args:
+            scope (str): The cache scope, e.g. the index name.
+            query (str): The query.
+            embedding (Optional[np.ndarray]): The query embedding, if already computed.
+
+        Returns:
+            Optional[Dict[str, Any]]: On a hit, {"query", "answer", "sources", "similarity", "created_at"}
+            where "query" is the cached query; None on a miss.
+        """
+        if embedding is None:
+            embedding = self.embed(query)
+        vector = self._normalize(embedding)
+
+        with self._lock:
+            entries = self._scopes.get(scope)
+            if entries is None or not entries["alive"].any():
+                self.misses += 1
+                return None
+
+            self._expire(scope, entries)
+            size = entries["size"]
+            similarities = entries["matrix"][:size] @ vector
+            similarities[~entries["alive"][:size]] = -np.inf
+            slot = int(np.argmax(similarities)) if size else 0
+            if not size or similarities[slot] < self.threshold:
+                self.misses += 1
+                return None
+
+            self.hits += 1
+            self._lru.move_to_end((scope, slot))
+            return {**entries["entries"][slot], "similarity": float(similarities[slot])}
+
+    def store(self, scope: str, query: str, answer: Any, embedding: Optional[np.ndarray] = None,
+              sources: Optional[List[Dict[str, Any]]] = None) -> None:
+        """
+        Store the answer to a query.
+
+        Args:
+            scope (str): The cache scope, e.g. the index name.
+            query (str): The query.
+            answer (Any): The generated answer.
+            embedding (Optional[np.ndarray]): The query embedding, if already computed.
+            sources (Optional[List[Dict[str, Any]]]): The retrieved chunks the answer was generated from.
+        """
+        if embedding is None:
+            embedding = self.embed(query)
+        vector = self._normalize(embedding)
+
+        with self._lock:
+            entries = self._scopes.get(scope)
+            if entries is None:
+                entries = {"matrix": np.empty((16, self._dimension), dtype=np.float32), "alive": np.zeros(16, dtype=bool),
+                           "entries": [None] * 16, "free": [], "size": 0}
+                self._scopes[scope] = entries
+
+            if entries["free"]:
+                slot = entries["free"].pop()
+            else:
+                slot = entries["size"]
+                if slot == len(entries["matrix"]):
+                    self._grow(entries)
+                entries["size"] += 1
+
+            entries["matrix"][slot] = vector
+            entries["alive"][slot] = True
+            entries["entries"][slot] = {"query": query, "answer": answer, "sources": sources or [], "created_at": time.time()}
+            self._lru[(scope, slot)] = None
+
+            while len(self._lru) > self.max_entries:
+                (old_scope, old_slot), _ = self._lru.popitem(last=False)
+                self._remove(old_scope, old_slot)
+                self.evictions += 1
+
+    def invalidate(self, scope: Optional[str] = None) -> None:
+        """
+        Drop the cached answers of a scope, e.g. after its index has been re-ingested.
+
+        Args:
+            scope (Optional[str]): The scope to drop. None drops every scope.
+        """
+        with self._lock:
+            scopes = list(self._scopes) if scope is None else [scope]
+            for name in scopes:
+                if self._scopes.pop(name, None) is not None:
+                    self.invalidations += 1
+            self._lru = OrderedDict((key, None) for key in self._lru if key[0] in self._scopes)
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Return the cache metrics.
+
+        Returns:
+            Dict[str, Any]: The number of "entries", "hits", "misses", "evictions", "expirations" and
+            "invalidations", and the "hit_rate".
+        """
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._lru),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+                "invalidations": self.invalidations,
+            }
+
+    def _expire(self, scope: str, entries: Dict[str, Any]) -> None:
+        """Remove the expired entries of a scope. The caller holds the lock."""
+        if self.ttl is None:
+            return
+        deadline = time.time() - self.ttl
+        for slot in np.flatnonzero(entries["alive"][:entries["size"]]):
+            if entries["entries"][slot]["created_at"] < deadline:
+                self._lru.pop((scope, int(slot)), None)
+                self._remove(scope, int(slot))
+                self.expirations += 1
+
+    def _remove(self, scope: str, slot: int) -> None:
+        """Free a slot of a scope. The caller holds the lock and has removed the slot from the LRU."""
+        entries = self._scopes[scope]
+        entries["alive"][slot] = False
+        entries["entries"][slot] = None
+        entries["free"].append(slot)
+
+    @staticmethod
+    def _grow(entries: Dict[str, Any]) -> None:
+        """Double the capacity of a scope."""
+        capacity = 2 * len(entries["matrix"])
+        matrix = np.empty((capacity, entries["matrix"].shape[1]), dtype=np.float32)
+        matrix[:len(entries["matrix"])] = entries["matrix"]
+        alive = np.zeros(capacity, dtype=bool)
+        alive[:len(entries["alive"])] = entries["alive"]
+        entries["matrix"], entries["alive"] = matrix, alive
+        entries["entries"].extend([None] * (capacity - len(entries["entries"])))
+
+    @staticmethod
+    def _normalize(embedding: np.ndarray) -> np.ndarray:
+        """Scale an embedding to unit length, so that dot products are cosine similarities."""
+        vector = np.asarray(embedding, dtype=np.float32).ravel()
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm > 0 else vector
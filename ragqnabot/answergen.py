@@ -1,32 +1,210 @@
-import cohere
-from typing import List, Dict
-from ragqnabot.configs import COHERE_API_KEY
+import time
+import threading
+from typing import TYPE_CHECKING, AsyncIterator, Iterator, List, Dict, Optional, Tuple, Union
+from ragqnabot.configs import COHERE_API_KEY, COHERE_BASE_URL
+from ragqnabot.telemetry import telemetry
 
-def generate_answer(query: str, retrieved_docs: List[Dict[str, str]], cohere_api: str = COHERE_API_KEY) -> str:
+# The Cohere SDK takes about two seconds to import, so it is only imported when the first client is created.
+if TYPE_CHECKING:
+    import cohere
+    import httpx
+
+CHAT_MODEL = "command-r-plus"
+ERROR_MESSAGE = "An error occurred while generating the answer"
+SYSTEM_PROMPT = "You are a helpful AI assistant that provides concise answers based on the provided context. Respond with only the answer to the question, without adding any extra explanation or text."
+
+_clients = {}
+_lock = threading.Lock()
+
+class ErrorMessage(str):
+    """
+    The error message returned, or yielded by the streaming functions, when generation fails.
+
+    A stream that fails part way has already yielded the first pieces of the answer, so the text as a
+    whole does not start with ERROR_MESSAGE: test the pieces with isinstance(piece, ErrorMessage).
+    """
+
+def get_cohere_client(cohere_api: str = COHERE_API_KEY, base_url: Optional[str] = COHERE_BASE_URL, max_connections: int = 10,
+                      timeout: float = 300) -> "cohere.ClientV2":
+    """
+    Return a Cohere client for the given API key and base URL, reusing the one created by an earlier call.
+
+    The client keeps a pool of HTTP connections alive, so consecutive questions skip the TCP and TLS
+    handshakes.
+
+    Args:
+        cohere_api (str): The API key for Cohere.
+        base_url (Optional[str]): The base URL of the Cohere API, e.g. a local fake server for testing.
+                                  Defaults to COHERE_BASE_URL, or the public API if that is unset.
+        max_connections (int): The size of the connection pool of a newly created client. Default is 10.
+        timeout (float): The request timeout in seconds of a newly created client. Default is 300.
+
+    Returns:
+        cohere.ClientV2: The shared Cohere client.
+    """
+    key = (cohere_api, base_url)
+    with _lock:
+        client = _clients.get(key)
+        if client is None:
+            import cohere
+            import httpx
+            http_client = httpx.Client(limits=httpx.Limits(max_connections=max_connections,
+                                                           max_keepalive_connections=max_connections), timeout=timeout)
+            kwargs = {"base_url": base_url} if base_url else {}
+            client = cohere.ClientV2(cohere_api, httpx_client=http_client, timeout=timeout, **kwargs)
+            _clients[key] = client
+        return client
+
+def create_async_cohere_client(cohere_api: str = COHERE_API_KEY, base_url: Optional[str] = COHERE_BASE_URL,
+                               http_client: Optional["httpx.AsyncClient"] = None, timeout: float = 300) -> "cohere.AsyncClientV2":
+    """
+    Create an asyncio Cohere client.
+
+    Unlike get_cohere_client, the client is not shared: its connections belong to the event loop
+    they are opened in, so every event loop needs its own client.
+
+    Args:
+        cohere_api (str): The API key for Cohere.
+        base_url (Optional[str]): The base URL of the Cohere API, e.g. a local fake server for testing.
+                                  Defaults to COHERE_BASE_URL, or the public API if that is unset.
+        http_client (Optional[httpx.AsyncClient]): The HTTP client holding the connection pool. The caller
+                                                   closes it with `await http_client.aclose()` when done.
+        timeout (float): The request timeout in seconds. Default is 300.
+
+    Returns:
+        cohere.AsyncClientV2: The new Cohere client.
+    """
+    import cohere
+    kwargs = {"base_url": base_url} if base_url else {}
+    return cohere.AsyncClientV2(cohere_api, httpx_client=http_client, timeout=timeout, **kwargs)
+
+def generate_answer(query: str, retrieved_docs: List[Union[Dict[str, str], Tuple[Dict[str, str], float]]], cohere_api: str = COHERE_API_KEY,
+                    client: Optional["cohere.ClientV2"] = None) -> str:
     """
     Generate an answer based on the query and retrieved documents.
 
     Args:
         query (str): The user's question.
-        retrieved_docs (List[Dict[str, str]]): A list of retrieved relevant documents.
+        retrieved_docs (List[Union[Dict[str, str], Tuple[Dict[str, str], float]]]): A list of retrieved relevant
+            documents, either as dicts or as the (document, score) tuples returned by `VectorStore.similarity_search`.
+        cohere_api (str): The API key for Cohere.
+        client (Optional[cohere.ClientV2]): The Cohere client to use. Defaults to the shared client for cohere_api.
+
+    Returns:
+        str: The generated answer, or an ErrorMessage if generation fails.
+    """
+    with telemetry.span("generate", model=CHAT_MODEL) as span:
+        try:
+            co = client or get_cohere_client(cohere_api)
+            response = co.chat(
+                model=CHAT_MODEL,
+                messages=_build_messages(query, retrieved_docs)
+            )
+
+            return response.message.content
+
+        except Exception as e:
+            span.record_exception(e)
+            return ErrorMessage(f"{ERROR_MESSAGE}: {str(e)}")
+
+def stream_answer(query: str, retrieved_docs: List[Union[Dict[str, str], Tuple[Dict[str, str], float]]], cohere_api: str = COHERE_API_KEY,
+                  client: Optional["cohere.ClientV2"] = None) -> Iterator[str]:
+    """
+    Generate an answer based on the query and retrieved documents, yielding the text as it arrives.
+
+    Args:
+        query (str): The user's question.
+        retrieved_docs (List[Union[Dict[str, str], Tuple[Dict[str, str], float]]]): A list of retrieved relevant
+            documents, either as dicts or as the (document, score) tuples returned by `VectorStore.similarity_search`.
         cohere_api (str): The API key for Cohere.
+        client (Optional[cohere.ClientV2]): The Cohere client to use. Defaults to the shared client for cohere_api.
+
+    Yields:
+        str: The pieces of the generated answer. If generation fails, the last piece is an ErrorMessage,
+        possibly after pieces of a partial answer.
+    """
+    # The span is not entered: it stays open across yields, where it must not parent the caller's spans.
+    span = telemetry.span("generate", model=CHAT_MODEL, stream=True)
+    start, first_token = time.perf_counter(), True
+    try:
+        co = client or get_cohere_client(cohere_api)
+        for event in co.chat_stream(model=CHAT_MODEL, messages=_build_messages(query, retrieved_docs)):
+            if event.type == "content-delta":
+                if first_token:
+                    telemetry.record("generate.first_token", time.perf_counter() - start)
+                    first_token = False
+                yield event.delta.message.content.text
+
+    except Exception as e:
+        span.record_exception(e)
+        yield ErrorMessage(f"{ERROR_MESSAGE}: {str(e)}")
+    finally:
+        span.end()
+
+async def agenerate_answer(query: str, retrieved_docs: List[Union[Dict[str, str], Tuple[Dict[str, str], float]]],
+                           client: "cohere.AsyncClientV2") -> str:
+    """
+    Generate an answer based on the query and retrieved documents, without blocking the event loop.
+
+    Args:
+        query (str): The user's question.
+        retrieved_docs (List[Union[Dict[str, str], Tuple[Dict[str, str], float]]]): A list of retrieved relevant
+            documents, either as dicts or as the (document, score) tuples returned by `VectorStore.similarity_search`.
+        client (cohere.AsyncClientV2): The asyncio Cohere client, see create_async_cohere_client.
 
     Returns:
-        str: The generated answer or an error message.
+        str: The generated answer, or an ErrorMessage if generation fails.
+    """
+    with telemetry.span("generate", model=CHAT_MODEL) as span:
+        try:
+            response = await client.chat(
+                model=CHAT_MODEL,
+                messages=_build_messages(query, retrieved_docs)
+            )
+
+            return response.message.content
+
+        except Exception as e:
+            span.record_exception(e)
+            return ErrorMessage(f"{ERROR_MESSAGE}: {str(e)}")
+
+async def astream_answer(query: str, retrieved_docs: List[Union[Dict[str, str], Tuple[Dict[str, str], float]]],
+                         client: "cohere.AsyncClientV2") -> AsyncIterator[str]:
     """
+    Generate an answer based on the query and retrieved documents, yielding the text as it arrives.
+
+    Args:
+        query (str): The user's question.
+        retrieved_docs (List[Union[Dict[str, str], Tuple[Dict[str, str], float]]]): A list of retrieved relevant
+            documents, either as dicts or as the (document, score) tuples returned by `VectorStore.similarity_search`.
+        client (cohere.AsyncClientV2): The asyncio Cohere client, see create_async_cohere_client.
+
+    Yields:
+        str: The pieces of the generated answer. If generation fails, the last piece is an ErrorMessage,
+        possibly after pieces of a partial answer.
+    """
+    span = telemetry.span("generate", model=CHAT_MODEL, stream=True)
+    start, first_token = time.perf_counter(), True
     try:
-        co = cohere.ClientV2(cohere_api)
-        context = "\n".join([doc['text'] for doc in retrieved_docs])
-        prompt = f"Context: {context}\n\nQuestion: {query}\n\nAnswer:"
-        response = co.chat(
-            model="command-r-plus",
-            messages = [
-            {"role": "system", "content": "You are a helpful AI assistant that provides concise answers based on the provided context. Respond with only the answer to the question, without adding any extra explanation or text."},
-            {"role": "user", "content": prompt},
-            ]
-        )
-
-        return response.message.content
+        async for event in client.chat_stream(model=CHAT_MODEL, messages=_build_messages(query, retrieved_docs)):
+            if event.type == "content-delta":
+                if first_token:
+                    telemetry.record("generate.first_token", time.perf_counter() - start)
+                    first_token = False
+                yield event.delta.message.content.text
 
     except Exception as e:
-        return f"An error occurred while generating the answer: {str(e)}"
\ No newline at end of file
+        span.record_exception(e)
+        yield ErrorMessage(f"{ERROR_MESSAGE}: {str(e)}")
+    finally:
+        span.end()
+
+def _build_messages(query: str, retrieved_docs: List[Union[Dict[str, str], Tuple[Dict[str, str], float]]]) -> List[Dict[str, str]]:
+    """Build the chat messages holding the retrieved context and the question."""
+    docs = [doc[0] if isinstance(doc, tuple) else doc for doc in retrieved_docs]
+    context = "\n".join([doc['text'] for doc in docs])
+    prompt = f"Context: {context}\n\nQuestion: {query}\n\nAnswer:"
+    return [
+        {"role": "system", "content": SYSTEM_PROMPT},
+        {"role": "user", "content": prompt},
+    ]
@@ -0,0 +1,392 @@
+import time
+import asyncio
+import itertools
+import contextvars
+import numpy as np
+from functools import partial
+from concurrent.futures import ThreadPoolExecutor
+from ragqnabot.answercache import SemanticAnswerCache
+from ragqnabot.answergen import ErrorMessage, agenerate_answer, astream_answer, create_async_cohere_client
+from ragqnabot.configs import COHERE_API_KEY, COHERE_BASE_URL
+from ragqnabot.contextbuilder import ContextBuilder
+from ragqnabot.reranker import CrossEncoderReranker
+from ragqnabot.telemetry import telemetry
+from ragqnabot.vectorstore import VectorStore
+from typing import TYPE_CHECKING, Any, AsyncIterator, Dict, List, Optional, Tuple
+
+if TYPE_CHECKING:
+    import httpx
+
+# httpcore's asyncio connection pool scans every connection on each request, which gets slow for
+# large pools. The Cohere connections are therefore spread over several small pools.
+CONNECTIONS_PER_POOL = 16
+
+class EmbeddingBatcher:
+    """
+    Batches the query embeddings requested by concurrent coroutines into single `encode` calls.
+
+    A request waits at most max_wait seconds for others to join its batch. While a batch is being
+    encoded, new requests queue up and form the next batch, so under load the batches grow by
+    themselves and the model runs far fewer, larger forward passes.
+    """
+
+    def __init__(self, model, max_batch_size: int = 64, max_wait: float = 0.002):
+        """
+        Initialize the EmbeddingBatcher.
+
+        Args:
+            model: The SentenceTransformer model.
+            max_batch_size (int): The maximum number of queries per `encode` call. Default is 64.
+            max_wait (float): The maximum time in seconds a query waits for its batch to fill. Default is 0.002.
+        """
+        self.model = model
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self.batches = 0  # Number of encode calls made
+        self.embedded = 0  # Number of queries embedded
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="embedding-batcher")
+        self._queue: Optional[asyncio.Queue] = None
+        self._task: Optional[asyncio.Task] = None
+        self._closed = False
+
+    async def embed(self, text: str) -> np.ndarray:
+        """
+        Embed one query, batched with the queries of concurrent callers.
+
+        Args:
+            text (str): The query.
+
+        Returns:
+            np.ndarray: The float32 query embedding.
+
+        Raises:
+            RuntimeError: If the batcher is closed.
+        """
+        if self._closed:
+            raise RuntimeError("The embedding batcher is closed")
+        if self._task is None or self._task.done():
+            self._queue = asyncio.Queue()
+            self._task = asyncio.get_running_loop().create_task(self._run())
+        future = asyncio.get_running_loop().create_future()
+        self._queue.put_nowait((text, future))
+        return await future
+
+    async def aclose(self) -> None:
+        """Stop the batching task and the encoding thread. The batcher cannot be used afterwards."""
+        self._closed = True
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        self._executor.shutdown(wait=False)
+
+    async def _run(self) -> None:
+        """Collect queued queries into batches and encode them, one batch at a time."""
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self._queue.get()]
+            deadline = loop.time() + self.max_wait
+            while len(batch) < self.max_batch_size:
+                if not self._queue.empty():
+                    batch.append(self._queue.get_nowait())
+                    continue
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self._queue.get(), remaining))
+                except asyncio.TimeoutError:
+                    break
+
+            # Callers that timed out in the meantime need no embedding.
+            batch = [(text, future) for text, future in batch if not future.done()]
+            if not batch:
+                continue
+            texts = [text for text, _ in batch]
+            try:
+                with telemetry.span("embed.query", batch=len(texts)):
+                    embeddings = await loop.run_in_executor(
+                        self._executor, partial(self.model.encode, texts, batch_size=len(texts), convert_to_numpy=True))
+            except Exception as e:
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+
+            self.batches += 1
+            self.embedded += len(batch)
+            embeddings = np.asarray(embeddings, dtype=np.float32)
+            for (_, future), embedding in zip(batch, embeddings):
+                if not future.done():
+                    future.set_result(embedding)
+
+
+class AsyncQueryPipeline:
+    """
+    An asyncio-native embed -> retrieve -> generate pipeline for serving many concurrent users.
+
+    - Embed: concurrent queries are embedded in shared `encode` calls by an EmbeddingBatcher.
+    - Retrieve: the index is queried from a bounded pool of threads, since the Pinecone client
+      is synchronous. The event loop is never blocked by a network round trip.
+    - Generate: answers come from Cohere's asyncio client over a pool of keep-alive connections.
+
+    Each stage has its own timeout. An optional SemanticAnswerCache answers repeated questions
+    before any stage runs.
+    """
+
+    def __init__(self, vectorstore: VectorStore, index, k: int = 3, answer_cache: Optional[SemanticAnswerCache] = None,
+                 scope: str = "default", cohere_api: str = COHERE_API_KEY, base_url: Optional[str] = COHERE_BASE_URL,
+                 embed_timeout: Optional[float] = 5, retrieve_timeout: Optional[float] = 10, generate_timeout: Optional[float] = 60,
+                 max_batch_size: int = 64, max_wait: float = 0.002, max_concurrency: int = 32, max_connections: int = 100,
+                 context_builder: Optional[ContextBuilder] = None, search_mode: str = "dense",
+                 reranker: Optional[CrossEncoderReranker] = None, filter: Optional[Dict[str, Any]] = None,
+                 namespace: Optional[str] = None):
+        """
+        Initialize the AsyncQueryPipeline.
+
+        Args:
+            vectorstore (VectorStore): The vector store whose model embeds the queries and which searches the index.
+            index: The index to search, e.g. a Pinecone index or a LocalIndex.
+            k (int): The number of chunks retrieved per query. Default is 3.
+            answer_cache (Optional[SemanticAnswerCache]): A cache of answers to past questions.
+            scope (str): The answer cache scope, e.g. the index name. It should also identify the namespace and
+                         filter, as answers are only valid for the chunks they were retrieved from. Default is "default".
+            cohere_api (str): The API key for Cohere.
+            base_url (Optional[str]): The base URL of the Cohere API. Defaults to COHERE_BASE_URL.
+            embed_timeout (Optional[float]): The timeout in seconds of the embedding stage. Default is 5.
+            retrieve_timeout (Optional[float]): The timeout in seconds of the retrieval stage. Default is 10.
+            generate_timeout (Optional[float]): The timeout in seconds of the generation stage. Default is 60.
+            max_batch_size (int): The maximum number of queries embedded per `encode` call. Default is 64.
+            max_wait (float): The maximum time in seconds a query waits for its embedding batch to fill. Default is 0.002.
+            max_concurrency (int): The number of index requests in flight at a time. Default is 32.
+            max_connections (int): The number of connections to Cohere. Default is 100.
+            context_builder (Optional[ContextBuilder]): Merges, deduplicates and budgets the retrieved chunks
+                                                        before generation.
+            search_mode (str): The VectorStore.similarity_search mode: "dense", "hybrid" or "lexical". Default is "dense".
+            reranker (Optional[CrossEncoderReranker]): Re-ranks reranker.num_candidates retrieved chunks and keeps the
+                                                       best k. Runs on a thread of its own, within the retrieve timeout.
+            filter (Optional[Dict[str, Any]]): A metadata filter every retrieved chunk must match, e.g. {"doc_id": "manual.pdf"}.
+            namespace (Optional[str]): The namespace of the index to search, e.g. the tenant's. Defaults to the default namespace.
+        """
+        self.vectorstore = vectorstore
+        self.index = index
+        self.k = k
+        self.answer_cache = answer_cache
+        self.scope = scope
+        self.cohere_api = cohere_api
+        self.base_url = base_url
+        self.embed_timeout = embed_timeout
+        self.retrieve_timeout = retrieve_timeout
+        self.generate_timeout = generate_timeout
+        self.max_connections = max_connections
+        self.context_builder = context_builder
+        self.search_mode = search_mode
+        self.reranker = reranker
+        self.filter = filter
+        self.namespace = namespace
+        self.batcher = EmbeddingBatcher(vectorstore.model, max_batch_size=max_batch_size, max_wait=max_wait)
+        self._index_executor = ThreadPoolExecutor(max_workers=max_concurrency, thread_name_prefix="index-query")
+        # The cross-encoder uses every core for one batch, so queries are re-ranked one at a time.
+        self._rerank_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="rerank")
+        self._http_clients: List["httpx.AsyncClient"] = []
+        self._clients = []
+        self._next_client = itertools.count()
+        self._closed = False
+
+    async def __aenter__(self) -> "AsyncQueryPipeline":
+        return self
+
+    async def __aexit__(self, *exc_info) -> None:
+        await self.aclose()
+
+    async def embed(self, query: str) -> np.ndarray:
+        """
+        Embed a query, batched with concurrent queries.
+
+        Raises:
+            TimeoutError: If the embedding stage exceeds embed_timeout.
+            RuntimeError: If the pipeline is closed.
+        """
+        self._check_open()
+        return await self._stage("embed", self.batcher.embed(query), self.embed_timeout)
+
+    async def retrieve(self, query: str, query_embedding: Optional[np.ndarray] = None) -> List[Tuple[Dict[str, Any], float]]:
+        """
+        Retrieve the k chunks most similar to a query, re-ranked if the pipeline has a reranker.
+
+        Args:
+            query (str): The query.
+            query_embedding (Optional[np.ndarray]): The query embedding, if already computed.
+
+        Returns:
+            List[Tuple[Dict[str, Any], float]]: The (metadata, score) tuples, highest score first.
+
+        Raises:
+            TimeoutError: If a stage exceeds its timeout.
+            RuntimeError: If the pipeline is closed.
+        """
+        self._check_open()
+        if query_embedding is None and self.search_mode != "lexical":
+            query_embedding = await self.embed(query)
+        loop = asyncio.get_running_loop()
+        k = self.k if self.reranker is None else max(self.reranker.num_candidates, self.k)
+        search = partial(self.vectorstore.similarity_search, self.index, query, k=k, query_embedding=query_embedding,
+                         mode=self.search_mode, filter=self.filter, namespace=self.namespace)
+        # The search runs in a copy of the current context, so that its spans are children of the current span.
+        retrieve = loop.run_in_executor(self._index_executor, contextvars.copy_context().run, search)
+        if self.reranker is not None:
+            retrieve = self._rerank(loop, query, retrieve)
+        return await self._stage("retrieve", retrieve, self.retrieve_timeout)
+
+    async def answer(self, query: str) -> Dict[str, Any]:
+        """
+        Answer a query: embed it, retrieve the relevant chunks and generate the answer.
+
+        Args:
+            query (str): The user's question.
+
+        Returns:
+            Dict[str, Any]: The "answer", its "sources" (the retrieved chunks), whether it was "cached",
+            and the "timings" in seconds of the stages that ran. With a context builder, "context_tokens"
+            and "saved_tokens" report the size of the assembled context and the tokens it saved.
+            If generation fails, the "answer" is an answergen.ErrorMessage, which is not cached.
+
+        Raises:
+            TimeoutError: If a stage exceeds its timeout.
+            RuntimeError: If the pipeline is closed.
+        """
+        with telemetry.span("answer") as span:
+            result = await self._answer(query)
+            span.set_attribute("cached", result["cached"])
+            return result
+
+    async def _answer(self, query: str) -> Dict[str, Any]:
+        timings = {}
+        start = time.perf_counter()
+        query_embedding = await self.embed(query)
+        timings["embed"] = time.perf_counter() - start
+
+        cached = self._lookup(query, query_embedding)
+        if cached is not None:
+            return {"answer": cached["answer"], "sources": cached["sources"], "cached": True, "timings": timings}
+
+        start = time.perf_counter()
+        retrieved_docs = await self.retrieve(query, query_embedding)
+        timings["retrieve"] = time.perf_counter() - start
+
+        result = {"cached": False, "timings": timings}
+        if self.context_builder is not None:
+            context = self.context_builder.build(retrieved_docs)
+            retrieved_docs = context["chunks"]
+            result.update(context_tokens=context["tokens"], saved_tokens=context["saved_tokens"])
+
+        start = time.perf_counter()
+        answer = await self._stage("generate", agenerate_answer(query, retrieved_docs, self._cohere_client()), self.generate_timeout)
+        timings["generate"] = time.perf_counter() - start
+
+        sources = [doc for doc, _ in retrieved_docs]
+        self._store(query, answer, query_embedding, sources)
+        return {"answer": answer, "sources": sources, **result}
+
+    async def stream(self, query: str) -> AsyncIterator[str]:
+        """
+        Answer a query, yielding the answer as it is generated.
+
+        The generate_timeout bounds the whole generation, not each piece.
+
+        Args:
+            query (str): The user's question.
+
+        Yields:
+            str: The pieces of the answer. A cached answer is yielded in one piece. If generation fails, the
+            last piece is an answergen.ErrorMessage and the partial answer is not cached.
+
+        Raises:
+            TimeoutError: If a stage exceeds its timeout.
+            RuntimeError: If the pipeline is closed.
+        """
+        query_embedding = await self.embed(query)
+        cached = self._lookup(query, query_embedding)
+        if cached is not None:
+            yield cached["answer"]
+            return
+
+        retrieved_docs = await self.retrieve(query, query_embedding)
+        if self.context_builder is not None:
+            retrieved_docs = self.context_builder.build(retrieved_docs)["chunks"]
+        loop = asyncio.get_running_loop()
+        deadline = None if self.generate_timeout is None else loop.time() + self.generate_timeout
+        pieces = []
+        stream = astream_answer(query, retrieved_docs, self._cohere_client())
+        try:
+            while True:
+                remaining = None if deadline is None else max(deadline - loop.time(), 0)
+                try:
+                    piece = await asyncio.wait_for(stream.__anext__(), remaining)
+                except StopAsyncIteration:
+                    break
+                except asyncio.TimeoutError:
+                    raise TimeoutError(f"The generate stage timed out after {self.generate_timeout} seconds")
+                pieces.append(piece)
+                yield piece
+        finally:
+            await stream.aclose()
+
+        if not any(isinstance(piece, ErrorMessage) for piece in pieces):
+            self._store(query, "".join(pieces), query_embedding, [doc for doc, _ in retrieved_docs])
+
+    async def aclose(self) -> None:
+        """Stop the embedding batcher and close the thread pools and HTTP connections. The pipeline cannot be used afterwards."""
+        self._closed = True
+        await self.batcher.aclose()
+        self._index_executor.shutdown(wait=False)
+        self._rerank_executor.shutdown(wait=False)
+        for http_client in self._http_clients:
+            await http_client.aclose()
+        self._http_clients, self._clients = [], []
+
+    def _check_open(self) -> None:
+        """Raise a RuntimeError if the pipeline is closed, rather than failing in a shut down thread pool."""
+        if self._closed:
+            raise RuntimeError("The pipeline is closed")
+
+    def _cohere_client(self):
+        """Return an asyncio Cohere client, round robin, creating the clients in the running event loop on first use."""
+        if not self._clients:
+            import httpx
+            pools = -(-self.max_connections // CONNECTIONS_PER_POOL)
+            for i in range(pools):
+                # max_connections is divided over the pools, so that they open at most max_connections in total.
+                size = self.max_connections // pools + (i < self.max_connections % pools)
+                http_client = httpx.AsyncClient(limits=httpx.Limits(max_connections=size, max_keepalive_connections=size),
+                                                timeout=self.generate_timeout)
+                self._http_clients.append(http_client)
+                self._clients.append(create_async_cohere_client(self.cohere_api, self.base_url, http_client=http_client,
+                                                                timeout=self.generate_timeout or 300))
+        return self._clients[next(self._next_client) % len(self._clients)]
+
+    async def _rerank(self, loop: asyncio.AbstractEventLoop, query: str, retrieve) -> List[Tuple[Dict[str, Any], float]]:
+        """Await the search, then re-rank its results on the re-ranking thread."""
+        retrieved_docs = await retrieve
+        return await loop.run_in_executor(self._rerank_executor, contextvars.copy_context().run, self.reranker.rerank,
+                                          query, retrieved_docs, self.k)
+
+    def _lookup(self, query: str, query_embedding: np.ndarray) -> Optional[Dict[str, Any]]:
+        if self.answer_cache is None:
+            return None
+        return self.answer_cache.lookup(self.scope, query, query_embedding)
+
+    def _store(self, query: str, answer: Any, query_embedding: np.ndarray, sources: List[Dict[str, Any]]) -> None:
+        if self.answer_cache is not None and not isinstance(answer, ErrorMessage):
+            self.answer_cache.store(self.scope, query, answer, query_embedding, sources=sources)
+
+    @staticmethod
+    async def _stage(name: str, awaitable, timeout: Optional[float]):
+        """Await a stage, turning a timeout into a TimeoutError naming the stage."""
+        try:
+            return await asyncio.wait_for(awaitable, timeout)
+        except asyncio.TimeoutError:
+            raise TimeoutError(f"The {name} stage timed out after {timeout} seconds")
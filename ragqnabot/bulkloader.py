@@ -0,0 +1,173 @@
+import os
+import time
+from itertools import chain, zip_longest
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, FIRST_COMPLETED, wait
+from urllib.parse import urlparse
+from ragqnabot.datalaoder import DocumentLoader
+from ragqnabot.configs import OCR_CACHE_DIR
+from ragqnabot.ocr import OCRCache, OCREngine, set_ocr_engine
+from ragqnabot.telemetry import telemetry
+from typing import TYPE_CHECKING, Any, Dict, Iterable, Iterator, List, Optional, Tuple
+
+if TYPE_CHECKING:
+    import requests
+
+def _init_worker() -> None:
+    """
+    Set up a worker process. Telemetry is disabled, since its spans would never reach the parent process,
+    and OCR runs in the worker itself: files are already loaded in parallel, one per process.
+    """
+    telemetry.disable()
+    set_ocr_engine(OCREngine(max_workers=1, cache=OCRCache(OCR_CACHE_DIR) if OCR_CACHE_DIR else None))
+
+def _load_file(path: str, segment_size: int, rows_per_segment: int) -> Tuple[List[Dict[str, Any]], float]:
+    """
+    Load all segments of one file. Runs in a worker process, so it must be a module-level function.
+
+    Returns the segments and the loading time, which the parent process records as the load span.
+    """
+    start = time.perf_counter()
+    loader = DocumentLoader(path, segment_size=segment_size, rows_per_segment=rows_per_segment)
+    segments = list(loader.iter_segments())
+    return segments, time.perf_counter() - start
+
+def _load_url(url: str, session: "requests.Session", timeout: Optional[float]) -> Tuple[List[Dict[str, Any]], None]:
+    """Load the segments of one URL through the shared session. Runs in a worker thread, which records its own load span."""
+    return list(DocumentLoader(url, session=session, timeout=timeout).iter_segments()), None
+
+
+class BulkLoader:
+    """
+    A class for loading many files, directory trees and URLs in parallel.
+
+    Files are parsed by a pool of processes, since PDF parsing and OCR are CPU-bound. URLs are
+    fetched by a pool of threads sharing one pooled HTTP session. A failing source does not stop
+    the others: it is recorded in `self.errors`.
+    """
+
+    def __init__(self, sources: Iterable[str], max_workers: Optional[int] = None, max_connections: int = 16,
+                 recursive: bool = True, timeout: Optional[float] = 30, segment_size: int = 100000, rows_per_segment: int = 1000):
+        """
+        Initialize the BulkLoader.
+
+        Args:
+            sources (Iterable[str]): File paths, directories and URLs to load.
+            max_workers (Optional[int]): The number of parsing processes. Defaults to the number of CPUs.
+            max_connections (int): The number of concurrent HTTP requests. Default is 16.
+            recursive (bool): Whether to descend into subdirectories. Default is True.
+            timeout (Optional[float]): The timeout in seconds for fetching a URL. Default is 30.
+            segment_size (int): Passed on to DocumentLoader. Default is 100000.
+            rows_per_segment (int): Passed on to DocumentLoader. Default is 1000.
+        """
+        self.sources = list(sources)
+        self.max_workers = max_workers or os.cpu_count() or 1
+        self.max_connections = max_connections
+        self.recursive = recursive
+        self.timeout = timeout
+        self.segment_size = segment_size
+        self.rows_per_segment = rows_per_segment
+        self.errors: List[Dict[str, str]] = []
+
+    @classmethod
+    def from_manifest(cls, manifest_path: str, **kwargs) -> "BulkLoader":
+        """
+        Create a BulkLoader from a manifest file listing one path or URL per line.
+
+        Empty lines and lines starting with '#' are ignored.
+
+        Args:
+            manifest_path (str): The path to the manifest file.
+            **kwargs: Further BulkLoader options.
+
+        Returns:
+            BulkLoader: The loader for the listed sources.
+        """
+        with open(manifest_path, 'r', encoding='utf-8') as file:
+            sources = [line.strip() for line in file if line.strip() and not line.lstrip().startswith('#')]
+        return cls(sources, **kwargs)
+
+    def iter_documents(self) -> Iterator[Dict[str, Any]]:
+        """
+        Load every source in parallel and yield the documents as soon as they are loaded.
+
+        Only a bounded number of sources is in flight at a time, so memory stays bounded however
+        many sources there are. Failed sources are recorded in `self.errors` as {"source", "error"}.
+
+        Yields:
+            Dict[str, Any]: {"source": str, "segments": List[Dict[str, Any]]} for every loaded source,
+            in completion order.
+        """
+        import requests
+        from requests.adapters import HTTPAdapter
+        self.errors = []
+        files, urls = self._collect()
+
+        with ProcessPoolExecutor(max_workers=self.max_workers, initializer=_init_worker) as processes, \
+                ThreadPoolExecutor(max_workers=self.max_connections) as threads, \
+                requests.Session() as session:
+            adapter = HTTPAdapter(pool_connections=self.max_connections, pool_maxsize=self.max_connections)
+            session.mount("http://", adapter)
+            session.mount("https://", adapter)
+
+            file_jobs = ((processes, path, _load_file, (path, self.segment_size, self.rows_per_segment)) for path in files)
+            url_jobs = ((threads, url, _load_url, (url, session, self.timeout)) for url in urls)
+            # Interleave files and URLs so both pools are kept busy from the start.
+            jobs = (job for job in chain.from_iterable(zip_longest(file_jobs, url_jobs)) if job is not None)
+
+            window = 2 * (self.max_workers + self.max_connections)
+            pending = {}
+            for executor, source, function, args in jobs:
+                if len(pending) >= window:
+                    yield from self._drain(pending, wait(pending, return_when=FIRST_COMPLETED).done)
+                pending[executor.submit(function, *args)] = source
+            while pending:
+                yield from self._drain(pending, wait(pending, return_when=FIRST_COMPLETED).done)
+
+    def ingest(self, store, splitter, **add_kwargs) -> Dict[str, Any]:
+        """
+        Load every source and add its chunks to a vector store, using the source as document id.
+
+        Args:
+            store (VectorStore): The vector store to add the chunks to.
+            splitter (DocumentSplitter): The splitter used to chunk the loaded segments.
+            **add_kwargs: Options passed to VectorStore.add_texts, such as batch_size.
+
+        Returns:
+            Dict[str, Any]: The ids of the loaded "documents" and the "errors" of the failed sources.
+        """
+        documents = []
+        for document in self.iter_documents():
+            store.add_texts(splitter.split_segments(document["segments"]), doc_id=document["source"], **add_kwargs)
+            documents.append(document["source"])
+        return {"documents": documents, "errors": self.errors}
+
+    def _drain(self, pending: Dict, done: Iterable) -> Iterator[Dict[str, Any]]:
+        """Yield the documents of the finished futures and record their failures."""
+        for future in done:
+            source = pending.pop(future)
+            try:
+                segments, seconds = future.result()
+            except Exception as e:
+                self.errors.append({"source": source, "error": str(e)})
+                continue
+            if seconds is not None:
+                telemetry.record("load", seconds, source=source, items=len(segments))
+            yield {"source": source, "segments": segments}
+
+    def _collect(self) -> Tuple[List[str], List[str]]:
+        """Split the sources into files (expanding directories) and URLs."""
+        files, urls = [], []
+        for source in self.sources:
+            parsed = urlparse(source)
+            if parsed.scheme and parsed.netloc:
+                urls.append(source)
+            elif os.path.isdir(source):
+                for root, dirs, names in os.walk(source):
+                    dirs.sort()
+                    files.extend(os.path.join(root, name) for name in sorted(names)
+                                 if os.path.splitext(name)[1].lower() in DocumentLoader.SUPPORTED_EXTENSIONS)
+                    if not self.recursive:
+                        break
+            else:
+                files.append(source)
+        return files, urls
@@ -4,4 +4,20 @@ from dotenv import load_dotenv
 load_dotenv('.env')
 
 PINECONE_API_KEY = os.getenv("PINECONE_API_KEY")
-COHERE_API_KEY = os.getenv("COHERE_API_KEY")
\ No newline at end of file
+COHERE_API_KEY = os.getenv("COHERE_API_KEY")
+EMBEDDING_CACHE_DIR = os.getenv("EMBEDDING_CACHE_DIR", ".cache/embeddings")
+COHERE_BASE_URL = os.getenv("COHERE_BASE_URL")
+LEXICAL_INDEX_DIR = os.getenv("LEXICAL_INDEX_DIR", ".cache/lexical")
+# Re-ranking is enabled in the CLI and the Streamlit app when a cross-encoder model is set
+RERANKER_MODEL = os.getenv("RERANKER_MODEL")
+RERANK_LATENCY_BUDGET = float(os.getenv("RERANK_LATENCY_BUDGET", "0.5"))
+# The vector storage of the CLI's local index: "float32", "float16", "int8" or "pq"
+LOCAL_INDEX_STORAGE = os.getenv("LOCAL_INDEX_STORAGE", "float32")
+# Per-stage latency telemetry, off by default; TELEMETRY_LOG appends every span to a JSON lines file
+TELEMETRY_ENABLED = os.getenv("TELEMETRY", "").lower() in ("1", "true", "yes")
+TELEMETRY_LOG = os.getenv("TELEMETRY_LOG")
+# OCR of images and scanned PDF pages: the result cache (empty to disable) and the number of OCR processes (0 for one per CPU)
+OCR_CACHE_DIR = os.getenv("OCR_CACHE_DIR", ".cache/ocr")
+OCR_WORKERS = int(os.getenv("OCR_WORKERS", "0"))
+# Snapshots of the chunks and embeddings of ingested files, restored instead of re-ingesting unchanged files
+SNAPSHOT_DIR = os.getenv("SNAPSHOT_DIR", ".cache/snapshots")
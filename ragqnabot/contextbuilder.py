@@ -0,0 +1,208 @@
+import re
+import threading
+from typing import Any, Dict, List, Optional, Tuple, Union
+from ragqnabot.telemetry import telemetry
+
+# Keys that locate a chunk within its segment rather than identify the segment.
+POSITION_KEYS = ("text", "start_index", "end_index", "token_count")
+WORD_PATTERN = re.compile(r'\w+')
+
+class ContextBuilder:
+    """
+    A class for assembling the retrieved chunks of a query into a compact context for generation.
+
+    Chunks of the same document segment that overlap or touch, as the overlapping windows of
+    DocumentSplitter do, are merged using their start offsets. Chunks whose text is largely
+    contained in a better-ranked chunk are dropped. The remaining content is packed into the token
+    budget best-ranked first, and the number of tokens saved is reported.
+    """
+
+    def __init__(self, max_tokens: int = 1500, duplicate_threshold: float = 0.8, min_tokens: int = 32, tokenizer=None,
+                 embedding_model_name: str = 'all-MiniLM-L6-v2'):
+        """
+        Initialize the ContextBuilder.
+
+        Args:
+            max_tokens (int): The token budget of the context. Default is 1500.
+            duplicate_threshold (float): The share of a chunk's word trigrams found in a better-ranked chunk
+                                         above which it is dropped as a near-duplicate. Default is 0.8.
+            min_tokens (int): A chunk that does not fit the remaining budget is cut to fit, unless fewer than
+                              min_tokens tokens remain. Default is 32.
+            tokenizer: A Hugging Face fast tokenizer used to count tokens. Defaults to the tokenizer of the
+                       embedding model.
+            embedding_model_name (str): The embedding model whose tokenizer is used by default.
+                                        Default is 'all-MiniLM-L6-v2'.
+        """
+        self.max_tokens = max_tokens
+        self.duplicate_threshold = duplicate_threshold
+        self.min_tokens = min_tokens
+        self.embedding_model_name = embedding_model_name
+        self._tokenizer = tokenizer
+        self._lock = threading.Lock()
+        self.queries = 0
+        self.original_tokens = 0
+        self.context_tokens = 0
+
+    @property
+    def tokenizer(self):
+        """The tokenizer used to count tokens, loaded from the embedding model on first use."""
+        if self._tokenizer is None:
+            from ragqnabot.modelregistry import get_model
+            self._tokenizer = get_model(self.embedding_model_name).tokenizer
+        return self._tokenizer
+
+    @telemetry.traced("assemble")
+    def build(self, retrieved_docs: List[Union[Dict[str, Any], Tuple[Dict[str, Any], float]]]) -> Dict[str, Any]:
+        """
+        Assemble the context for the retrieved chunks of a query.
+
+        Args:
+            retrieved_docs (List[Union[Dict[str, Any], Tuple[Dict[str, Any], float]]]): The retrieved chunks, best
+                first, either as dicts or as the (metadata, score) tuples returned by `VectorStore.similarity_search`.
+
+        Returns:
+            Dict[str, Any]: A dictionary with
+                - "chunks": the assembled chunks, best first, as (metadata, score) tuples that can be passed
+                  to generate_answer in place of the retrieved chunks;
+                - "context": the texts of the assembled chunks, joined;
+                - "tokens", "original_tokens" and "saved_tokens": the token counts of the context and of the
+                  retrieved chunks, and their difference;
+                - "merged", "duplicates" and "truncated": the number of chunks merged into a neighbour,
+                  dropped as near-duplicates, and cut or left out to fit the budget.
+        """
+        chunks = [(doc[0], doc[1]) if isinstance(doc, tuple) else (doc, None) for doc in retrieved_docs]
+        chunks = [(metadata, score) for metadata, score in chunks if metadata and metadata.get('text')]
+        original_tokens = sum(self._count_tokens([metadata['text'] for metadata, _ in chunks]))
+
+        blocks = self._merge(chunks)
+        merged = len(chunks) - len(blocks)
+        blocks, duplicates = self._drop_duplicates(blocks)
+        packed, tokens, truncated = self._pack(blocks)
+
+        with self._lock:
+            self.queries += 1
+            self.original_tokens += original_tokens
+            self.context_tokens += tokens
+        telemetry.current_span().set_attribute("tokens", tokens)
+
+        return {
+            "chunks": [(block["metadata"], block["score"]) for block in packed],
+            "context": "\n\n".join(block["metadata"]["text"] for block in packed),
+            "tokens": tokens,
+            "original_tokens": original_tokens,
+            "saved_tokens": original_tokens - tokens,
+            "merged": merged,
+            "duplicates": duplicates,
+            "truncated": truncated,
+        }
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Return the token counts over all queries built so far.
+
+        Returns:
+            Dict[str, Any]: The number of "queries", the "original_tokens" and "context_tokens", the
+            "saved_tokens" and the "saved_ratio".
+        """
+        with self._lock:
+            saved = self.original_tokens - self.context_tokens
+            return {
+                "queries": self.queries,
+                "original_tokens": self.original_tokens,
+                "context_tokens": self.context_tokens,
+                "saved_tokens": saved,
+                "saved_ratio": saved / self.original_tokens if self.original_tokens else 0.0,
+            }
+
+    def _merge(self, chunks: List[Tuple[Dict[str, Any], Optional[float]]]) -> List[Dict[str, Any]]:
+        """Merge the chunks of the same segment whose character ranges overlap or touch."""
+        blocks = []
+        groups: Dict[Tuple, List[Dict[str, Any]]] = {}
+        for rank, (metadata, score) in enumerate(chunks):
+            block = {"metadata": dict(metadata), "score": score, "rank": rank}
+            start = metadata.get('start_index')
+            if start is None:
+                blocks.append(block)
+                continue
+            # Pinecone returns numeric metadata as floats.
+            block["start"] = int(start)
+            block["end"] = block["start"] + len(metadata['text'])
+            key = tuple(sorted((name, str(value)) for name, value in metadata.items() if name not in POSITION_KEYS))
+            groups.setdefault(key, []).append(block)
+
+        for group in groups.values():
+            group.sort(key=lambda block: block["start"])
+            current = group[0]
+            for block in group[1:]:
+                if block["start"] <= current["end"]:
+                    if block["end"] > current["end"]:
+                        current["metadata"]['text'] += block["metadata"]['text'][current["end"] - block["start"]:]
+                        current["end"] = block["end"]
+                    current["score"] = _best_score(current["score"], block["score"])
+                    current["rank"] = min(current["rank"], block["rank"])
+                else:
+                    blocks.append(current)
+                    current = block
+            blocks.append(current)
+
+        for block in blocks:
+            if "start" in block:
+                block["metadata"]['start_index'] = block["start"]
+                block["metadata"]['end_index'] = block["end"]
+                block["metadata"].pop('token_count', None)
+        blocks.sort(key=lambda block: block["rank"])
+        return blocks
+
+    def _drop_duplicates(self, blocks: List[Dict[str, Any]]) -> Tuple[List[Dict[str, Any]], int]:
+        """Drop the blocks whose word trigrams are mostly contained in a better-ranked block."""
+        kept, kept_shingles = [], []
+        for block in blocks:
+            shingles = _shingles(block["metadata"]['text'])
+            if shingles and any(len(shingles & other) >= self.duplicate_threshold * len(shingles) for other in kept_shingles):
+                continue
+            kept.append(block)
+            kept_shingles.append(shingles)
+        return kept, len(blocks) - len(kept)
+
+    def _pack(self, blocks: List[Dict[str, Any]]) -> Tuple[List[Dict[str, Any]], int, int]:
+        """Take the blocks best-ranked first while they fit the budget, cutting the first one that does not."""
+        counts = self._count_tokens([block["metadata"]['text'] for block in blocks])
+        packed, tokens = [], 0
+        for i, (block, count) in enumerate(zip(blocks, counts)):
+            remaining = self.max_tokens - tokens
+            if count <= remaining:
+                packed.append(block)
+                tokens += count
+                continue
+            if remaining >= self.min_tokens:
+                text, count = self._truncate(block["metadata"]['text'], remaining)
+                block["metadata"]['text'] = text
+                block["metadata"].pop('end_index', None)
+                packed.append(block)
+                tokens += count
+            return packed, tokens, len(blocks) - i
+        return packed, tokens, 0
+
+    def _count_tokens(self, texts: List[str]) -> List[int]:
+        """Count the tokens of every text without special tokens."""
+        if not texts:
+            return []
+        return [len(ids) for ids in self.tokenizer(texts, add_special_tokens=False)['input_ids']]
+
+    def _truncate(self, text: str, max_tokens: int) -> Tuple[str, int]:
+        """Cut a text to its first max_tokens tokens."""
+        offsets = self.tokenizer(text, add_special_tokens=False, return_offsets_mapping=True)['offset_mapping'][:max_tokens]
+        return (text[:offsets[-1][1]], len(offsets)) if offsets else ("", 0)
+
+
+def _best_score(first: Optional[float], second: Optional[float]) -> Optional[float]:
+    if first is None or second is None:
+        return first if second is None else second
+    return max(first, second)
+
+def _shingles(text: str) -> set:
+    """Return the set of word trigrams of a text, or of its words if it has fewer than three."""
+    words = WORD_PATTERN.findall(text.lower())
+    if len(words) < 3:
+        return set(words)
+    return {(words[i], words[i + 1], words[i + 2]) for i in range(len(words) - 2)}
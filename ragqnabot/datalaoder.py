@@ -1,30 +1,56 @@
 # Importing the Libraries
+import io
 import os
-import docx
-import PyPDF2
-import chardet
-import requests
-import pytesseract
-import pandas as pd
-from PIL import Image
-from bs4 import BeautifulSoup
-from typing import Union, Dict, Any
+import mmap
+import codecs
+import logging
+from collections import deque
+from typing import TYPE_CHECKING, Union, Dict, Any, Iterator, List, Optional
 from urllib.parse import urlparse
+from ragqnabot.ocr import OCREngine, get_ocr_engine
+from ragqnabot.telemetry import telemetry
+
+# The parsing libraries are imported by the methods of their formats, so loading a text file
+# does not pay for importing pandas, PyPDF2, python-docx and BeautifulSoup.
+if TYPE_CHECKING:
+    import requests
+
+logger = logging.getLogger(__name__)
 
 
 class DocumentLoader:
     """A class for loading data from various file formats and web pages."""
 
-    def __init__(self, path: str):
+    SUPPORTED_EXTENSIONS = ('.pdf', '.docx', '.html', '.htm', '.txt', '.md', '.csv', '.xls', '.xlsx', '.jpg', '.jpeg', '.png')
+    ENCODING_SAMPLE_SIZE = 64 * 1024  # Bytes inspected when the encoding has to be detected
+    MMAP_THRESHOLD = 16 * 1024 * 1024  # Text files from this size on are memory-mapped instead of read
+    OCR_MIN_CHARS = 16  # PDF pages with less extracted text than this are treated as scanned and OCRed
+
+    def __init__(self, path: str, segment_size: int = 100000, rows_per_segment: int = 1000,
+                 session: Optional["requests.Session"] = None, timeout: Optional[float] = None, ocr: Optional[OCREngine] = None):
         """
         Initialize the DocumentLoader with a file path or URL.
 
         Args:
             path (str): The path to the file to be loaded or a URL.
+            segment_size (int): The approximate number of characters per segment yielded by iter_segments
+                                for text and DOCX files. Default is 100000.
+            rows_per_segment (int): The number of CSV/Excel rows per segment yielded by iter_segments. Default is 1000.
+            session (Optional[requests.Session]): A session used to fetch URLs, so connections can be pooled
+                                                  across loaders. Default is None (a one-off request).
+            timeout (Optional[float]): The timeout in seconds for fetching URLs. Default is None (no timeout).
+            ocr (Optional[OCREngine]): The OCR engine for images and scanned PDF pages. Defaults to the shared
+                                       engine of get_ocr_engine, which caches its results in OCR_CACHE_DIR.
         """
         self.path = path
         self.data = None
+        self.segment_size = segment_size
+        self.rows_per_segment = rows_per_segment
+        self.session = session
+        self.timeout = timeout
+        self.ocr = ocr
 
+    @telemetry.traced("load")
     def load_data(self) -> Union[str, Dict[str, Any]]:
         """
         Load data from the file or URL based on its type.
@@ -66,6 +92,64 @@ class DocumentLoader:
         except IOError as e:
             raise IOError(f"Error reading file or loading web page: {e}")
 
+    def iter_segments(self) -> Iterator[Dict[str, Any]]:
+        """
+        Lazily load the file or URL as a sequence of text segments with source metadata.
+
+        Unlike load_data, the whole document is never held in memory at once: PDFs are read page
+        by page, text and DOCX files in blocks of about segment_size characters, and CSV/Excel
+        files in blocks of rows_per_segment rows.
+
+        Yields:
+            Dict[str, Any]: {"text": str, "metadata": dict}. The metadata always contains "source" and,
+            depending on the format, "page", "sheet", "row_start"/"row_end" or "url". Segments of local
+            files also carry the file's "modified_at" time in seconds since the epoch.
+
+        Raises:
+            ValueError: If the file format is unsupported or the URL is invalid.
+            IOError: If there's an error reading the file or loading the web page.
+        """
+        return telemetry.timed_iter("load", self._iter_segments(), source=self.path)
+
+    def _iter_segments(self) -> Iterator[Dict[str, Any]]:
+        try:
+            if self._is_url(self.path):
+                yield {"text": self._load_web_page(self.path), "metadata": {"source": self.path, "url": self.path}}
+                return
+
+            file_extension = os.path.splitext(self.path)[1].lower()
+
+            iterators = {
+                '.pdf': self._iter_pdf,
+                '.docx': self._iter_docx,
+                '.txt': self._iter_txt,
+                '.md': self._iter_txt,
+                '.csv': self._iter_csv,
+                '.xls': self._iter_excel,
+                '.xlsx': self._iter_excel,
+            }
+            whole_file_loaders = {
+                '.html': self._load_html,
+                '.htm': self._load_html,
+                '.jpg': self._load_image,
+                '.jpeg': self._load_image,
+                '.png': self._load_image
+            }
+
+            if file_extension in iterators:
+                segments = iterators[file_extension]()
+            elif file_extension in whole_file_loaders:
+                segments = iter([{"text": whole_file_loaders[file_extension](), "metadata": {"source": self.path}}])
+            else:
+                raise ValueError(f"Unsupported file format: {file_extension}. Available formats: {', '.join(list(iterators) + list(whole_file_loaders))}")
+            # The modification time lets metadata filters select chunks by the age of their file.
+            modified_at = int(os.path.getmtime(self.path))
+            for segment in segments:
+                segment["metadata"]["modified_at"] = modified_at
+                yield segment
+        except IOError as e:
+            raise IOError(f"Error reading file or loading web page: {e}")
+
     def _is_url(self, path: str) -> bool:
         """Check if the given path is a URL."""
         try:
@@ -87,8 +171,10 @@ class DocumentLoader:
         Raises:
             ValueError: If the web page couldn't be loaded.
         """
+        import requests
+        from bs4 import BeautifulSoup
         try:
-            response = requests.get(url)
+            response = (self.session or requests).get(url, timeout=self.timeout)
             response.raise_for_status()
             soup = BeautifulSoup(response.content, 'lxml')
             return soup.get_text()
@@ -97,27 +183,102 @@ class DocumentLoader:
 
     def _load_pdf(self) -> str:
         """Load text from a PDF file."""
+        return "".join(segment["text"] for segment in self._iter_pdf())
+
+    def _iter_pdf(self) -> Iterator[Dict[str, Any]]:
+        """
+        Yield the text of a PDF file page by page.
+
+        Pages without a text layer, i.e. scanned pages, are OCRed instead. Their OCR runs in the
+        background while the following pages are read, and pages are still yielded in order.
+        """
         try:
-            text = ""
+            import PyPDF2
             with open(self.path, 'rb') as file:
                 reader = PyPDF2.PdfReader(file)
-                for page in reader.pages:
-                    text += page.extract_text()
-            return text
+                pending = deque()  # (page number, text, or the OCR futures of the page images)
+                for page_number, page in enumerate(reader.pages, start=1):
+                    text = page.extract_text() or ""
+                    if len(text.strip()) < self.OCR_MIN_CHARS:
+                        text = self._ocr_page(page, page_number) or text
+                    pending.append((page_number, text))
+                    # Yield the pages that are ready, and wait for the oldest one when too many are in flight.
+                    # The OCR engine is only looked up for a page with OCR futures, so text PDFs never create it.
+                    while pending and (isinstance(pending[0][1], str) or all(future.done() for future in pending[0][1])
+                                       or len(pending) > 2 * self._ocr_engine().max_workers):
+                        yield self._pdf_segment(*pending.popleft())
+                while pending:
+                    yield self._pdf_segment(*pending.popleft())
         except Exception as e:
             raise IOError(f"Error reading PDF file: {e}")
 
+    def _ocr_page(self, page, page_number: int) -> List:
+        """Start the OCR of the scanned images of a PDF page, returning their futures. Unreadable images are skipped."""
+        from PIL import Image
+        try:
+            images = page.images
+        except Exception:
+            return []  # Images in a format PyPDF2 cannot decode
+        page_width = float(page.mediabox.width) / 72  # In inches
+        engine, futures = None, []
+        for image in images:
+            try:
+                with Image.open(io.BytesIO(image.data)) as opened:
+                    width, height = opened.size
+            except Exception as e:
+                logger.warning(f"Skipping unreadable image {image.name} on page {page_number} of {self.path}: {e}")
+                continue
+            # Icons and logos hold no text worth recognizing.
+            if min(width, height) < 64:
+                continue
+            engine = engine or self._ocr_engine()
+            futures.append(engine.submit(image.data, dpi=width / page_width if page_width else None))
+        return futures
+
+    def _pdf_segment(self, page_number: int, text: Union[str, List]) -> Dict[str, Any]:
+        """Return the segment of a PDF page, waiting for its OCR if needed. Images whose OCR failed are skipped."""
+        metadata = {"source": self.path, "page": page_number}
+        if not isinstance(text, str):
+            texts = []
+            for future in text:
+                try:
+                    texts.append(future.result())
+                except Exception as e:
+                    logger.warning(f"Skipping an image on page {page_number} of {self.path} whose OCR failed: {e}")
+            text = "\n".join(texts)
+            metadata["ocr"] = True
+        return {"text": text, "metadata": metadata}
+
     def _load_docx(self) -> str:
         """Load text from a DOCX file."""
         try:
+            import docx
             doc = docx.Document(self.path)
             return "\n".join([para.text for para in doc.paragraphs])
         except Exception as e:
             raise IOError(f"Error reading DOCX file: {e}")
 
+    def _iter_docx(self) -> Iterator[Dict[str, Any]]:
+        """Yield the text of a DOCX file in blocks of whole paragraphs of about segment_size characters."""
+        try:
+            import docx
+            doc = docx.Document(self.path)
+            paragraphs, length, first = [], 0, 0
+            for number, para in enumerate(doc.paragraphs):
+                paragraphs.append(para.text)
+                length += len(para.text) + 1
+                if length >= self.segment_size:
+                    yield {"text": "\n".join(paragraphs), "metadata": {"source": self.path, "paragraph_start": first, "paragraph_end": number}}
+                    paragraphs, length, first = [], 0, number + 1
+            if paragraphs:
+                yield {"text": "\n".join(paragraphs), "metadata": {"source": self.path, "paragraph_start": first, "paragraph_end": first + len(paragraphs) - 1}}
+        except Exception as e:
+            raise IOError(f"Error reading DOCX file: {e}")
+
     def _load_html(self) -> str:
         """Load text from an HTML file."""
         try:
+            from bs4 import BeautifulSoup
             with open(self.path, 'r', encoding='utf-8') as file:
                 soup = BeautifulSoup(file, 'lxml')
                 return soup.get_text()
@@ -125,21 +286,89 @@ class DocumentLoader:
             raise IOError(f"Error reading HTML file: {e}")
 
     def _load_txt(self) -> str:
-        """Load text from a TXT or MD file."""
+        """
+        Load text from a TXT or MD file.
+
+        The file is read once (memory-mapped when larger than MMAP_THRESHOLD) and decoded as UTF-8
+        directly. Only when that fails is the encoding detected, from a bounded sample.
+        """
         try:
             with open(self.path, 'rb') as file:
-                raw_data = file.read()
-                result = chardet.detect(raw_data)
-                encoding = result['encoding']
+                if os.fstat(file.fileno()).st_size >= self.MMAP_THRESHOLD:
+                    with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as raw_data:
+                        text = self._decode(raw_data)
+                else:
+                    text = self._decode(file.read())
+            # Match the newline translation of text-mode reads.
+            return text.replace('\r\n', '\n').replace('\r', '\n')
+        except Exception as e:
+            raise IOError(f"Error reading text file: {e}")
 
-            with open(self.path, 'r', encoding=encoding) as file:
-                return file.read()
+    def _decode(self, raw_data) -> str:
+        """Decode bytes or a memory map, trying UTF-8 before sampling for the encoding."""
+        encoding = self._detect_encoding(raw_data[:self.ENCODING_SAMPLE_SIZE])
+        try:
+            return str(raw_data, encoding)
+        except UnicodeDecodeError as e:
+            # The sample looked like UTF-8 but the rest is not: detect around the offending bytes.
+            sample = raw_data[max(0, e.start - self.ENCODING_SAMPLE_SIZE // 2):e.start + self.ENCODING_SAMPLE_SIZE // 2]
+            encoding = self._chardet(sample)
+            return str(raw_data, encoding, 'replace')
+
+    def _iter_txt(self) -> Iterator[Dict[str, Any]]:
+        """Yield the text of a TXT or MD file in blocks of about segment_size characters, decoding incrementally."""
+        try:
+            with open(self.path, 'rb') as file:
+                block = file.read(self.segment_size)
+                encoding = self._detect_encoding(block[:self.ENCODING_SAMPLE_SIZE])
+                decoder = io.IncrementalNewlineDecoder(codecs.getincrementaldecoder(encoding)(), translate=True)
+                offset = 0
+                while True:
+                    final = len(block) < self.segment_size
+                    try:
+                        text = decoder.decode(block, final=final)
+                    except UnicodeDecodeError:
+                        # Switch encodings mid-file; the blocks already yielded stay as they were.
+                        encoding = self._chardet(block[:self.ENCODING_SAMPLE_SIZE])
+                        decoder = io.IncrementalNewlineDecoder(codecs.getincrementaldecoder(encoding)('replace'), translate=True)
+                        text = decoder.decode(block, final=final)
+                    if text:
+                        yield {"text": text, "metadata": {"source": self.path, "char_offset": offset}}
+                        offset += len(text)
+                    if final:
+                        break
+                    block = file.read(self.segment_size)
         except Exception as e:
             raise IOError(f"Error reading text file: {e}")
 
+    def _detect_encoding(self, sample: bytes) -> str:
+        """
+        Detect the encoding of a text file from a bounded sample of its first bytes.
+
+        A byte order mark decides directly, and a sample that decodes as UTF-8 is taken as UTF-8
+        (ASCII included). chardet only runs on the sample otherwise.
+        """
+        if sample.startswith(codecs.BOM_UTF8):
+            return 'utf-8-sig'
+        if sample.startswith((codecs.BOM_UTF16_LE, codecs.BOM_UTF16_BE)):
+            return 'utf-16'
+        try:
+            # final=False tolerates a multi-byte character cut off at the end of the sample.
+            codecs.getincrementaldecoder('utf-8')().decode(sample, final=False)
+            return 'utf-8'
+        except UnicodeDecodeError:
+            return self._chardet(sample)
+
+    @staticmethod
+    def _chardet(sample: bytes) -> str:
+        """Detect the encoding of a sample with chardet, falling back to UTF-8."""
+        import chardet
+        return chardet.detect(sample)['encoding'] or 'utf-8'
+
     def _load_csv(self) -> str:
         """Load text from a CSV file."""
         try:
+            import pandas as pd
             df = pd.read_csv(self.path)
             return df.to_string(index=False)
         except Exception as e:
@@ -148,15 +377,84 @@ class DocumentLoader:
     def _load_excel(self) -> str:
         """Load text from an Excel file."""
         try:
+            import pandas as pd
             df = pd.read_excel(self.path)
             return df.to_string(index=False)
         except Exception as e:
             raise IOError(f"Error reading Excel file: {e}")
 
+    def _iter_csv(self) -> Iterator[Dict[str, Any]]:
+        """Yield a CSV file in blocks of rows_per_segment rows, each rendered with its header."""
+        try:
+            import pandas as pd
+            row_start = 0
+            for df in pd.read_csv(self.path, chunksize=self.rows_per_segment):
+                yield {"text": df.to_string(index=False),
+                       "metadata": {"source": self.path, "row_start": row_start, "row_end": row_start + len(df) - 1}}
+                row_start += len(df)
+        except Exception as e:
+            raise IOError(f"Error reading CSV file: {e}")
+
+    def _iter_excel(self) -> Iterator[Dict[str, Any]]:
+        """
+        Yield every sheet of an Excel file in blocks of rows_per_segment rows, each rendered with its header.
+
+        .xlsx files are streamed row by row with openpyxl's read-only mode, so only one block is held in
+        memory. xlrd cannot stream, so every sheet of a legacy .xls file is read whole.
+        """
+        try:
+            import pandas as pd
+            if self.path.lower().endswith('.xls'):
+                with pd.ExcelFile(self.path) as workbook:
+                    for sheet in workbook.sheet_names:
+                        df = workbook.parse(sheet)
+                        for row_start in range(0, len(df), self.rows_per_segment):
+                            yield self._excel_segment(str(sheet), row_start, df.iloc[row_start:row_start + self.rows_per_segment])
+                return
+
+            import openpyxl
+            workbook = openpyxl.load_workbook(self.path, read_only=True, data_only=True)
+            try:
+                for worksheet in workbook.worksheets:
+                    rows = worksheet.iter_rows(values_only=True)
+                    header = next(rows, None)
+                    if header is None:
+                        continue
+                    # Unnamed columns are named like pandas.read_excel names them.
+                    columns = [f"Unnamed: {i}" if name is None else name for i, name in enumerate(header)]
+                    block, blank, row_start = [], [], 0
+                    for row in rows:
+                        # Empty rows are kept between data rows but dropped at the end of the sheet, as by pandas.
+                        if all(value is None for value in row):
+                            blank.append(row)
+                            continue
+                        if len(row) > len(columns):
+                            columns += [f"Unnamed: {i}" for i in range(len(columns), len(row))]
+                        block.extend(blank)
+                        block.append(row)
+                        blank = []
+                        while len(block) >= self.rows_per_segment:
+                            yield self._excel_segment(worksheet.title, row_start, pd.DataFrame(block[:self.rows_per_segment], columns=columns))
+                            block = block[self.rows_per_segment:]
+                            row_start += self.rows_per_segment
+                    if block:
+                        yield self._excel_segment(worksheet.title, row_start, pd.DataFrame(block, columns=columns))
+            finally:
+                workbook.close()
+        except Exception as e:
+            raise IOError(f"Error reading Excel file: {e}")
+
+    def _excel_segment(self, sheet: str, row_start: int, block) -> Dict[str, Any]:
+        """Return the segment of a block of rows of an Excel sheet, given as a DataFrame."""
+        return {"text": block.to_string(index=False),
+                "metadata": {"source": self.path, "sheet": sheet, "row_start": row_start, "row_end": row_start + len(block) - 1}}
+
     def _load_image(self) -> str:
         """Load text from an image file using OCR."""
         try:
-            image = Image.open(self.path)
-            return pytesseract.image_to_string(image)
+            return self._ocr_engine().image_to_text(self.path)
         except Exception as e:
-            raise IOError(f"Error reading image file: {e}")
\ No newline at end of file
+            raise IOError(f"Error reading image file: {e}")
+
+    def _ocr_engine(self) -> OCREngine:
+        return self.ocr or get_ocr_engine()
\ No newline at end of file
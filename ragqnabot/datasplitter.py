@@ -1,41 +1,77 @@
-from typing import List
+import re
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+from ragqnabot.telemetry import telemetry
+
+# A sentence runs from a non-space character to the next sentence-ending punctuation followed by
+# whitespace, a paragraph break or the end of the text. A punctuation run is only tried from its first
+# character, so a run that is not followed by whitespace is read once rather than once per character.
+SENTENCE_PATTERN = re.compile(r'\S(?:[.!?]+(?=\s)|.*?(?:(?<![.!?])[.!?]+(?=\s)|(?=\n[ \t]*\n)|\Z))', re.S)
+PARAGRAPH_BREAK = re.compile(r'\n[ \t]*\n')
 
 class DocumentSplitter:
     """
     A class for splitting text data into smaller chunks with optional overlap and start index tracking.
+
+    Two modes are available:
+        - "characters": fixed windows of chunk_size characters overlapping by overlap characters.
+        - "tokens": whole sentences, grouped by paragraph where possible, packed up to a token budget
+          measured with the embedding model's tokenizer. Chunks never exceed the model's maximum
+          sequence length, so the embedding model never silently truncates them.
     """
 
-    def __init__(self, data: str, chunk_size: int = 1000, overlap: int = 200, add_start_index: bool = False):
+    def __init__(self, data: Optional[str] = None, chunk_size: int = 1000, overlap: int = 200, add_start_index: bool = True,
+                 mode: str = "characters", max_tokens: Optional[int] = None, tokenizer=None,
+                 embedding_model_name: str = 'all-MiniLM-L6-v2'):
         """
         Initialize the DocumentSplitter.
 
         Args:
-            data (str): The text data to be split.
+            data (Optional[str]): The text data to be split. Can be omitted when only split_segments is used.
             chunk_size (int): The size of each chunk in characters. Default is 1000.
             overlap (int): The number of overlapping characters between chunks. Default is 200.
             add_start_index (bool): Whether to include the start index in the output chunks. Default is True.
+            mode (str): "characters" or "tokens". Default is "characters".
+            max_tokens (Optional[int]): The token budget per chunk in "tokens" mode. Defaults to, and is capped
+                                        at, the embedding model's maximum sequence length.
+            tokenizer: A Hugging Face fast tokenizer used in "tokens" mode. Defaults to the tokenizer
+                       of the embedding model. When given together with max_tokens, the embedding model
+                       is not loaded and max_tokens is used as is.
+            embedding_model_name (str): The embedding model whose tokenizer and sequence length are used
+                                        in "tokens" mode. Default is 'all-MiniLM-L6-v2'.
+
+        Raises:
+            ValueError: If the mode is unsupported.
         """
+        if mode not in ("characters", "tokens"):
+            raise ValueError(f"Unsupported mode: {mode}. Available modes: characters, tokens")
+
         self.data = data
         self.chunk_size = chunk_size
         self.overlap = overlap
         self.add_start_index = add_start_index
+        self.mode = mode
+        self.embedding_model_name = embedding_model_name
+        self._tokenizer = tokenizer
+        self._custom_tokenizer = tokenizer is not None
+        self._max_tokens = max_tokens
 
+    @telemetry.traced("split")
     def split_data(self) -> List[str]:
         """
         Split the data into chunks with optional overlap. Optionally includes the start index in each chunk.
 
+        In "tokens" mode the chunks are always dictionaries with 'text', 'start_index', 'end_index'
+        and 'token_count'.
+
         Returns:
             List[Union[str, Dict[str, Union[str, int]]]]:
             A list of chunks, either as plain text strings or dictionaries containing the chunk text.
         """
-        chunks = []
-        data_length = len(self.data)
-        start_index = 0
-
-        while start_index < data_length:
-            end_index = min(start_index + self.chunk_size, data_length)
-            chunk = self.data[start_index:end_index]
+        if self.mode == "tokens":
+            return list(self._token_chunks(self.data))
 
+        chunks = []
+        for start_index, chunk in self._windows(self.data):
             if self.add_start_index:
                 chunks.append({
                     'text': chunk,
@@ -44,6 +80,136 @@ class DocumentSplitter:
             else:
                 chunks.append(chunk)
 
+        return chunks
+
+    def split_segments(self, segments: Iterable[Dict[str, Any]]) -> Iterator[Dict[str, Any]]:
+        """
+        Lazily split a stream of segments, as yielded by DocumentLoader.iter_segments, into chunks.
+
+        Chunks never span two segments, so every chunk carries the metadata (page, sheet, rows, ...)
+        of the segment it comes from. Only one segment is held in memory at a time.
+
+        Args:
+            segments (Iterable[Dict[str, Any]]): Segments of the form {"text": str, "metadata": dict}.
+
+        Yields:
+            Dict[str, Any]: A chunk with its 'text', its 'start_index' and 'end_index' within the segment and the
+            segment metadata. In "tokens" mode, 'token_count' is included as well.
+        """
+        return telemetry.timed_iter("split", self._split_segments(segments), mode=self.mode)
+
+    def _split_segments(self, segments: Iterable[Dict[str, Any]]) -> Iterator[Dict[str, Any]]:
+        for segment in segments:
+            metadata = segment.get('metadata', {})
+            if self.mode == "tokens":
+                for chunk in self._token_chunks(segment['text']):
+                    yield {**chunk, **metadata}
+            else:
+                for start_index, chunk in self._windows(segment['text']):
+                    yield {'text': chunk, 'start_index': start_index, 'end_index': start_index + len(chunk), **metadata}
+
+    def settings(self) -> Dict[str, Any]:
+        """Return the settings that determine the chunks, e.g. to recognize chunks split earlier with the same settings."""
+        settings = {"mode": self.mode, "add_start_index": self.add_start_index}
+        if self.mode == "tokens":
+            settings.update(max_tokens=self._max_tokens, embedding_model_name=self.embedding_model_name,
+                            tokenizer=getattr(self._tokenizer, "name_or_path", None) if self._custom_tokenizer else None)
+        else:
+            settings.update(chunk_size=self.chunk_size, overlap=self.overlap)
+        return settings
+
+    @property
+    def tokenizer(self):
+        """The tokenizer used in "tokens" mode, loaded from the embedding model on first use."""
+        if self._tokenizer is None:
+            from ragqnabot.modelregistry import get_model
+            self._tokenizer = get_model(self.embedding_model_name).tokenizer
+        return self._tokenizer
+
+    @property
+    def max_tokens(self) -> int:
+        """The token budget per chunk, never more than the embedding model accepts."""
+        if self._max_tokens and self._custom_tokenizer:
+            return self._max_tokens
+        from ragqnabot.modelregistry import get_model
+        model = get_model(self.embedding_model_name)
+        # The model adds special tokens such as [CLS] and [SEP] around every input.
+        limit = model.max_seq_length - self.tokenizer.num_special_tokens_to_add()
+        return min(self._max_tokens, limit) if self._max_tokens else limit
+
+    def _windows(self, text: str) -> Iterator[Tuple[int, str]]:
+        """Yield (start index, chunk) windows of chunk_size characters advancing by chunk_size - overlap."""
+        data_length = len(text)
+        start_index = 0
+
+        while start_index < data_length:
+            end_index = min(start_index + self.chunk_size, data_length)
+            yield start_index, text[start_index:end_index]
+
             start_index += self.chunk_size - self.overlap
 
-        return chunks
\ No newline at end of file
+    def _token_chunks(self, text: str) -> Iterator[Dict[str, Any]]:
+        """
+        Pack whole sentences into chunks of at most max_tokens tokens.
+
+        Every sentence is tokenized once, so the cost is linear in the length of the text. A chunk is
+        closed early at a paragraph break when it is at least half full and the next paragraph would
+        not fit. Sentences longer than the budget are cut at token boundaries.
+        """
+        budget = self.max_tokens
+        spans = [(match.start(), match.end()) for match in SENTENCE_PATTERN.finditer(text)]
+        if not spans:
+            return
+        counts = self._count_tokens([text[start:end] for start, end in spans])
+
+        # paragraph_tokens[i] is the number of tokens from sentence i to the end of its paragraph.
+        paragraph_tokens = [0] * len(spans)
+        remaining = 0
+        for i in range(len(spans) - 1, -1, -1):
+            if i + 1 < len(spans) and PARAGRAPH_BREAK.search(text, spans[i][1], spans[i + 1][0]):
+                remaining = 0
+            remaining += counts[i]
+            paragraph_tokens[i] = remaining
+
+        chunk_start, chunk_end, chunk_tokens = None, None, 0
+        for i, (start, end) in enumerate(spans):
+            if counts[i] > budget:
+                if chunk_start is not None:
+                    yield self._chunk(text, chunk_start, chunk_end, chunk_tokens)
+                    chunk_start, chunk_tokens = None, 0
+                yield from self._split_long_sentence(text, start, end, budget)
+                continue
+
+            paragraph_starts = i > 0 and PARAGRAPH_BREAK.search(text, spans[i - 1][1], start) is not None
+            early_break = (paragraph_starts and chunk_tokens >= budget // 2
+                           and chunk_tokens + paragraph_tokens[i] > budget)
+            if chunk_start is not None and (chunk_tokens + counts[i] > budget or early_break):
+                yield self._chunk(text, chunk_start, chunk_end, chunk_tokens)
+                chunk_start, chunk_tokens = None, 0
+
+            if chunk_start is None:
+                chunk_start = start
+            chunk_end = end
+            chunk_tokens += counts[i]
+
+        if chunk_start is not None:
+            yield self._chunk(text, chunk_start, chunk_end, chunk_tokens)
+
+    def _count_tokens(self, texts: List[str], batch_size: int = 1024) -> List[int]:
+        """Count the tokens of every text without special tokens, tokenizing in batches."""
+        counts = []
+        for start in range(0, len(texts), batch_size):
+            encoded = self.tokenizer(texts[start:start + batch_size], add_special_tokens=False)['input_ids']
+            counts.extend(len(ids) for ids in encoded)
+        return counts
+
+    def _split_long_sentence(self, text: str, start: int, end: int, budget: int) -> Iterator[Dict[str, Any]]:
+        """Cut a sentence longer than the budget into pieces of at most budget tokens."""
+        offsets = self.tokenizer(text[start:end], add_special_tokens=False, return_offsets_mapping=True)['offset_mapping']
+        for first in range(0, len(offsets), budget):
+            piece = offsets[first:first + budget]
+            yield self._chunk(text, start + piece[0][0], start + piece[-1][1], len(piece))
+
+    @staticmethod
+    def _chunk(text: str, start: int, end: int, token_count: int) -> Dict[str, Any]:
+        return {'text': text[start:end], 'start_index': start, 'end_index': end, 'token_count': token_count}
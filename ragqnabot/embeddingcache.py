@@ -0,0 +1,189 @@
+import os
+import sqlite3
+import threading
+import numpy as np
+from typing import Dict, Iterable, List, Optional, Set
+
+class EmbeddingCache:
+    """
+    A persistent on-disk cache of chunk embeddings, keyed by a hash of the chunk content.
+
+    The embeddings live in a memory-mapped float32 array (`embeddings.f32`) and a SQLite table
+    (`cache.sqlite`) maps every content hash to its row. The same database records which chunk
+    ids of each document were last upserted to each index, so re-ingesting a document only has
+    to upsert new chunks and delete stale ones.
+    """
+
+    def __init__(self, path: str, dimension: int = 384, model_name: str = 'all-MiniLM-L6-v2'):
+        """
+        Initialize the EmbeddingCache, creating the cache directory if needed.
+
+        Args:
+            path (str): The directory holding the cache files.
+            dimension (int): The embedding dimension. Default is 384.
+            model_name (str): The embedding model the cached vectors belong to. Default is 'all-MiniLM-L6-v2'.
+
+        Raises:
+            ValueError: If the directory holds a cache for another model or dimension.
+        """
+        os.makedirs(path, exist_ok=True)
+        self.path = path
+        self.dimension = dimension
+        self.model_name = model_name
+        self._lock = threading.Lock()
+        self._matrix_path = os.path.join(path, "embeddings.f32")
+
+        self._db = sqlite3.connect(os.path.join(path, "cache.sqlite"), check_same_thread=False)
+        with self._db:
+            self._db.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+            self._db.execute("CREATE TABLE IF NOT EXISTS embeddings (hash TEXT PRIMARY KEY, row INTEGER)")
+            self._db.execute("CREATE TABLE IF NOT EXISTS documents (scope TEXT, doc_id TEXT, chunk_id TEXT, PRIMARY KEY (scope, doc_id, chunk_id))")
+            self._db.execute("INSERT OR IGNORE INTO meta VALUES ('model_name', ?), ('dimension', ?)", (model_name, str(dimension)))
+        meta = dict(self._db.execute("SELECT key, value FROM meta"))
+        if meta["model_name"] != model_name or int(meta["dimension"]) != dimension:
+            raise ValueError(f"Cache at {path} holds {meta['model_name']} embeddings of dimension {meta['dimension']}, "
+                             f"not {model_name} of dimension {dimension}")
+
+        self._size = self._db.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+        self._matrix = None
+        self._open_matrix(max(self._size, 1024))
+
+    def __len__(self) -> int:
+        return self._size
+
+    def get_many(self, hashes: Iterable[str]) -> Dict[str, np.ndarray]:
+        """
+        Look up cached embeddings.
+
+        Args:
+            hashes (Iterable[str]): The content hashes to look up.
+
+        Returns:
+            Dict[str, np.ndarray]: The cached embeddings of the hashes that were found.
+        """
+        hashes = list(hashes)
+        found_hashes, found_rows = [], []
+        with self._lock:
+            # SQLite limits the number of bound parameters, so look the hashes up in slices.
+            for start in range(0, len(hashes), 500):
+                part = hashes[start:start + 500]
+                placeholders = ",".join("?" * len(part))
+                for content_hash, row in self._db.execute(f"SELECT hash, row FROM embeddings WHERE hash IN ({placeholders})", part):
+                    found_hashes.append(content_hash)
+                    found_rows.append(row)
+            embeddings = self._matrix[np.array(found_rows, dtype=np.int64)] if found_rows else None
+        return {content_hash: embeddings[i] for i, content_hash in enumerate(found_hashes)}
+
+    def put_many(self, hashes: List[str], embeddings: np.ndarray) -> None:
+        """
+        Store embeddings for the given content hashes. Hashes that are already cached are skipped.
+
+        Args:
+            hashes (List[str]): The content hashes, aligned with the rows of embeddings.
+            embeddings (np.ndarray): The embedding matrix.
+        """
+        with self._lock:
+            known = self._cached_hashes(hashes)
+            rows = []
+            new_indices = []
+            for i, content_hash in enumerate(hashes):
+                if content_hash not in known:
+                    known.add(content_hash)
+                    rows.append((content_hash, self._size + len(rows)))
+                    new_indices.append(i)
+            if not rows:
+                return
+
+            if self._size + len(rows) > len(self._matrix):
+                self._open_matrix(max(self._size + len(rows), 2 * len(self._matrix)))
+            self._matrix[self._size:self._size + len(rows)] = embeddings[new_indices]
+            self._matrix.flush()
+            # Commit the key rows only after the vectors are on disk.
+            with self._db:
+                self._db.executemany("INSERT INTO embeddings VALUES (?, ?)", rows)
+            self._size += len(rows)
+
+    def document_ids(self, scope: str, doc_id: str) -> Set[str]:
+        """
+        Return the chunk ids last recorded for a document in an index.
+
+        Args:
+            scope (str): The index the ids were upserted to, e.g. its name.
+            doc_id (str): The document id.
+
+        Returns:
+            Set[str]: The recorded chunk ids.
+        """
+        with self._lock:
+            return {chunk_id for chunk_id, in self._db.execute(
+                "SELECT chunk_id FROM documents WHERE scope = ? AND doc_id = ?", (scope, doc_id))}
+
+    def set_document_ids(self, scope: str, doc_id: str, chunk_ids: Iterable[str]) -> None:
+        """
+        Record the chunk ids of a document in an index, replacing the previous record.
+
+        Args:
+            scope (str): The index the ids were upserted to, e.g. its name.
+            doc_id (str): The document id.
+            chunk_ids (Iterable[str]): The chunk ids now in the index.
+        """
+        with self._lock, self._db:
+            self._db.execute("DELETE FROM documents WHERE scope = ? AND doc_id = ?", (scope, doc_id))
+            self._db.executemany("INSERT OR IGNORE INTO documents VALUES (?, ?, ?)",
+                                 [(scope, doc_id, chunk_id) for chunk_id in chunk_ids])
+
+    def recorded_ids(self, index_name: Optional[str], chunk_ids: Iterable[str]) -> Set[str]:
+        """
+        Return the chunk ids still recorded for a document in an index or in any of its namespaces.
+
+        Args:
+            index_name (Optional[str]): The name of the index. Its namespaces are recorded under the scopes
+                                        "<index_name>/<namespace>". None looks the ids up in every index.
+            chunk_ids (Iterable[str]): The chunk ids to look up.
+
+        Returns:
+            Set[str]: The chunk ids that are recorded.
+        """
+        chunk_ids = list(chunk_ids)
+        if index_name is None:
+            condition, parameters = "", []
+        else:
+            condition, parameters = "(scope = ? OR substr(scope, 1, ?) = ?) AND ", [index_name, len(index_name) + 1, f"{index_name}/"]
+        found = set()
+        with self._lock:
+            for start in range(0, len(chunk_ids), 500):
+                part = chunk_ids[start:start + 500]
+                placeholders = ",".join("?" * len(part))
+                found.update(chunk_id for chunk_id, in self._db.execute(
+                    f"SELECT chunk_id FROM documents WHERE {condition}chunk_id IN ({placeholders})", [*parameters, *part]))
+        return found
+
+    def close(self) -> None:
+        """Flush the embeddings and close the database."""
+        with self._lock:
+            if self._matrix is not None:
+                self._matrix.flush()
+                self._matrix = None
+            self._db.close()
+
+    def _cached_hashes(self, hashes: List[str]) -> Set[str]:
+        """Return the subset of hashes that are cached. The caller holds the lock."""
+        found = set()
+        for start in range(0, len(hashes), 500):
+            part = hashes[start:start + 500]
+            placeholders = ",".join("?" * len(part))
+            found.update(content_hash for content_hash, in self._db.execute(f"SELECT hash FROM embeddings WHERE hash IN ({placeholders})", part))
+        return found
+
+    def _open_matrix(self, capacity: int) -> None:
+        """(Re)map the embeddings file with room for capacity rows, growing the file if needed."""
+        if self._matrix is not None:
+            self._matrix.flush()
+            self._matrix = None
+        size = capacity * self.dimension * 4
+        with open(self._matrix_path, "ab") as file:
+            if file.tell() < size:
+                file.truncate(size)
+            else:
+                capacity = file.tell() // (self.dimension * 4)
+        self._matrix = np.memmap(self._matrix_path, dtype=np.float32, mode="r+", shape=(capacity, self.dimension))
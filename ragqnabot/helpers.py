@@ -1,7 +1,79 @@
+import json
+import random
+import threading
+import time
+import contextvars
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
 from ragqnabot.configs import PINECONE_API_KEY
-from pinecone import Pinecone, ServerlessSpec
+from ragqnabot.localindex import LocalIndex
+from ragqnabot.telemetry import telemetry
 
-def setup_pinecone(index_name, vectors, pinecone_api=PINECONE_API_KEY):
+# Pinecone rejects upsert requests larger than 2 MB.
+MAX_UPSERT_BYTES = 2 * 1024 * 1024
+
+_clients = {}
+_indexes = {}
+_lock = threading.Lock()
+
+def get_pinecone_client(pinecone_api=PINECONE_API_KEY):
+    """
+    Return a Pinecone client for the given API key, reusing the one created by an earlier call.
+
+    Args:
+        pinecone_api (str): The API key for authenticating with Pinecone.
+
+    Returns:
+        Pinecone: The shared Pinecone client.
+    """
+    with _lock:
+        client = _clients.get(pinecone_api)
+        if client is None:
+            # Imported here, so the local index and the upsert helpers do not require the Pinecone SDK.
+            from pinecone import Pinecone
+            client = Pinecone(api_key=pinecone_api)
+            _clients[pinecone_api] = client
+        return client
+
+def get_index(index_name, pinecone_api=PINECONE_API_KEY, create=False, dimension=384):
+    """
+    Return the Pinecone index object for the given name, reusing the one created by an earlier call.
+
+    Args:
+        index_name (str): The name of the index.
+        pinecone_api (str): The API key for authenticating with Pinecone.
+        create (bool): Whether to create the index if it does not exist yet.
+        dimension (int): The dimension of the index if it has to be created. Default is 384.
+
+    Returns:
+        Index: The Pinecone index object.
+
+    The existence check against the Pinecone control plane is only made the first time an index is requested.
+    """
+    key = (pinecone_api, index_name)
+    index = _indexes.get(key)
+    if index is not None:
+        return index
+
+    pinecone = get_pinecone_client(pinecone_api)
+    if create and index_name not in pinecone.list_indexes().names():
+        from pinecone import ServerlessSpec
+        pinecone.create_index(
+            name=index_name,
+            dimension=dimension,
+            metric="cosine",
+            spec=ServerlessSpec(
+                cloud="aws",
+                region="us-east-1"
+            )
+        )
+
+    index = pinecone.Index(index_name)
+    with _lock:
+        _indexes[key] = index
+    return index
+
+def setup_pinecone(index_name, vectors, pinecone_api=PINECONE_API_KEY, batch_size=100, max_workers=4, max_retries=3, progress_callback=None,
+                   namespace=None):
     """
     Set up a Pinecone index for storing and retrieving vector embeddings.
 
@@ -9,6 +81,12 @@ def setup_pinecone(index_name, vectors, pinecone_api=PINECONE_API_KEY):
         index_name (str): The name of the index to create or use.
         vectors (list): A list of vectors to be added to the index.
         pinecone_api (str): The API key for authenticating with Pinecone.
+        batch_size (int): The maximum number of vectors per upsert request. Default is 100.
+        max_workers (int): The number of upsert requests sent concurrently. Default is 4.
+        max_retries (int): The number of retries of a failed upsert request. Default is 3.
+        progress_callback (callable): Called after every upserted batch, see upsert_vectors.
+        namespace (str): The namespace to upload the vectors to, e.g. one per tenant, so that
+                         several tenants or documents share one index. Defaults to the default namespace.
 
     Returns:
         Index: The initialized Pinecone index object for further operations.
@@ -16,47 +94,152 @@ def setup_pinecone(index_name, vectors, pinecone_api=PINECONE_API_KEY):
     Raises:
         Exception: Raises an exception if there is an error during index creation or vector upsertion.
 
-    This function initializes a Pinecone client with the provided API key, checks if the index already exists,
-    creates it if necessary, and uploads the given vectors to the index.
+    This function reuses a shared Pinecone client, creates the index if it does not exist yet,
+    and uploads the given vectors to the index in concurrent, retried batches.
     """
-    pinecone = Pinecone(api_key=pinecone_api)
-    
     try:
-        # Check if the index already exists
-        if index_name not in pinecone.list_indexes():
-            pinecone.create_index(
-                name=index_name,
-                dimension=384,
-                metric="cosine",
-                spec=ServerlessSpec(
-                    cloud="aws",
-                    region="us-east-1"
-                )
-            )
-
-        index = pinecone.Index(index_name)
-        index.upsert(vectors=vectors)
-
+        index = get_index(index_name, pinecone_api, create=True)
+        upsert_vectors(index, vectors, batch_size=batch_size, max_workers=max_workers,
+                       max_retries=max_retries, progress_callback=progress_callback, namespace=namespace)
         return index
 
     except Exception as e:
         raise Exception(f"An error occurred while setting up the Pinecone index: {e}")
-    
+
+def upsert_vectors(index, vectors, batch_size=100, max_batch_bytes=MAX_UPSERT_BYTES, max_workers=4, max_retries=3, backoff=0.5, progress_callback=None, total=None,
+                   namespace=None):
+    """
+    Upsert vectors into an index in size-bounded batches sent through a bounded worker pool.
+
+    Args:
+        index: The index to upsert into, e.g. a Pinecone index or a LocalIndex.
+        vectors (iterable): The (id, values, metadata) tuples to upsert. May be a generator.
+        batch_size (int): The maximum number of vectors per batch. Default is 100.
+        max_batch_bytes (int): The maximum estimated request size of a batch. Default is 2 MB.
+        max_workers (int): The number of batches upserted concurrently. Default is 4.
+        max_retries (int): The number of retries of a failed batch, with exponential backoff. Default is 3.
+        backoff (float): The delay in seconds before the first retry. Default is 0.5.
+        progress_callback (callable): Called as progress_callback(upserted, total, vectors_per_sec) after
+                                      every batch. total is None when it is unknown.
+        total (int): The number of vectors, for progress reporting when vectors has no length.
+        namespace (str): The namespace to upsert into. Defaults to the default namespace.
+
+    Returns:
+        int: The number of upserted vectors.
+
+    Raises:
+        Exception: If a batch still fails after max_retries retries.
+
+    At most 2 * max_workers batches are in flight at any time, so a generator of vectors is
+    consumed only as fast as the index accepts them.
+    """
+    if total is None and hasattr(vectors, "__len__"):
+        total = len(vectors)
+    upserted = 0
+    start_time = time.perf_counter()
+
+    def batch_done(future):
+        nonlocal upserted
+        upserted += future.result()
+        if progress_callback:
+            elapsed = time.perf_counter() - start_time
+            progress_callback(upserted, total, upserted / elapsed if elapsed > 0 else 0.0)
+
+    with telemetry.span("upsert") as span, ThreadPoolExecutor(max_workers=max_workers) as executor:
+        pending = set()
+        for batch in _iter_batches(vectors, batch_size, max_batch_bytes):
+            if len(pending) >= 2 * max_workers:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    batch_done(future)
+            # Running the batch in a copy of the current context makes its span a child of the upsert span.
+            pending.add(executor.submit(contextvars.copy_context().run, _upsert_with_retry, index, batch, max_retries, backoff, namespace))
+        for future in pending:
+            batch_done(future)
+        span.set_attribute("vectors", upserted)
+
+    return upserted
+
+def _iter_batches(vectors, batch_size, max_batch_bytes):
+    """Group vectors into batches bounded by count and by estimated request size."""
+    batch, batch_bytes = [], 0
+    for vector in vectors:
+        vector_bytes = _estimate_size(vector)
+        if batch and (len(batch) >= batch_size or batch_bytes + vector_bytes > max_batch_bytes):
+            yield batch
+            batch, batch_bytes = [], 0
+        batch.append(vector)
+        batch_bytes += vector_bytes
+    if batch:
+        yield batch
+
+def _estimate_size(vector):
+    """Estimate the serialized size of a vector: about 20 bytes per float plus the id and metadata."""
+    if isinstance(vector, dict):
+        vector_id, values, metadata = vector["id"], vector["values"], vector.get("metadata")
+    else:
+        vector_id, values = vector[0], vector[1]
+        metadata = vector[2] if len(vector) > 2 else None
+    return 20 * len(values) + len(str(vector_id)) + (len(json.dumps(metadata)) if metadata else 0)
+
+def _upsert_with_retry(index, batch, max_retries, backoff, namespace=None):
+    """Upsert one batch, retrying with exponential backoff and jitter. Returns the batch size."""
+    # The namespace is only passed when given, so indexes without namespaces keep working.
+    kwargs = {"namespace": namespace} if namespace else {}
+    for attempt in range(max_retries + 1):
+        try:
+            with telemetry.span("upsert.batch", vectors=len(batch), attempt=attempt):
+                index.upsert(vectors=batch, **kwargs)
+            return len(batch)
+        except Exception as e:
+            if attempt == max_retries:
+                raise Exception(f"Upsert of {len(batch)} vectors failed after {max_retries + 1} attempts: {e}")
+            time.sleep(backoff * (2 ** attempt) * (1 + random.random()))
+
 def list_indexes(pinecone_api=PINECONE_API_KEY):
     """
     List all existing Pinecone indexes.
 
     Args:
-        pinecone_api (str): The API key for authenticating with Pinecone. 
+        pinecone_api (str): The API key for authenticating with Pinecone.
                             Defaults to the PINECONE_API_KEY from the configs.
 
     Returns:
         list: A list of index names.
 
     Description:
-        This function initializes a Pinecone client with the provided API key
+        This function reuses the shared Pinecone client for the provided API key
         and retrieves the names of all existing indexes.
     """
-    pinecone = Pinecone(api_key=pinecone_api)
+    pinecone = get_pinecone_client(pinecone_api)
     indexes = pinecone.list_indexes()
     return indexes
+
+def setup_local_index(vectors, dimension=384, mode="auto", batch_size=10000, namespace="", **kwargs):
+    """
+    Set up an in-process LocalIndex for storing and retrieving vector embeddings.
+
+    Args:
+        vectors (Iterable): The vectors to be added to the index, e.g. VectorStore.iter_vectors().
+        dimension (int): The dimension of the vectors. Default is 384.
+        mode (str): The search mode, "exact", "ivf" or "auto". Default is "auto".
+        batch_size (int): The number of vectors upserted at a time, which bounds the memory taken by
+                          vectors given as lists of floats. Default is 10000.
+        namespace (str): The namespace to add the vectors to. Default is "".
+        **kwargs: Further LocalIndex options, such as nlist, nprobe, storage and metadata_fields.
+
+    Returns:
+        LocalIndex: The populated index, usable wherever a Pinecone index is expected.
+
+    This function is the offline counterpart of setup_pinecone: no network round trips are made
+    when the returned index is queried.
+    """
+    index = LocalIndex(dimension=dimension, mode=mode, **kwargs)
+    batch = []
+    for vector in vectors:
+        batch.append(vector)
+        if len(batch) >= batch_size:
+            index.upsert(vectors=batch, namespace=namespace)
+            batch = []
+    index.upsert(vectors=batch, namespace=namespace)
+    return index
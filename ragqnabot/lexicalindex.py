@@ -0,0 +1,391 @@
+import os
+import re
+import json
+import threading
+import numpy as np
+from array import array
+from collections import Counter
+from typing import Dict, Iterable, List, Optional, Tuple
+
+# Words and identifiers such as "ERR-4021", "SKU_12.B" or "55-1234-A" are kept whole.
+TOKEN_PATTERN = re.compile(r'[^\W_]+(?:[-_./:#][^\W_]+)*')
+SEPARATOR_PATTERN = re.compile(r'[-_./:#]')
+
+def tokenize(text: str) -> List[str]:
+    """
+    Split a text into lowercase terms for lexical search.
+
+    Compound identifiers are indexed whole and by their parts, so "ERR-4021" matches the queries
+    "err-4021", "ERR 4021" and "4021".
+
+    Args:
+        text (str): The text to tokenize.
+
+    Returns:
+        List[str]: The terms, in order of occurrence.
+    """
+    terms = []
+    for match in TOKEN_PATTERN.finditer(text.lower()):
+        token = match.group()
+        terms.append(token)
+        if len(token) > 1 and SEPARATOR_PATTERN.search(token):
+            terms.extend(part for part in SEPARATOR_PATTERN.split(token) if part)
+    return terms
+
+
+class BM25Index:
+    """
+    A compact BM25 inverted index over chunk texts, for exact-term retrieval alongside the vectors.
+
+    Posting lists are stored in CSR form: one array of offsets per term into flat arrays of chunk
+    numbers (uint32) and term frequencies (uint16). Chunks added after the index was loaded go to
+    small per-term append-only arrays, which are merged into the flat arrays on save. Saved
+    indexes are loaded through memory-mapping, so loading is instant and the posting lists are
+    paged in by the OS as they are queried.
+    """
+
+    FILES = ("offsets.npy", "postings.npy", "frequencies.npy", "lengths.npy", "vocabulary.json", "ids.txt")
+
+    def __init__(self, k1: float = 1.2, b: float = 0.75, path: Optional[str] = None):
+        """
+        Initialize an empty BM25Index.
+
+        Args:
+            k1 (float): The BM25 term frequency saturation. Default is 1.2.
+            b (float): The BM25 length normalization. Default is 0.75.
+            path (Optional[str]): The directory the index is saved to by default.
+        """
+        self.k1 = k1
+        self.b = b
+        self.path = path
+        self._lock = threading.Lock()
+        self._ids: List[str] = []
+        self._numbers: Dict[str, int] = {}  # Chunk id -> chunk number
+        self._vocabulary: Dict[str, int] = {}  # Term -> term number
+        self._lengths = np.empty(0, dtype=np.uint32)
+        self._deleted = np.empty(0, dtype=bool)
+        self._deleted_count = 0
+        self._total_length = 0
+        self._norms = None  # k1 * (1 - b + b * length / average length), recomputed after changes
+
+        # Flat posting lists of the saved index, possibly memory-mapped
+        self._offsets = np.zeros(1, dtype=np.int64)
+        self._postings = np.empty(0, dtype=np.uint32)
+        self._frequencies = np.empty(0, dtype=np.uint16)
+        # Posting lists of the chunks added since, per term number
+        self._new_postings: Dict[int, Tuple[array, array]] = {}
+
+    def __len__(self) -> int:
+        return len(self._ids) - self._deleted_count
+
+    def __contains__(self, chunk_id: str) -> bool:
+        number = self._numbers.get(chunk_id)
+        return number is not None and not self._deleted[number]
+
+    @classmethod
+    def open(cls, path: str, **kwargs) -> "BM25Index":
+        """
+        Load the index saved in a directory, or create an empty one that will be saved there.
+
+        Args:
+            path (str): The index directory.
+            **kwargs: BM25 parameters for a new index.
+
+        Returns:
+            BM25Index: The index.
+        """
+        if os.path.exists(os.path.join(path, "vocabulary.json")):
+            return cls.load(path)
+        return cls(path=path, **kwargs)
+
+    @classmethod
+    def load(cls, path: str) -> "BM25Index":
+        """
+        Load a saved index, memory-mapping its posting lists.
+
+        Args:
+            path (str): The index directory.
+
+        Returns:
+            BM25Index: The loaded index.
+
+        Raises:
+            IOError: If the directory does not hold a saved index.
+        """
+        try:
+            with open(os.path.join(path, "vocabulary.json"), 'r', encoding='utf-8') as file:
+                header = json.load(file)
+            with open(os.path.join(path, "ids.txt"), 'r', encoding='utf-8') as file:
+                ids = file.read().split('\n')[:-1]
+            index = cls(k1=header["k1"], b=header["b"], path=path)
+            index._offsets = np.load(os.path.join(path, "offsets.npy"), mmap_mode='r')
+            index._postings = np.load(os.path.join(path, "postings.npy"), mmap_mode='r')
+            index._frequencies = np.load(os.path.join(path, "frequencies.npy"), mmap_mode='r')
+            lengths = np.load(os.path.join(path, "lengths.npy"))
+        except (OSError, ValueError, KeyError) as e:
+            raise IOError(f"Error loading the lexical index from {path}: {e}")
+
+        index._vocabulary = {term: number for number, term in enumerate(header["terms"])}
+        index._ids = ids
+        index._numbers = {chunk_id: number for number, chunk_id in enumerate(ids) if chunk_id}
+        index._lengths = lengths.astype(np.uint32)
+        index._deleted = np.array([not chunk_id for chunk_id in ids], dtype=bool)
+        index._deleted_count = int(index._deleted.sum())
+        index._total_length = int(lengths[~index._deleted].sum())
+        return index
+
+    def add(self, ids: Iterable[str], texts: Iterable[str]) -> int:
+        """
+        Index chunks. Chunks whose id is already indexed are skipped.
+
+        Args:
+            ids (Iterable[str]): The chunk ids, e.g. the VectorStore vector ids.
+            texts (Iterable[str]): The chunk texts, aligned with ids.
+
+        Returns:
+            int: The number of indexed chunks.
+        """
+        added = 0
+        with self._lock:
+            for chunk_id, text in zip(ids, texts):
+                if chunk_id in self._numbers:
+                    continue
+                number = len(self._ids)
+                terms = Counter(tokenize(text))
+                for term, frequency in terms.items():
+                    term_number = self._vocabulary.setdefault(term, len(self._vocabulary))
+                    postings = self._new_postings.get(term_number)
+                    if postings is None:
+                        postings = self._new_postings[term_number] = (array('I'), array('H'))
+                    postings[0].append(number)
+                    postings[1].append(min(frequency, 65535))
+
+                length = sum(terms.values())
+                self._ids.append(chunk_id)
+                self._numbers[chunk_id] = number
+                self._append_length(length)
+                self._total_length += length
+                added += 1
+            if added:
+                self._norms = None
+        return added
+
+    def delete(self, ids: Iterable[str]) -> int:
+        """
+        Remove chunks from the search results. Their postings are dropped when the index is saved.
+
+        Args:
+            ids (Iterable[str]): The chunk ids.
+
+        Returns:
+            int: The number of removed chunks.
+        """
+        deleted = 0
+        with self._lock:
+            for chunk_id in ids:
+                number = self._numbers.pop(chunk_id, None)
+                if number is None:
+                    continue
+                self._deleted[number] = True
+                self._ids[number] = ""
+                self._total_length -= int(self._lengths[number])
+                deleted += 1
+            if deleted:
+                self._deleted_count += deleted
+                self._norms = None
+        return deleted
+
+    def search(self, query: str, top_k: int = 10) -> List[Tuple[str, float]]:
+        """
+        Return the chunks with the highest BM25 score for a query.
+
+        Args:
+            query (str): The query.
+            top_k (int): The number of results. Default is 10.
+
+        Returns:
+            List[Tuple[str, float]]: (chunk id, score) tuples, highest score first. Chunks that contain
+            none of the query terms are not returned.
+        """
+        term_numbers = {self._vocabulary[term] for term in tokenize(query) if term in self._vocabulary}
+        if not term_numbers or top_k <= 0:
+            return []
+
+        with self._lock:
+            # Snapshot what a concurrent add may change; the new postings are copied out.
+            norms = self._current_norms()
+            deleted = self._deleted
+            ids = self._ids
+            count = len(self._ids) - self._deleted_count
+            offsets, postings, frequencies = self._offsets, self._postings, self._frequencies
+            new_postings = {number: (np.array(self._new_postings[number][0], dtype=np.uint32),
+                                     np.array(self._new_postings[number][1], dtype=np.uint16))
+                            for number in term_numbers if number in self._new_postings}
+
+        # Rarest terms first: they have the highest idf and the shortest posting lists.
+        terms = []
+        for number in term_numbers:
+            parts = []
+            if number + 1 < len(offsets):
+                start, end = offsets[number], offsets[number + 1]
+                parts.append((postings[start:end], frequencies[start:end]))
+            if number in new_postings:
+                parts.append(new_postings[number])
+            frequency_of_term = sum(len(chunk_numbers) for chunk_numbers, _ in parts)
+            idf = float(np.log1p((count - frequency_of_term + 0.5) / (frequency_of_term + 0.5)))
+            terms.append((frequency_of_term, idf, parts))
+        terms.sort(key=lambda term: term[0])
+
+        scores = np.zeros(len(norms), dtype=np.float32)
+        touched, touched_count = [], 0
+        candidates = None
+        for i, (frequency_of_term, idf, parts) in enumerate(terms):
+            # MaxScore pruning: once the remaining terms together cannot lift a chunk that has none of
+            # the terms scored so far above the current k-th best score, they only need to be scored
+            # for the chunks already found. Common words in a question are then nearly free.
+            bound = sum(idf * (self.k1 + 1) for _, idf, _ in terms[i:])
+            if touched and touched_count <= len(scores) // 8:
+                candidates = np.unique(np.concatenate(touched))
+                candidates = candidates[~deleted[candidates]]
+                if len(candidates) >= top_k and np.partition(scores[candidates], len(candidates) - top_k)[len(candidates) - top_k] > bound:
+                    for _, idf, parts in terms[i:]:
+                        for chunk_numbers, term_frequencies in parts:
+                            positions = np.searchsorted(chunk_numbers, candidates)
+                            found = positions < len(chunk_numbers)
+                            found[found] = chunk_numbers[positions[found]] == candidates[found]
+                            self._accumulate(scores, norms, idf, candidates[found], term_frequencies[positions[found]])
+                    break
+                candidates = None
+            for chunk_numbers, term_frequencies in parts:
+                self._accumulate(scores, norms, idf, chunk_numbers, term_frequencies)
+                touched.append(chunk_numbers)
+                touched_count += len(chunk_numbers)
+
+        if candidates is None:
+            if touched_count > len(scores) // 8:
+                candidates = np.flatnonzero(scores)
+            else:
+                candidates = np.unique(np.concatenate(touched))
+            candidates = candidates[~deleted[candidates]]
+        candidate_scores = scores[candidates]
+        if len(candidates) > top_k:
+            best = np.argpartition(-candidate_scores, top_k - 1)[:top_k]
+            candidates, candidate_scores = candidates[best], candidate_scores[best]
+        order = np.argsort(-candidate_scores, kind='stable')
+        return [(ids[candidates[i]], float(candidate_scores[i])) for i in order]
+
+    def _accumulate(self, scores: np.ndarray, norms: np.ndarray, idf: float, chunk_numbers: np.ndarray,
+                    term_frequencies: np.ndarray) -> None:
+        """Add the BM25 contribution of a term to the scores of the chunks that contain it."""
+        term_frequencies = term_frequencies.astype(np.float32)
+        scores[chunk_numbers] += idf * (self.k1 + 1) * term_frequencies / (term_frequencies + norms[chunk_numbers])
+
+    def save(self, path: Optional[str] = None) -> None:
+        """
+        Merge the chunks added since loading into the flat posting lists and write the index.
+
+        Every file is written next to its target and then renamed over it, so a reader that has the
+        previous version memory-mapped is not affected.
+
+        Args:
+            path (Optional[str]): The index directory. Defaults to the directory the index was opened from.
+
+        Raises:
+            ValueError: If no path is given and the index has none.
+        """
+        path = path or self.path
+        if path is None:
+            raise ValueError("No path given to save the lexical index to")
+        os.makedirs(path, exist_ok=True)
+
+        with self._lock:
+            self._merge()
+            terms = [None] * len(self._vocabulary)
+            for term, number in self._vocabulary.items():
+                terms[number] = term
+            arrays = {"offsets.npy": self._offsets, "postings.npy": self._postings,
+                      "frequencies.npy": self._frequencies, "lengths.npy": self._lengths[:len(self._ids)]}
+            for name, values in arrays.items():
+                with open(os.path.join(path, name + ".tmp"), 'wb') as file:
+                    np.save(file, values)
+            with open(os.path.join(path, "ids.txt.tmp"), 'w', encoding='utf-8') as file:
+                file.writelines(chunk_id + '\n' for chunk_id in self._ids)
+            with open(os.path.join(path, "vocabulary.json.tmp"), 'w', encoding='utf-8') as file:
+                json.dump({"k1": self.k1, "b": self.b, "terms": terms}, file)
+            # The vocabulary goes last: its presence marks a complete index for open().
+            for name in self.FILES:
+                os.replace(os.path.join(path, name + ".tmp"), os.path.join(path, name))
+            self.path = path
+
+    def _merge(self) -> None:
+        """Merge the new posting lists into the flat ones, dropping deleted chunks. The caller holds the lock."""
+        term_count = len(self._vocabulary)
+        old_counts = np.zeros(term_count, dtype=np.int64)
+        old_counts[:len(self._offsets) - 1] = np.diff(self._offsets)
+        new_counts = np.zeros(term_count, dtype=np.int64)
+        new_terms = sorted(self._new_postings)
+        for number in new_terms:
+            new_counts[number] = len(self._new_postings[number][0])
+
+        offsets = np.zeros(term_count + 1, dtype=np.int64)
+        np.cumsum(old_counts + new_counts, out=offsets[1:])
+        postings = np.empty(offsets[-1], dtype=np.uint32)
+        frequencies = np.empty(offsets[-1], dtype=np.uint16)
+
+        # Every term keeps its old postings first, then its new ones, so each list stays sorted.
+        old_offsets = np.zeros(term_count + 1, dtype=np.int64)
+        old_offsets[:len(self._offsets)] = self._offsets
+        old_offsets[len(self._offsets):] = self._offsets[-1]
+        shift = np.repeat(offsets[:-1] - old_offsets[:-1], old_counts)
+        destination = np.arange(len(self._postings), dtype=np.int64) + shift
+        postings[destination] = self._postings
+        frequencies[destination] = self._frequencies
+        for number in new_terms:
+            chunk_numbers, term_frequencies = self._new_postings[number]
+            start = offsets[number] + old_counts[number]
+            postings[start:start + len(chunk_numbers)] = chunk_numbers
+            frequencies[start:start + len(chunk_numbers)] = term_frequencies
+
+        if self._deleted_count:
+            postings, frequencies, offsets = self._drop_deleted(postings, frequencies, offsets)
+        self._offsets, self._postings, self._frequencies = offsets, postings, frequencies
+        self._new_postings = {}
+
+    def _drop_deleted(self, postings: np.ndarray, frequencies: np.ndarray, offsets: np.ndarray):
+        """Remove the postings of deleted chunks and renumber the remaining chunks."""
+        keep = ~self._deleted[postings]
+        terms = np.repeat(np.arange(len(offsets) - 1), np.diff(offsets))[keep]
+        offsets = np.zeros_like(offsets)
+        np.cumsum(np.bincount(terms, minlength=len(offsets) - 1), out=offsets[1:])
+
+        alive = np.flatnonzero(~self._deleted[:len(self._ids)])
+        renumber = np.zeros(len(self._ids), dtype=np.uint32)
+        renumber[alive] = np.arange(len(alive), dtype=np.uint32)
+        self._ids = [self._ids[number] for number in alive]
+        self._numbers = {chunk_id: number for number, chunk_id in enumerate(self._ids)}
+        self._lengths = self._lengths[alive].copy()
+        self._deleted = np.zeros(len(alive), dtype=bool)
+        self._deleted_count = 0
+        self._norms = None
+        return renumber[postings[keep]], frequencies[keep], offsets
+
+    def _append_length(self, length: int) -> None:
+        """Append a chunk length, growing the arrays geometrically. The caller holds the lock."""
+        size = len(self._ids) - 1
+        if size >= len(self._lengths):
+            capacity = max(1024, 2 * len(self._lengths))
+            lengths = np.zeros(capacity, dtype=np.uint32)
+            lengths[:size] = self._lengths[:size]
+            deleted = np.zeros(capacity, dtype=bool)
+            deleted[:size] = self._deleted[:size]
+            self._lengths, self._deleted = lengths, deleted
+        self._lengths[size] = length
+
+    def _current_norms(self) -> np.ndarray:
+        """Return the BM25 length norms, recomputing them after changes. The caller holds the lock."""
+        if self._norms is None:
+            count = len(self._ids) - self._deleted_count
+            average = self._total_length / count if count else 1.0
+            lengths = self._lengths[:len(self._ids)].astype(np.float32)
+            self._norms = (self.k1 * (1 - self.b + self.b * lengths / max(average, 1e-9))).astype(np.float32)
+        return self._norms
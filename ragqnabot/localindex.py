@@ -0,0 +1,614 @@
+import copy
+import tempfile
+import threading
+import numpy as np
+from abc import ABC, abstractmethod
+from ragqnabot.metadatafilter import MetadataIndex
+from ragqnabot.quantization import MetadataTable, get_quantizer
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple, Union
+
+class BaseIndex(ABC):
+    """
+    The vector index interface used by VectorStore.
+
+    It mirrors the subset of the Pinecone `Index` API that the pipeline relies on, so a Pinecone
+    index and a LocalIndex can be used interchangeably.
+    """
+
+    @abstractmethod
+    def upsert(self, vectors: Iterable[Union[Tuple, Dict[str, Any]]], namespace: str = "") -> Dict[str, int]:
+        """Insert or overwrite vectors given as (id, values[, metadata]) tuples or dicts in a namespace."""
+
+    @abstractmethod
+    def query(self, vector: Sequence[float], top_k: int = 10, include_values: bool = False, include_metadata: bool = False,
+              filter: Optional[Dict[str, Any]] = None, namespace: str = "") -> Dict[str, Any]:
+        """Return the top_k most similar vectors of a namespace matching a metadata filter as {"matches": [{"id", "score", ...}]}."""
+
+    @abstractmethod
+    def fetch(self, ids: List[str], namespace: str = "") -> Dict[str, Any]:
+        """Return the stored vectors of a namespace as {"vectors": {id: {"id", "values", "metadata"}}}."""
+
+    @abstractmethod
+    def delete(self, ids: Optional[List[str]] = None, delete_all: bool = False, namespace: str = "",
+               filter: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        """Delete the vectors of a namespace with the given ids, matching a metadata filter, or all of them."""
+
+    @abstractmethod
+    def describe_index_stats(self) -> Dict[str, Any]:
+        """Return basic statistics about the index."""
+
+
+class LocalIndex(BaseIndex):
+    """
+    An in-process vector index backed by a NumPy matrix, usable as a drop-in replacement for a
+    Pinecone index.
+
+    Two search modes are available:
+        - "exact": brute-force similarity over every stored vector.
+        - "ivf": an inverted file index. Vectors are clustered with k-means and a query only
+          scores the vectors of the `nprobe` closest clusters.
+    The default "auto" mode searches exactly until the index holds `ivf_threshold` vectors.
+
+    With a quantized storage ("float16", "int8" or "pq"), only compact codes of the vectors are
+    kept in memory and scored. The float32 vectors live in a memory-mapped file and are read only
+    to re-score the best candidates exactly. The metadata is then kept in string tables instead of
+    Python dicts.
+
+    Like a Pinecone index, the index is partitioned into namespaces, e.g. one per tenant: every
+    operation applies to one namespace, the default "" unless given. Queries can be restricted to
+    the vectors whose metadata matches a filter in Pinecone's filter language (see
+    matches_filter). The filter is evaluated on a MetadataIndex of posting lists and number
+    columns instead of the metadata itself, and selective filters are searched exactly over the
+    matching rows only, which is cheaper than an unfiltered search.
+    """
+
+    def __init__(self, dimension: int = 384, metric: str = "cosine", mode: str = "auto", nlist: Optional[int] = None,
+                 nprobe: int = 8, ivf_threshold: int = 50000, storage: str = "float32", rescore: int = 4,
+                 vectors_path: Optional[str] = None, pq_subspaces: Optional[int] = None,
+                 metadata_fields: Optional[Iterable[str]] = None):
+        """
+        Initialize the LocalIndex.
+
+        Args:
+            dimension (int): The dimension of the stored vectors. Default is 384.
+            metric (str): "cosine" or "dotproduct". For "cosine" the vectors are stored L2-normalized. Default is "cosine".
+            mode (str): "exact", "ivf" or "auto". Default is "auto".
+            nlist (Optional[int]): The number of IVF clusters. Defaults to about 4 * sqrt(number of vectors).
+            nprobe (int): The number of IVF clusters scanned per query. Default is 8.
+            ivf_threshold (int): The number of vectors from which "auto" mode switches to IVF. Default is 50000.
+            storage (str): "float32" keeps the vectors in memory. "float16", "int8" and "pq" keep 2, 1 and 1/8 bytes
+                           per dimension in memory, and the float32 vectors on disk. Default is "float32".
+            rescore (int): With a quantized storage, the rescore * top_k best candidates are re-scored with the
+                           float32 vectors. 0 returns the approximate scores. Default is 4.
+            vectors_path (Optional[str]): The file holding the float32 vectors of a quantized storage.
+                                          Defaults to an anonymous temporary file.
+            pq_subspaces (Optional[int]): The number of bytes per vector of the "pq" storage. Defaults to dimension / 8.
+            metadata_fields (Optional[Iterable[str]]): The metadata fields that can be filtered on.
+                                                       Defaults to every field except "text".
+
+        Raises:
+            ValueError: If the metric, mode or storage is unsupported.
+        """
+        if metric not in ("cosine", "dotproduct"):
+            raise ValueError(f"Unsupported metric: {metric}. Available metrics: cosine, dotproduct")
+        if mode not in ("exact", "ivf", "auto"):
+            raise ValueError(f"Unsupported mode: {mode}. Available modes: exact, ivf, auto")
+
+        self.dimension = dimension
+        self.metric = metric
+        self.mode = mode
+        self.nlist = nlist
+        self.nprobe = nprobe
+        self.ivf_threshold = ivf_threshold
+        self.storage = storage
+        self.rescore = rescore
+        self.vectors_path = vectors_path
+
+        self._matrix = np.empty((0, dimension), dtype=np.float32)
+        self._size = 0  # Number of used rows in self._matrix, including deleted ones
+        self._alive = np.empty(0, dtype=bool)
+        self._norms = np.empty(0, dtype=np.float32)  # L2 norm of every upserted vector; cosine rows are stored normalized
+        self._ids: List[str] = []
+        self._metadata: List[Optional[Dict[str, Any]]] = []
+
+        # Quantized storage: codes of the rows below _coded_size, and the file behind self._matrix.
+        self._quantizer = None
+        if storage != "float32":
+            self._quantizer = get_quantizer(storage, dimension, **({"m": pq_subspaces} if storage == "pq" else {}))
+            self._codes = np.empty((0, self._quantizer.code_size), dtype=np.uint8)
+            self._metadata = MetadataTable()
+        self._coded_size = 0
+        self._trained_size = 0
+        self._file = None
+        self._rows: Dict[str, int] = {}  # Key of (namespace, id) -> row
+        self._namespace = np.empty(0, dtype=np.int32)  # Namespace code of every row
+        self._namespaces: Dict[str, int] = {"": 0}  # Namespace -> code
+        self._namespace_names: List[str] = [""]
+        self._metadata_index = MetadataIndex(fields=metadata_fields)
+        self._lock = threading.Lock()  # Serializes writers, e.g. concurrent batches from upsert_vectors
+
+        # IVF state: centroids, row indices grouped by cluster, and the number of rows covered.
+        self._centroids = None
+        self._list_rows = None
+        self._list_offsets = None
+        self._ivf_size = 0
+
+    def __len__(self) -> int:
+        return len(self._rows)
+
+    def upsert(self, vectors: Iterable[Union[Tuple, Dict[str, Any]]], namespace: str = "") -> Dict[str, int]:
+        """
+        Insert or overwrite vectors.
+
+        Args:
+            vectors (Iterable[Union[Tuple, Dict[str, Any]]]): Vectors as (id, values), (id, values, metadata)
+                tuples or {"id", "values", "metadata"} dicts, as accepted by Pinecone.
+            namespace (str): The namespace of the vectors. Default is "".
+
+        Returns:
+            Dict[str, int]: {"upserted_count": number of upserted vectors}.
+        """
+        ids, values, metadatas = [], [], []
+        for vector in vectors:
+            if isinstance(vector, dict):
+                ids.append(str(vector["id"]))
+                values.append(vector["values"])
+                metadatas.append(vector.get("metadata"))
+            else:
+                ids.append(str(vector[0]))
+                values.append(vector[1])
+                metadatas.append(vector[2] if len(vector) > 2 else None)
+        if not ids:
+            return {"upserted_count": 0}
+
+        values = np.asarray(values, dtype=np.float32).reshape(len(ids), -1)
+        if values.shape[1] != self.dimension:
+            raise ValueError(f"Vector dimension {values.shape[1]} does not match index dimension {self.dimension}")
+        norms = np.linalg.norm(values, axis=1).astype(np.float32)
+        matrix = self._prepare(values)
+
+        with self._lock:
+            self._insert(ids, matrix, norms, metadatas, namespace)
+        return {"upserted_count": len(ids)}
+
+    def query(self, vector: Sequence[float], top_k: int = 10, include_values: bool = False, include_metadata: bool = False,
+              filter: Optional[Dict[str, Any]] = None, namespace: str = "") -> Dict[str, Any]:
+        """
+        Return the top_k vectors most similar to the query vector, highest score first.
+
+        Args:
+            vector (Sequence[float]): The query vector.
+            top_k (int): The number of matches to return. Default is 10.
+            include_values (bool): Whether to include the upserted values in each match (see fetch).
+            include_metadata (bool): Whether to include the stored metadata in each match.
+            filter (Optional[Dict[str, Any]]): A metadata filter the matches must match, e.g. {"doc_id": "manual.pdf"}.
+            namespace (str): The namespace to search. Default is "".
+
+        Returns:
+            Dict[str, Any]: {"matches": [{"id", "score"[, "values"][, "metadata"]}], "namespace": namespace}.
+
+        Raises:
+            ValueError: If the filter is malformed or uses a field that is not indexed.
+        """
+        query = self._prepare(np.asarray(vector, dtype=np.float32).reshape(1, -1))[0]
+        rows, scores = self._search(query, top_k, self._allowed(namespace, filter))
+
+        matches = []
+        for row, score in zip(rows, scores):
+            match = {"id": self._ids[row], "score": float(score)}
+            if include_values:
+                match["values"] = self._values(row).tolist()
+            if include_metadata:
+                match["metadata"] = self._metadata[row]
+            matches.append(match)
+        return {"matches": matches, "namespace": namespace}
+
+    def fetch(self, ids: List[str], namespace: str = "") -> Dict[str, Any]:
+        """
+        Return the stored vectors for the given ids. Unknown ids are skipped.
+
+        As with Pinecone, the values are those upserted, up to float32 rounding: with the cosine
+        metric, the normalized stored vector is scaled back by the norm kept for it.
+
+        Args:
+            ids (List[str]): The ids to fetch.
+            namespace (str): The namespace of the vectors. Default is "".
+
+        Returns:
+            Dict[str, Any]: {"vectors": {id: {"id", "values", "metadata"}}, "namespace": namespace}.
+        """
+        vectors = {}
+        for vector_id in ids:
+            row = self._rows.get(self._key(namespace, vector_id))
+            if row is not None:
+                vectors[vector_id] = {
+                    "id": vector_id,
+                    "values": self._values(row).tolist(),
+                    "metadata": self._metadata[row],
+                }
+        return {"vectors": vectors, "namespace": namespace}
+
+    def delete(self, ids: Optional[List[str]] = None, delete_all: bool = False, namespace: str = "",
+               filter: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        """
+        Delete vectors by id, by metadata filter, or every vector of a namespace when delete_all is True.
+
+        Args:
+            ids (Optional[List[str]]): The ids to delete. Unknown ids are ignored.
+            delete_all (bool): Whether to delete every vector of the namespace.
+            namespace (str): The namespace of the vectors. Default is "".
+            filter (Optional[Dict[str, Any]]): A metadata filter; the vectors matching it are deleted.
+
+        Returns:
+            Dict[str, Any]: An empty dict, as returned by Pinecone.
+        """
+        with self._lock:
+            if delete_all or filter:
+                allowed = self._allowed(namespace, filter if not delete_all else None)
+                rows = np.flatnonzero(self._alive[:self._size] if allowed is None else allowed)
+                keys = [self._key(namespace, self._ids[row]) for row in rows]
+            else:
+                keys = [self._key(namespace, str(vector_id)) for vector_id in ids or []]
+            for key in keys:
+                row = self._rows.pop(key, None)
+                if row is not None:
+                    self._alive[row] = False
+                    self._metadata[row] = None
+
+            # Reclaim the space once more than half of the rows are deleted.
+            if self._size and len(self._rows) < self._size // 2:
+                self._compact()
+        return {}
+
+    def describe_index_stats(self) -> Dict[str, Any]:
+        """Return the dimension, vector count per namespace, storage and active search mode of the index."""
+        counts = np.bincount(self._namespace[:self._size][self._alive[:self._size]], minlength=len(self._namespace_names))
+        return {
+            "dimension": self.dimension,
+            "total_vector_count": len(self._rows),
+            "namespaces": {name: {"vector_count": int(count)} for name, count in zip(self._namespace_names, counts) if count},
+            "metric": self.metric,
+            "mode": self._active_mode(),
+            "storage": self.storage,
+        }
+
+    def memory_usage(self) -> Dict[str, int]:
+        """
+        Return the bytes of memory taken by the stored vectors and their metadata, excluding the spare
+        capacity reserved for future upserts.
+
+        Returns:
+            Dict[str, int]: The "vectors" (float32 vectors, 0 when they are on disk), "codes", "metadata"
+            (the string tables; the size of the dicts is not measured with the float32 storage) and "total" bytes.
+        """
+        usage = {
+            "vectors": 0 if self._quantizer is not None else self._matrix[:self._size].nbytes,
+            "codes": self._codes[:self._coded_size].nbytes if self._quantizer is not None else 0,
+            "metadata": self._metadata.nbytes() if isinstance(self._metadata, MetadataTable) else 0,
+        }
+        usage["total"] = sum(usage.values())
+        return usage
+
+    @staticmethod
+    def _key(namespace: str, vector_id: str) -> str:
+        """Return the key of a vector in self._rows; ids of the default namespace are their own key."""
+        return f"{namespace}\x00{vector_id}" if namespace else vector_id
+
+    def _insert(self, ids: List[str], matrix: np.ndarray, norms: np.ndarray, metadatas: List[Optional[Dict[str, Any]]],
+                namespace: str = "") -> None:
+        """Overwrite existing rows and append new ones, given the prepared vectors and the norms of the upserted ones."""
+        code = self._namespaces.get(namespace)
+        if code is None:
+            code = self._namespaces[namespace] = len(self._namespace_names)
+            self._namespace_names.append(namespace)
+
+        new_rows = {}  # id -> position in the batch; a repeated id keeps its last vector
+        overwritten = {}  # row -> its previous metadata
+        for i, vector_id in enumerate(ids):
+            row = self._rows.get(self._key(namespace, vector_id))
+            if row is None:
+                new_rows[vector_id] = i
+            else:
+                overwritten.setdefault(row, self._metadata[row])
+                self._matrix[row] = matrix[i]
+                self._norms[row] = norms[i]
+                self._metadata[row] = metadatas[i]
+                if row < self._coded_size:
+                    self._codes[row] = self._quantizer.encode(matrix[i:i + 1])[0]
+
+        if overwritten:
+            self._metadata_index.remove(list(overwritten), list(overwritten.values()))
+            for row in overwritten:
+                self._metadata_index.add(row, self._metadata[row])
+
+        if new_rows:
+            self._reserve(self._size + len(new_rows))
+            start = self._size
+            self._namespace[start:start + len(new_rows)] = code
+            self._matrix[start:start + len(new_rows)] = matrix[list(new_rows.values())]
+            self._norms[start:start + len(new_rows)] = norms[list(new_rows.values())]
+            self._alive[start:start + len(new_rows)] = True
+            if self._quantizer is not None and self._quantizer.trained and self._coded_size == start:
+                self._codes[start:start + len(new_rows)] = self._quantizer.encode(matrix[list(new_rows.values())])
+                self._coded_size = start + len(new_rows)
+            for offset, (vector_id, i) in enumerate(new_rows.items()):
+                self._rows[self._key(namespace, vector_id)] = start + offset
+                self._ids.append(vector_id)
+                self._metadata.append(metadatas[i])
+                self._metadata_index.add(start + offset, metadatas[i])
+            self._size += len(new_rows)
+
+        # Overwritten vectors may now belong to another cluster.
+        if len(new_rows) < len(ids):
+            self._reset_ivf()
+
+    def _values(self, row: int) -> np.ndarray:
+        """Return the vector of a row as it was upserted."""
+        if self.metric == "cosine":
+            return self._matrix[row] * self._norms[row]
+        return self._matrix[row]
+
+    def _prepare(self, matrix: np.ndarray) -> np.ndarray:
+        """L2-normalize vectors for the cosine metric."""
+        if self.metric == "cosine":
+            norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+            norms[norms == 0] = 1.0
+            matrix = matrix / norms
+        return matrix
+
+    def _reserve(self, capacity: int) -> None:
+        """Grow the storage geometrically so repeated upserts are amortized O(1) per vector."""
+        if capacity <= len(self._matrix):
+            return
+        new_capacity = max(capacity, 2 * len(self._matrix), 1024)
+        if self._quantizer is None:
+            matrix = np.empty((new_capacity, self.dimension), dtype=np.float32)
+            matrix[:self._size] = self._matrix[:self._size]
+        else:
+            matrix = self._map_vectors(new_capacity)
+            codes = np.empty((new_capacity, self._codes.shape[1]), dtype=np.uint8)
+            codes[:self._coded_size] = self._codes[:self._coded_size]
+            self._codes = codes
+        alive = np.zeros(new_capacity, dtype=bool)
+        alive[:self._size] = self._alive[:self._size]
+        namespace = np.zeros(new_capacity, dtype=np.int32)
+        namespace[:self._size] = self._namespace[:self._size]
+        norms = np.zeros(new_capacity, dtype=np.float32)
+        norms[:self._size] = self._norms[:self._size]
+        self._matrix, self._alive, self._namespace, self._norms = matrix, alive, namespace, norms
+
+    def _map_vectors(self, capacity: int) -> np.memmap:
+        """(Re)map the file of float32 vectors with room for capacity rows, growing the file."""
+        if self._file is None:
+            self._file = open(self.vectors_path, "w+b") if self.vectors_path else tempfile.TemporaryFile()
+        if isinstance(self._matrix, np.memmap):
+            self._matrix.flush()
+        self._file.truncate(capacity * self.dimension * 4)
+        return np.memmap(self._file, dtype=np.float32, mode="r+", shape=(capacity, self.dimension))
+
+    def _compact(self) -> None:
+        """Drop deleted rows from the storage and renumber the remaining ones."""
+        keep = np.flatnonzero(self._alive[:self._size])
+        if self._quantizer is None:
+            self._matrix = self._matrix[keep].copy()
+            self._alive = np.ones(len(keep), dtype=bool)
+        else:
+            # Move the kept rows down in place; row keep[i] is never below row i, so no kept row is overwritten early.
+            for start in range(0, len(keep), 65536):
+                block = keep[start:start + 65536]
+                self._matrix[start:start + len(block)] = self._matrix[block]
+            coded = keep[keep < self._coded_size]
+            self._codes[:len(coded)] = self._codes[coded]
+            self._coded_size = len(coded)
+            self._alive[:] = False
+            self._alive[:len(keep)] = True
+        namespace = np.zeros(len(self._alive), dtype=np.int32)
+        namespace[:len(keep)] = self._namespace[keep]
+        self._namespace = namespace
+        norms = np.zeros(len(self._alive), dtype=np.float32)
+        norms[:len(keep)] = self._norms[keep]
+        self._norms = norms
+        self._ids = [self._ids[row] for row in keep]
+        if isinstance(self._metadata, MetadataTable):
+            self._metadata = self._metadata.take(keep)
+        else:
+            self._metadata = [self._metadata[row] for row in keep]
+        mapping = np.full(self._size, -1, dtype=np.int64)
+        mapping[keep] = np.arange(len(keep))
+        self._metadata_index.remap(mapping)
+        self._rows = {self._key(self._namespace_names[code], vector_id): row
+                      for row, (vector_id, code) in enumerate(zip(self._ids, namespace[:len(keep)].tolist()))}
+        self._size = len(keep)
+        self._reset_ivf()
+
+    def _active_mode(self) -> str:
+        if self.mode == "auto":
+            return "ivf" if len(self._rows) >= self.ivf_threshold else "exact"
+        return self.mode
+
+    def _allowed(self, namespace: str, filter: Optional[Dict[str, Any]]) -> Optional[np.ndarray]:
+        """Return the mask of the live rows in a namespace that match a filter, or None if that is every live row."""
+        size = self._size
+        code = self._namespaces.get(namespace)
+        if code is None:
+            return np.zeros(size, dtype=bool)
+        mask = self._namespace[:size] == code if len(self._namespace_names) > 1 else None
+        if filter:
+            matched = self._metadata_index.evaluate(filter, size)
+            mask = matched if mask is None else mask & matched
+        return mask & self._alive[:size] if mask is not None else None
+
+    def _candidates(self, query: np.ndarray, top_k: int, allowed: Optional[np.ndarray]) -> np.ndarray:
+        """Return the rows to score: the live rows, or the rows of the probed IVF clusters, restricted to the allowed rows."""
+        ivf = self._active_mode() == "ivf" and len(self._rows) > 0
+        if allowed is None:
+            return self._ivf_candidates(query) if ivf else np.flatnonzero(self._alive[:self._size])
+        rows = np.flatnonzero(allowed)
+        if ivf:
+            # Probing nprobe / selectivity clusters finds about as many allowed rows as an unfiltered search scores.
+            # Those clusters hold fewer rows than are allowed once selectivity ** 2 > nprobe / nlist; for more
+            # selective filters, scoring every allowed row is cheaper, and exact.
+            centroids = self._centroids
+            nlist = len(centroids) if centroids is not None else self.nlist or max(1, int(4 * np.sqrt(len(self._rows))))
+            selectivity = len(rows) / max(1, len(self._rows))
+            if selectivity ** 2 * nlist > self.nprobe:
+                candidates = self._ivf_candidates(query, int(np.ceil(self.nprobe / selectivity)))
+                candidates = candidates[candidates < len(allowed)]
+                candidates = candidates[allowed[candidates]]
+                # Too few matching rows in the probed clusters, e.g. for a filter uncorrelated with them.
+                if len(candidates) >= top_k:
+                    return candidates
+        return rows
+
+    def _search(self, query: np.ndarray, top_k: int, allowed: Optional[np.ndarray] = None) -> Tuple[np.ndarray, np.ndarray]:
+        """Return the rows and scores of the top_k matches for a prepared query vector among the allowed rows."""
+        if self._quantizer is not None:
+            return self._quantized_search(query, top_k, allowed)
+        candidates = self._candidates(query, top_k, allowed)
+        # Scoring the whole matrix is faster than gathering the candidate rows once they are more than a quarter of it.
+        if len(candidates) > self._size // 4:
+            scores = (self._matrix[:self._size] @ query)[candidates]
+        else:
+            scores = self._matrix[candidates] @ query
+        return self._top_k(candidates, scores, top_k)
+
+    def _quantized_search(self, query: np.ndarray, top_k: int, allowed: Optional[np.ndarray] = None) -> Tuple[np.ndarray, np.ndarray]:
+        """Score the codes, then re-score the best rescore * top_k candidates with the float32 vectors."""
+        self._train_quantizer()
+        candidates = self._candidates(query, top_k, allowed)
+        # Codes and the quantizer that encoded them, as replaced together by a retraining, and a size
+        # that covers the candidates while writers append rows.
+        with self._lock:
+            quantizer, codes, coded_size, size = self._quantizer, self._codes, self._coded_size, self._size
+        if len(candidates) <= size // 4:
+            coded = candidates < coded_size
+            scores = np.empty(len(candidates), dtype=np.float32)
+            for start in range(0, len(candidates), 65536):
+                block = slice(start, start + 65536)
+                scores[block][coded[block]] = quantizer.score(codes[candidates[block][coded[block]]], query)
+            scores[~coded] = self._matrix[candidates[~coded]] @ query
+        else:
+            scores = np.empty(size, dtype=np.float32)
+            for start in range(0, coded_size, 65536):
+                end = min(start + 65536, coded_size)
+                scores[start:end] = quantizer.score(codes[start:end], query)
+            scores[coded_size:] = self._matrix[coded_size:size] @ query
+            scores = scores[candidates]
+
+        if self.rescore <= 0:
+            return self._top_k(candidates, scores, top_k)
+        candidates, _ = self._top_k(candidates, scores, self.rescore * top_k)
+        candidates = np.sort(candidates)  # Read the file in order
+        return self._top_k(candidates, self._matrix[candidates] @ query, top_k)
+
+    def _train_quantizer(self) -> None:
+        """Train the product quantizer on a sample of the stored vectors and encode them, once enough vectors are stored."""
+        if not self._quantizer_due():
+            return
+        # The training holds the lock, so it does not race writers, and a concurrent query that
+        # waited for the lock finds the quantizer trained already.
+        with self._lock:
+            if not self._quantizer_due():
+                return
+            rows = np.flatnonzero(self._alive[:self._size])
+            sample = np.sort(np.random.default_rng(0).choice(rows, min(len(rows), 65536), replace=False))
+            # A trained copy and new codes replace the old ones, which running queries keep scoring with.
+            quantizer = copy.copy(self._quantizer)
+            quantizer.train(self._matrix[sample])
+            codes = np.empty_like(self._codes)
+            codes[:self._size] = self._encode_rows(quantizer, 0, self._size)
+            self._quantizer, self._codes = quantizer, codes
+            self._coded_size = self._size
+            self._trained_size = len(sample)
+
+    def _quantizer_due(self) -> bool:
+        """Return whether the product quantizer needs to be trained or retrained."""
+        # Scalar quantizers need no training and encode the vectors as they are upserted.
+        if self.storage != "pq":
+            return False
+        # The product quantizer is retrained as the index grows, until it has seen 65536 vectors.
+        if self._quantizer.trained:
+            return self._trained_size < 65536 and self._size >= 4 * self._trained_size
+        return self._size >= 1024
+
+    def _encode_rows(self, quantizer, start: int, end: int) -> np.ndarray:
+        """Encode the stored vectors of rows start to end with a quantizer, in blocks."""
+        codes = np.empty((end - start, quantizer.code_size), dtype=np.uint8)
+        for block in range(start, end, 65536):
+            codes[block - start:min(block + 65536, end) - start] = quantizer.encode(self._matrix[block:min(block + 65536, end)])
+        return codes
+
+    @staticmethod
+    def _top_k(rows: np.ndarray, scores: np.ndarray, top_k: int) -> Tuple[np.ndarray, np.ndarray]:
+        """Select the top_k highest scores in O(n) and sort only those."""
+        if top_k <= 0:
+            return rows[:0], scores[:0]
+        if top_k < len(scores):
+            selected = np.argpartition(-scores, top_k - 1)[:top_k]
+            rows, scores = rows[selected], scores[selected]
+        order = np.argsort(-scores, kind="stable")
+        return rows[order], scores[order]
+
+    def _reset_ivf(self) -> None:
+        self._centroids = None
+        self._list_rows = None
+        self._list_offsets = None
+        self._ivf_size = 0
+
+    def _ivf_candidates(self, query: np.ndarray, nprobe: Optional[int] = None) -> np.ndarray:
+        """Return the live rows in the nprobe closest clusters plus rows added since the last training."""
+        # The clusters are trained and read under the lock, so a query sees them as written together.
+        with self._lock:
+            # Retrain once the rows not covered by the clusters exceed 10% of the covered ones.
+            if self._centroids is None or self._size - self._ivf_size > max(1000, self._ivf_size // 10):
+                self._train_ivf()
+            centroids, list_rows, list_offsets, ivf_size = self._centroids, self._list_rows, self._list_offsets, self._ivf_size
+
+        nprobe = min(nprobe or self.nprobe, len(centroids))
+        probes = np.argpartition(-(centroids @ query), nprobe - 1)[:nprobe]
+        candidates = [list_rows[list_offsets[c]:list_offsets[c + 1]] for c in probes]
+        candidates.append(np.arange(ivf_size, self._size))
+        candidates = np.concatenate(candidates)
+        return candidates[self._alive[candidates]]
+
+    def _train_ivf(self, iterations: int = 10, seed: int = 0) -> None:
+        """Cluster the stored vectors with k-means and group the rows by cluster. The caller holds the lock."""
+        rows = np.flatnonzero(self._alive[:self._size])
+        nlist = self.nlist or max(1, int(4 * np.sqrt(len(rows))))
+        nlist = min(nlist, len(rows))
+        rng = np.random.default_rng(seed)
+
+        # Train on a sample; 32 points per cluster is plenty for coarse quantization.
+        sample = self._matrix[rng.choice(rows, min(len(rows), 32 * nlist), replace=False)]
+        centroids = sample[rng.choice(len(sample), nlist, replace=False)].copy()
+        for _ in range(iterations):
+            assignments = self._assign(sample, centroids)
+            counts = np.bincount(assignments, minlength=nlist)
+            order = np.argsort(assignments, kind="stable")
+            sums = np.zeros_like(centroids)
+            nonempty = np.flatnonzero(counts)
+            sums[nonempty] = np.add.reduceat(sample[order], np.concatenate([[0], np.cumsum(counts)])[nonempty], axis=0)
+            empty = counts == 0
+            centroids = (sums / np.maximum(counts, 1)[:, None]).astype(np.float32)
+            centroids[empty] = sample[rng.choice(len(sample), int(empty.sum()))]
+            if self.metric == "cosine":
+                norms = np.linalg.norm(centroids, axis=1, keepdims=True)
+                norms[norms == 0] = 1.0
+                centroids /= norms
+
+        assignments = self._assign(self._matrix[:self._size], centroids)
+        order = np.argsort(assignments, kind="stable")
+        counts = np.bincount(assignments, minlength=nlist)
+        self._centroids = centroids
+        self._list_rows = order
+        self._list_offsets = np.concatenate([[0], np.cumsum(counts)])
+        self._ivf_size = self._size
+
+    @staticmethod
+    def _assign(matrix: np.ndarray, centroids: np.ndarray, block_size: int = 65536) -> np.ndarray:
+        """Return the index of the most similar centroid for every row, computed in blocks to bound memory."""
+        assignments = np.empty(len(matrix), dtype=np.int64)
+        for start in range(0, len(matrix), block_size):
+            block = matrix[start:start + block_size]
+            assignments[start:start + len(block)] = np.argmax(block @ centroids.T, axis=1)
+        return assignments
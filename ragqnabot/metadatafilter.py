@@ -0,0 +1,299 @@
+import numpy as np
+from numbers import Number
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+# The comparison operators of Pinecone's metadata filter language; $and and $or combine filters.
+OPERATORS = ("$eq", "$ne", "$gt", "$gte", "$lt", "$lte", "$in", "$nin", "$exists")
+
+_PRESENT = object()  # Stands for the rows holding a field, rather than one of its values, in MetadataIndex.remove
+
+def _is_number(value: Any) -> bool:
+    return isinstance(value, Number) and not isinstance(value, bool)
+
+def _equal(value: Any, target: Any) -> bool:
+    """Compare a metadata value with a filter value like Pinecone: numbers by value, True is not 1."""
+    if _is_number(value) and _is_number(target):
+        return float(value) == float(target)
+    return type(value) is type(target) and value == target
+
+def _conditions(filter: Dict[str, Any]):
+    """Yield the (field, operator, operand) conditions and the ("$and" / "$or", subfilters) of a filter."""
+    if not isinstance(filter, dict):
+        raise ValueError(f"A metadata filter must be a dict, got {type(filter).__name__}")
+    for field, condition in filter.items():
+        if field in ("$and", "$or"):
+            if not isinstance(condition, list):
+                raise ValueError(f"{field} takes a list of filters, got {condition!r}")
+            yield field, None, condition
+        elif isinstance(condition, dict):
+            for operator, operand in condition.items():
+                yield field, _check(operator, operand), operand
+        else:
+            yield field, "$eq", condition
+
+def _check(operator: str, operand: Any) -> str:
+    """Validate an operator and its operand, returning the operator."""
+    if operator not in OPERATORS:
+        raise ValueError(f"Unsupported filter operator: {operator}. Available operators: {', '.join(OPERATORS)}, $and, $or")
+    if operator in ("$in", "$nin") and not isinstance(operand, list):
+        raise ValueError(f"{operator} takes a list of values, got {operand!r}")
+    if operator in ("$gt", "$gte", "$lt", "$lte") and not _is_number(operand):
+        raise ValueError(f"{operator} takes a number, got {operand!r}")
+    if operator == "$exists" and not isinstance(operand, bool):
+        raise ValueError(f"$exists takes true or false, got {operand!r}")
+    return operator
+
+def matches_filter(metadata: Optional[Dict[str, Any]], filter: Optional[Dict[str, Any]]) -> bool:
+    """
+    Return whether a metadata dict matches a filter in Pinecone's metadata filter language.
+
+    A filter maps fields to values, e.g. {"doc_id": "manual.pdf"}, or to operators, e.g.
+    {"page": {"$gte": 10, "$lt": 20}}; several fields must all match. "$and" and "$or" combine a
+    list of filters. A field holding a list of strings matches $eq and $in when any element does.
+    $ne and $nin also match metadata without the field.
+
+    Args:
+        metadata (Optional[Dict[str, Any]]): The metadata. None matches only an empty filter.
+        filter (Optional[Dict[str, Any]]): The filter. None or {} matches everything.
+
+    Returns:
+        bool: Whether the metadata matches.
+
+    Raises:
+        ValueError: If the filter is malformed.
+    """
+    if not filter:
+        return True
+    metadata = metadata or {}
+    for field, operator, operand in _conditions(filter):
+        if field == "$and":
+            matched = all(matches_filter(metadata, subfilter) for subfilter in operand)
+        elif field == "$or":
+            matched = any(matches_filter(metadata, subfilter) for subfilter in operand)
+        else:
+            matched = _matches_condition(metadata, field, operator, operand)
+        if not matched:
+            return False
+    return True
+
+def _matches_condition(metadata: Dict[str, Any], field: str, operator: str, operand: Any) -> bool:
+    if operator == "$exists":
+        return (field in metadata) == operand
+    if field not in metadata:
+        return operator in ("$ne", "$nin")
+    value = metadata[field]
+    values = value if isinstance(value, list) else [value]
+    if operator in ("$eq", "$ne"):
+        return any(_equal(item, operand) for item in values) == (operator == "$eq")
+    if operator in ("$in", "$nin"):
+        return any(_equal(item, target) for item in values for target in operand) == (operator == "$in")
+    if not _is_number(value):
+        return False
+    if operator == "$gt":
+        return value > operand
+    if operator == "$gte":
+        return value >= operand
+    if operator == "$lt":
+        return value < operand
+    return value <= operand
+
+
+class _Postings:
+    """A growable array of rows; readers take a view of the rows appended so far, which later appends never change."""
+
+    __slots__ = ("rows", "size")
+
+    def __init__(self):
+        self.rows = np.empty(4, dtype=np.int64)
+        self.size = 0
+
+    def append(self, row: int) -> None:
+        if self.size == len(self.rows):
+            rows = np.empty(2 * len(self.rows), dtype=np.int64)
+            rows[:self.size] = self.rows[:self.size]
+            self.rows = rows
+        self.rows[self.size] = row
+        self.size += 1
+
+    def replace(self, rows: np.ndarray) -> None:
+        # A new array, so that views taken by readers stay valid.
+        self.rows = np.concatenate([rows, np.empty(max(4, len(rows)) - len(rows), dtype=np.int64)])
+        self.size = len(rows)
+
+    def view(self) -> np.ndarray:
+        return self.rows[:self.size]
+
+
+class MetadataIndex:
+    """
+    Indexes of the metadata of the rows of a LocalIndex, which evaluate a metadata filter to a
+    boolean mask of the matching rows without reading the metadata.
+
+    - Strings, booleans and the strings of lists have posting lists: the rows holding each value.
+      $eq and $in only read the postings of their values.
+    - Numbers are stored in a float64 column per field, NaN where a row has no number. $eq, $in
+      and the range operators compare the whole column at once, at 8 bytes per row and field.
+
+    The masks of the conditions are combined with NumPy's bitwise operators. Deleted rows stay in
+    the indexes until `remap` drops them; the caller masks them out.
+    """
+
+    def __init__(self, fields: Optional[Iterable[str]] = None, exclude: Iterable[str] = ("text",)):
+        """
+        Initialize an empty MetadataIndex.
+
+        Args:
+            fields (Optional[Iterable[str]]): The fields to index. Defaults to every field not excluded.
+            exclude (Iterable[str]): The fields not indexed when fields is None. Default is ("text",), since
+                                     long unique values only cost memory.
+        """
+        self.fields = set(fields) if fields is not None else None
+        self.exclude = set(exclude)
+        self._postings: Dict[str, Dict[Any, _Postings]] = {}  # field -> value -> rows
+        self._present: Dict[str, _Postings] = {}  # field -> rows holding a string, boolean or list
+        self._numbers: Dict[str, np.ndarray] = {}  # field -> float64 column
+        self._capacity = 0
+
+    def indexed(self, field: str) -> bool:
+        """Return whether a field is indexed and can be filtered on."""
+        return field in self.fields if self.fields is not None else field not in self.exclude
+
+    def add(self, row: int, metadata: Optional[Dict[str, Any]]) -> None:
+        """Index the metadata of a new or overwritten row. The previous metadata of an overwritten row must be removed first."""
+        for field, value in (metadata or {}).items():
+            if not self.indexed(field):
+                continue
+            if _is_number(value):
+                self._column(field, row)[row] = value
+                continue
+            values = value if isinstance(value, list) else [value]
+            postings = self._postings.setdefault(field, {})
+            for item in dict.fromkeys(item for item in values if isinstance(item, (str, bool))):
+                postings.setdefault(item, _Postings()).append(row)
+            self._present.setdefault(field, _Postings()).append(row)
+
+    def remove(self, rows: List[int], metadatas: List[Optional[Dict[str, Any]]]) -> None:
+        """Remove the metadata of rows from the indexes, e.g. before the rows are overwritten."""
+        removed: Dict[Tuple[str, Any], List[int]] = {}  # (field, value) -> rows; (field, _PRESENT) for self._present
+        for row, metadata in zip(rows, metadatas):
+            for field, value in (metadata or {}).items():
+                if not self.indexed(field):
+                    continue
+                if _is_number(value):
+                    self._numbers[field][row] = np.nan
+                    continue
+                values = value if isinstance(value, list) else [value]
+                for item in dict.fromkeys(item for item in values if isinstance(item, (str, bool))):
+                    removed.setdefault((field, item), []).append(row)
+                removed.setdefault((field, _PRESENT), []).append(row)
+
+        # One pass over every affected posting list, however many of its rows are removed.
+        for (field, value), value_rows in removed.items():
+            postings = self._present[field] if value is _PRESENT else self._postings[field][value]
+            postings.replace(postings.view()[~np.isin(postings.view(), value_rows)])
+
+    def remap(self, mapping: np.ndarray) -> None:
+        """
+        Renumber the rows after a LocalIndex dropped its deleted rows.
+
+        Args:
+            mapping (np.ndarray): The new row of every old row, -1 for dropped rows.
+        """
+        keep = np.flatnonzero(mapping >= 0)
+        for field, column in self._numbers.items():
+            self._numbers[field] = column[keep[keep < len(column)]].copy()
+        self._capacity = len(keep)
+        for field, postings in list(self._postings.items()):
+            for value, rows in list(postings.items()):
+                self._remap_postings(rows, mapping)
+                if not rows.size:
+                    del postings[value]
+        for rows in self._present.values():
+            self._remap_postings(rows, mapping)
+
+    @staticmethod
+    def _remap_postings(postings: _Postings, mapping: np.ndarray) -> None:
+        rows = mapping[postings.view()]
+        postings.replace(rows[rows >= 0])
+
+    def evaluate(self, filter: Dict[str, Any], size: int) -> np.ndarray:
+        """
+        Evaluate a filter on the rows below size.
+
+        Args:
+            filter (Dict[str, Any]): The filter, see matches_filter.
+            size (int): The number of rows.
+
+        Returns:
+            np.ndarray: A boolean mask of the matching rows. Deleted rows are not masked out.
+
+        Raises:
+            ValueError: If the filter is malformed or uses a field that is not indexed.
+        """
+        mask = np.ones(size, dtype=bool)
+        for field, operator, operand in _conditions(filter):
+            if field == "$and":
+                for subfilter in operand:
+                    mask &= self.evaluate(subfilter, size)
+            elif field == "$or":
+                matched = np.zeros(size, dtype=bool)
+                for subfilter in operand:
+                    matched |= self.evaluate(subfilter, size)
+                mask &= matched
+            else:
+                mask &= self._evaluate_condition(field, operator, operand, size)
+        return mask
+
+    def _evaluate_condition(self, field: str, operator: str, operand: Any, size: int) -> np.ndarray:
+        if not self.indexed(field):
+            raise ValueError(f"The metadata field {field!r} is not indexed and cannot be filtered on")
+        if operator in ("$ne", "$nin"):
+            return ~self._evaluate_condition(field, "$eq" if operator == "$ne" else "$in", operand, size)
+        if operator == "$exists":
+            mask = self._mark(self._present.get(field), size) | self._number_mask(field, size, lambda column: ~np.isnan(column))
+            return mask if operand else ~mask
+
+        targets = operand if operator == "$in" else [operand]
+        if operator in ("$eq", "$in"):
+            mask = np.zeros(size, dtype=bool)
+            postings = self._postings.get(field, {})
+            for target in targets:
+                if isinstance(target, (str, bool)):
+                    self._mark(postings.get(target), size, mask)
+            numbers = [float(target) for target in targets if _is_number(target)]
+            if numbers:
+                mask |= self._number_mask(field, size, lambda column: np.isin(column, numbers))
+            return mask
+        compare = {"$gt": np.greater, "$gte": np.greater_equal, "$lt": np.less, "$lte": np.less_equal}[operator]
+        return self._number_mask(field, size, lambda column: compare(column, operand))
+
+    @staticmethod
+    def _mark(postings: Optional[_Postings], size: int, mask: Optional[np.ndarray] = None) -> np.ndarray:
+        """Set the rows of a posting list in a mask, ignoring rows appended concurrently beyond size."""
+        mask = np.zeros(size, dtype=bool) if mask is None else mask
+        if postings is not None:
+            rows = postings.view()
+            mask[rows[rows < size]] = True
+        return mask
+
+    def _number_mask(self, field: str, size: int, predicate) -> np.ndarray:
+        """Apply a vectorized predicate to the number column of a field; rows without a number are False."""
+        mask = np.zeros(size, dtype=bool)
+        column = self._numbers.get(field)
+        if column is not None:
+            end = min(size, len(column))
+            with np.errstate(invalid='ignore'):
+                mask[:end] = predicate(column[:end])
+        return mask
+
+    def _column(self, field: str, row: int) -> np.ndarray:
+        """Return the number column of a field with room for row, growing every column geometrically."""
+        if row >= self._capacity:
+            self._capacity = max(row + 1, 2 * self._capacity, 1024)
+        column = self._numbers.get(field)
+        if column is None or len(column) < self._capacity:
+            grown = np.full(self._capacity, np.nan)
+            if column is not None:
+                grown[:len(column)] = column
+            self._numbers[field] = column = grown
+        return column
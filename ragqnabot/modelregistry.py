@@ -0,0 +1,118 @@
+import threading
+from typing import TYPE_CHECKING, Dict, List, Optional, Set, Tuple
+
+# sentence_transformers imports torch, which takes seconds: it is only imported when a model is loaded.
+if TYPE_CHECKING:
+    from sentence_transformers import SentenceTransformer
+
+class ModelRegistry:
+    """
+    A thread-safe registry of loaded SentenceTransformer models, keyed by model name and device.
+
+    Models are loaded lazily on first use and shared by every caller afterwards, so a process
+    holds at most one copy of each model's weights.
+    """
+
+    def __init__(self):
+        """Initialize an empty ModelRegistry."""
+        self._models: Dict[Tuple[str, Optional[str]], "SentenceTransformer"] = {}
+        self._load_locks: Dict[Tuple[str, Optional[str]], threading.Lock] = {}
+        self._warmed: Set[Tuple[str, Optional[str]]] = set()  # Keys whose model has run its warm-up encode
+        self._lock = threading.Lock()
+
+    def get(self, model_name: str, device: Optional[str] = None) -> "SentenceTransformer":
+        """
+        Return the model for the given name and device, loading it on first use.
+
+        Args:
+            model_name (str): The name of the sentence transformer model.
+            device (Optional[str]): The device to load the model on, e.g. "cpu" or "cuda".
+                                    None lets SentenceTransformer pick one.
+
+        Returns:
+            SentenceTransformer: The shared model instance.
+        """
+        key = (model_name, device)
+        model = self._models.get(key)
+        if model is not None:
+            return model
+
+        # Only one thread loads a given model; other models can load concurrently.
+        with self._lock:
+            load_lock = self._load_locks.setdefault(key, threading.Lock())
+        with load_lock:
+            model = self._models.get(key)
+            if model is None:
+                from sentence_transformers import SentenceTransformer
+                model = SentenceTransformer(model_name, device=device)
+                with self._lock:
+                    self._models[key] = model
+        return model
+
+    def warm_up(self, model_name: str, device: Optional[str] = None) -> "SentenceTransformer":
+        """
+        Load the model if needed and run one encode call, so the first real query does not pay for it.
+
+        The encode call runs once per model and device, also when the model was already loaded by `get`.
+
+        Args:
+            model_name (str): The name of the sentence transformer model.
+            device (Optional[str]): The device to load the model on.
+
+        Returns:
+            SentenceTransformer: The shared model instance.
+        """
+        key = (model_name, device)
+        model = self.get(model_name, device)
+        if key in self._warmed:
+            return model
+
+        with self._lock:
+            load_lock = self._load_locks.setdefault(key, threading.Lock())
+        with load_lock:
+            if key not in self._warmed:
+                model.encode("warm up")
+                with self._lock:
+                    self._warmed.add(key)
+        return model
+
+    def evict(self, model_name: Optional[str] = None, device: Optional[str] = None) -> int:
+        """
+        Drop loaded models from the registry so their memory can be reclaimed.
+
+        Args:
+            model_name (Optional[str]): The model to evict. None evicts every model.
+            device (Optional[str]): The device of the model to evict. Ignored when model_name is None.
+
+        Returns:
+            int: The number of evicted models.
+        """
+        with self._lock:
+            if model_name is None:
+                keys = list(self._models)
+            else:
+                keys = [key for key in self._models if key == (model_name, device)]
+            for key in keys:
+                del self._models[key]
+                self._load_locks.pop(key, None)
+                self._warmed.discard(key)
+        return len(keys)
+
+    def loaded(self) -> List[Tuple[str, Optional[str]]]:
+        """Return the (model_name, device) keys of the currently loaded models."""
+        return list(self._models)
+
+
+_registry = ModelRegistry()
+
+def get_model(model_name: str = 'all-MiniLM-L6-v2', device: Optional[str] = None) -> "SentenceTransformer":
+    """Return the process-wide shared model for the given name and device."""
+    return _registry.get(model_name, device)
+
+def warm_up_model(model_name: str = 'all-MiniLM-L6-v2', device: Optional[str] = None) -> "SentenceTransformer":
+    """Load and warm up the process-wide shared model for the given name and device."""
+    return _registry.warm_up(model_name, device)
+
+def evict_model(model_name: Optional[str] = None, device: Optional[str] = None) -> int:
+    """Evict models from the process-wide registry. Evicts every model when model_name is None."""
+    return _registry.evict(model_name, device)
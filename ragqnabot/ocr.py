@@ -0,0 +1,257 @@
+import io
+import os
+import sqlite3
+import hashlib
+import threading
+import numpy as np
+from concurrent.futures import Future, ProcessPoolExecutor
+from typing import TYPE_CHECKING, Dict, List, Optional, Union
+from ragqnabot.configs import OCR_CACHE_DIR, OCR_WORKERS
+
+# pytesseract imports pandas, so it is only imported where an image is recognized.
+if TYPE_CHECKING:
+    from PIL import Image
+
+def preprocess_image(image: "Image.Image", target_dpi: int = 300, dpi: Optional[float] = None, max_side: int = 4000,
+                     binarize: bool = True) -> "Image.Image":
+    """
+    Prepare an image for OCR: upright, grayscale, downscaled to target_dpi and binarized.
+
+    Tesseract is most accurate around 300 DPI. Phone photos and high-resolution scans hold several
+    times as many pixels, which only slow it down, so larger images are downscaled. Binarizing with
+    Otsu's threshold removes background shading and JPEG noise.
+
+    Args:
+        image (Image.Image): The image.
+        target_dpi (int): The resolution to downscale to. Default is 300.
+        dpi (Optional[float]): The resolution of the image, e.g. derived from the page size of a scanned PDF.
+                               Defaults to the resolution in the image file, if any.
+        max_side (int): The maximum width and height in pixels, for images without a known resolution. Default is 4000.
+        binarize (bool): Whether to convert the image to black and white. Default is True.
+
+    Returns:
+        Image.Image: The preprocessed grayscale image.
+    """
+    from PIL import Image, ImageOps
+    dpi = dpi or (image.info.get("dpi") or (None,))[0]
+    image = ImageOps.exif_transpose(image)
+    if image.mode in ("RGBA", "LA", "P"):
+        # Transparent areas would turn black, so put the image on a white background first.
+        background = Image.new("RGBA", image.size, "white")
+        image = Image.alpha_composite(background, image.convert("RGBA"))
+    image = image.convert("L")
+
+    scale = target_dpi / dpi if dpi and dpi > target_dpi else 1.0
+    scale = min(scale, max_side / max(image.size))
+    if scale < 1.0:
+        size = (max(1, round(image.width * scale)), max(1, round(image.height * scale)))
+        image = image.resize(size, Image.Resampling.LANCZOS, reducing_gap=3.0)
+    if binarize:
+        threshold = _otsu_threshold(image)
+        image = image.point([0] * (threshold + 1) + [255] * (255 - threshold))
+    return image
+
+def _otsu_threshold(image: "Image.Image") -> int:
+    """Return the gray level that best separates the histogram of a grayscale image into two classes."""
+    probabilities = np.asarray(image.histogram(), dtype=np.float64)
+    probabilities /= probabilities.sum()
+    weight = np.cumsum(probabilities)
+    mean = np.cumsum(probabilities * np.arange(256))
+    with np.errstate(divide='ignore', invalid='ignore'):
+        between = (mean[-1] * weight - mean) ** 2 / (weight * (1.0 - weight))
+    return int(np.argmax(np.nan_to_num(between, nan=0.0, posinf=0.0)))
+
+def _init_worker() -> None:
+    """Limit Tesseract to one thread per process: pages run in parallel already, and its OpenMP threads would oversubscribe the CPU."""
+    os.environ["OMP_THREAD_LIMIT"] = "1"
+
+def _recognize(data: bytes, lang: str, config: str, target_dpi: int, binarize: bool, dpi: Optional[float]) -> str:
+    """Preprocess an encoded image and OCR it. Runs in a worker process, so it must be a module-level function."""
+    import pytesseract
+    from PIL import Image
+    with Image.open(io.BytesIO(data)) as image:
+        image = preprocess_image(image, target_dpi=target_dpi, dpi=dpi, binarize=binarize)
+        return pytesseract.image_to_string(image, lang=lang, config=config)
+
+
+class OCRCache:
+    """
+    A persistent on-disk cache of OCR results, keyed by a hash of the image bytes and the OCR
+    settings, so re-ingesting the same scans skips Tesseract.
+
+    The texts live in a SQLite database in write-ahead-log mode, which lets the worker processes
+    of a BulkLoader share one cache.
+    """
+
+    def __init__(self, path: str):
+        """
+        Initialize the OCRCache, creating the cache directory if needed.
+
+        Args:
+            path (str): The directory holding the cache database.
+        """
+        os.makedirs(path, exist_ok=True)
+        self.path = path
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(os.path.join(path, "ocr.sqlite"), timeout=30, check_same_thread=False)
+        with self._db:
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute("CREATE TABLE IF NOT EXISTS texts (key TEXT PRIMARY KEY, text TEXT)")
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._db.execute("SELECT COUNT(*) FROM texts").fetchone()[0]
+
+    def get(self, key: str) -> Optional[str]:
+        """Return the cached text for a key, or None."""
+        with self._lock:
+            row = self._db.execute("SELECT text FROM texts WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else None
+
+    def put(self, key: str, text: str) -> None:
+        """Store the text for a key."""
+        with self._lock, self._db:
+            self._db.execute("INSERT OR REPLACE INTO texts VALUES (?, ?)", (key, text))
+
+    def close(self) -> None:
+        with self._lock:
+            self._db.close()
+
+
+class OCREngine:
+    """
+    Runs Tesseract OCR on images and scanned PDF pages.
+
+    Images are preprocessed (see preprocess_image) and recognized on a pool of worker processes,
+    one page per process, so the pages of a scanned PDF are recognized in parallel. Results are
+    looked up in and stored to an optional OCRCache.
+    """
+
+    def __init__(self, lang: str = "eng", target_dpi: int = 300, binarize: bool = True, config: str = "",
+                 max_workers: Optional[int] = None, cache: Optional[OCRCache] = None):
+        """
+        Initialize the OCREngine.
+
+        Args:
+            lang (str): The Tesseract language(s), e.g. "eng" or "eng+deu". Default is "eng".
+            target_dpi (int): The resolution images are downscaled to. Default is 300.
+            binarize (bool): Whether to binarize images before OCR. Default is True.
+            config (str): Extra Tesseract options, e.g. "--psm 6". Default is "".
+            max_workers (Optional[int]): The number of OCR processes. 1 runs OCR in the calling thread.
+                                         Defaults to OCR_WORKERS, or the number of CPUs if that is 0.
+            cache (Optional[OCRCache]): The cache of OCR results. Default is None (no caching).
+        """
+        self.lang = lang
+        self.target_dpi = target_dpi
+        self.binarize = binarize
+        self.config = config
+        self.max_workers = max_workers or OCR_WORKERS or os.cpu_count() or 1
+        self.cache = cache
+        self._pool = None
+        self._lock = threading.Lock()
+        self.recognized = 0
+        self.cached = 0
+
+    def image_to_text(self, image: Union[str, bytes], dpi: Optional[float] = None) -> str:
+        """
+        OCR one image.
+
+        Args:
+            image (Union[str, bytes]): The path of the image file, or its encoded bytes.
+            dpi (Optional[float]): The resolution of the image, if not stored in the file.
+
+        Returns:
+            str: The recognized text.
+        """
+        return self.submit(image, dpi).result()
+
+    def images_to_text(self, images: List[Union[str, bytes]]) -> List[str]:
+        """OCR several images in parallel and return their texts, in order."""
+        return [future.result() for future in [self.submit(image) for image in images]]
+
+    def submit(self, image: Union[str, bytes], dpi: Optional[float] = None) -> Future:
+        """
+        Start the OCR of one image.
+
+        Args:
+            image (Union[str, bytes]): The path of the image file, or its encoded bytes.
+            dpi (Optional[float]): The resolution of the image, if not stored in the file.
+
+        Returns:
+            Future: The future of the recognized text. It is already done when the text was cached.
+        """
+        if isinstance(image, str):
+            with open(image, 'rb') as file:
+                image = file.read()
+        args = (self.lang, self.config, self.target_dpi, self.binarize, round(dpi) if dpi else None)
+        key = hashlib.blake2b(image + repr(args).encode('utf-8'), digest_size=20).hexdigest()
+
+        text = self.cache.get(key) if self.cache is not None else None
+        if text is not None:
+            with self._lock:
+                self.cached += 1
+            future = Future()
+            future.set_result(text)
+            return future
+
+        if self.max_workers == 1:
+            future = Future()
+            try:
+                future.set_result(_recognize(image, *args))
+            except Exception as e:
+                future.set_exception(e)
+        else:
+            future = self._get_pool().submit(_recognize, image, *args)
+        future.add_done_callback(lambda done: self._store(key, done))
+        return future
+
+    def stats(self) -> Dict[str, int]:
+        """Return the number of images "recognized" by Tesseract and answered from the cache ("cached")."""
+        with self._lock:
+            return {"recognized": self.recognized, "cached": self.cached}
+
+    def close(self) -> None:
+        """Shut down the worker processes."""
+        with self._lock:
+            if self._pool is not None:
+                self._pool.shutdown()
+                self._pool = None
+
+    def _get_pool(self) -> ProcessPoolExecutor:
+        with self._lock:
+            if self._pool is None:
+                self._pool = ProcessPoolExecutor(max_workers=self.max_workers, initializer=_init_worker)
+            return self._pool
+
+    def _store(self, key: str, future: Future) -> None:
+        if future.cancelled() or future.exception() is not None:
+            return
+        with self._lock:
+            self.recognized += 1
+        if self.cache is not None:
+            self.cache.put(key, future.result())
+
+
+_default_engine = None
+_default_lock = threading.Lock()
+
+def get_ocr_engine() -> OCREngine:
+    """
+    Return the OCR engine used by DocumentLoaders created without one, creating it on first use.
+
+    Its cache lives in OCR_CACHE_DIR; set that environment variable to an empty string to disable it.
+
+    Returns:
+        OCREngine: The shared engine.
+    """
+    global _default_engine
+    with _default_lock:
+        if _default_engine is None:
+            _default_engine = OCREngine(cache=OCRCache(OCR_CACHE_DIR) if OCR_CACHE_DIR else None)
+        return _default_engine
+
+def set_ocr_engine(engine: OCREngine) -> None:
+    """Replace the OCR engine used by DocumentLoaders created without one."""
+    global _default_engine
+    with _default_lock:
+        _default_engine = engine
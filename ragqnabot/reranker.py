@@ -0,0 +1,173 @@
+import time
+import hashlib
+import threading
+import numpy as np
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple, Union
+from ragqnabot.telemetry import telemetry
+
+class CrossEncoderReranker:
+    """
+    A re-ranking stage that scores retrieved chunks against the query with a small local cross-encoder.
+
+    The vector search over-fetches candidates (num_candidates), the cross-encoder reads the query and
+    each candidate together, and only the top_n best candidates go to generation. This gives the
+    answer quality of a larger k without its prompt tokens.
+
+    Scores are cached per (query, chunk text) pair, so repeated questions and candidates shared by
+    several searches are only scored once. With a latency budget, re-ranking is skipped, and the
+    search order kept, whenever scoring the uncached candidates is expected to exceed it. While
+    queries are skipped, every probe_interval-th one scores as many of its candidates as fit in the
+    budget, so that the estimate recovers once scoring gets faster again.
+    """
+
+    def __init__(self, model_name: str = 'cross-encoder/ms-marco-MiniLM-L-6-v2', top_n: int = 3, num_candidates: int = 12,
+                 batch_size: int = 16, max_length: int = 512, latency_budget: Optional[float] = None, cache_size: int = 10000,
+                 device: str = "cpu", probe_interval: int = 10):
+        """
+        Initialize the CrossEncoderReranker.
+
+        Args:
+            model_name (str): The cross-encoder model. Default is 'cross-encoder/ms-marco-MiniLM-L-6-v2'.
+            top_n (int): The number of chunks kept after re-ranking. Default is 3.
+            num_candidates (int): The number of candidates to retrieve for re-ranking. Default is 12.
+            batch_size (int): The number of (query, chunk) pairs scored per forward pass. Default is 16.
+            max_length (int): The maximum number of tokens of a (query, chunk) pair. Default is 512.
+            latency_budget (Optional[float]): The time in seconds re-ranking may take per query. None never skips it.
+            cache_size (int): The maximum number of cached pair scores. Default is 10000.
+            device (str): The device to run the model on. Default is "cpu".
+            probe_interval (int): Every how many consecutive skipped queries the time per pair is measured
+                                  again on a few candidates. Default is 10.
+        """
+        self.model_name = model_name
+        self.top_n = top_n
+        self.num_candidates = num_candidates
+        self.batch_size = batch_size
+        self.max_length = max_length
+        self.latency_budget = latency_budget
+        self.cache_size = cache_size
+        self.device = device
+        self.probe_interval = probe_interval
+        self._model = None
+        self._model_lock = threading.Lock()
+        self._lock = threading.Lock()
+        self._scores = OrderedDict()  # (query, chunk text hash) -> score, least recently used first
+        self.seconds_per_pair = None  # Moving average of the scoring time of one pair
+        self._skipped_in_row = 0  # Consecutive queries skipped for the latency budget
+        self.queries = 0
+        self.skipped = 0
+        self.scored_pairs = 0
+        self.cached_pairs = 0
+
+    @property
+    def model(self):
+        """The cross-encoder, loaded on first use."""
+        if self._model is None:
+            with self._model_lock:
+                if self._model is None:
+                    from sentence_transformers import CrossEncoder
+                    self._model = CrossEncoder(self.model_name, max_length=self.max_length, device=self.device)
+        return self._model
+
+    def warm_up(self) -> None:
+        """Load the model and score one pair, so that the first query neither pays for it nor skews the latency estimate."""
+        self.model.predict([("warm up", "warm up")], batch_size=1, show_progress_bar=False)
+
+    @telemetry.traced("rerank")
+    def rerank(self, query: str, retrieved_docs: List[Union[Dict[str, Any], Tuple[Dict[str, Any], float]]],
+               top_n: Optional[int] = None) -> List[Tuple[Dict[str, Any], float]]:
+        """
+        Re-rank retrieved chunks by their cross-encoder relevance to the query.
+
+        Args:
+            query (str): The query.
+            retrieved_docs (List[Union[Dict[str, Any], Tuple[Dict[str, Any], float]]]): The candidates, best first,
+                either as dicts or as the (metadata, score) tuples returned by `VectorStore.similarity_search`.
+            top_n (Optional[int]): Overrides the number of chunks kept given at initialization.
+
+        Returns:
+            List[Tuple[Dict[str, Any], float]]: The top_n chunks as (metadata, score) tuples, highest score first.
+            The scores are cross-encoder scores, or the search scores when re-ranking was skipped.
+        """
+        top_n = top_n or self.top_n
+        candidates = [(doc[0], doc[1]) if isinstance(doc, tuple) else (doc, None) for doc in retrieved_docs]
+        candidates = [(metadata, score) for metadata, score in candidates if metadata and metadata.get('text')]
+        if len(candidates) <= 1:
+            return candidates[:top_n]
+
+        keys = [(query, hashlib.blake2b(metadata['text'].encode('utf-8'), digest_size=16).digest()) for metadata, _ in candidates]
+        with self._lock:
+            self.queries += 1
+            scores = {}
+            for key in keys:
+                if key in self._scores:
+                    self._scores.move_to_end(key)
+                    scores[key] = self._scores[key]
+            missing = [i for i, key in enumerate(keys) if key not in scores]
+            self.cached_pairs += len(keys) - len(missing)
+            probing = bool(missing) and self._over_budget(len(missing))
+            if probing:
+                self.skipped += 1
+                self._skipped_in_row += 1
+                telemetry.current_span().set_attribute("skipped", True)
+                if self._skipped_in_row % self.probe_interval:
+                    return candidates[:top_n]
+                # Probe: score only the pairs that fit in the budget, to measure the time per pair again.
+                missing = missing[:max(1, min(self.batch_size, int(self.latency_budget / self.seconds_per_pair)))]
+                telemetry.current_span().set_attribute("probe", len(missing))
+            else:
+                self._skipped_in_row = 0
+
+        if missing:
+            for i, score in zip(missing, self._score(query, [candidates[i][0]['text'] for i in missing])):
+                scores[keys[i]] = score
+            with self._lock:
+                for i in missing:
+                    self._scores[keys[i]] = scores[keys[i]]
+                while len(self._scores) > self.cache_size:
+                    self._scores.popitem(last=False)
+        if probing:
+            return candidates[:top_n]
+
+        order = sorted(range(len(candidates)), key=lambda i: scores[keys[i]], reverse=True)
+        return [(candidates[i][0], scores[keys[i]]) for i in order[:top_n]]
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Return the re-ranking metrics.
+
+        Returns:
+            Dict[str, Any]: The number of "queries", of queries "skipped" for the latency budget, of "scored_pairs"
+            and "cached_pairs", and the average "ms_per_pair".
+        """
+        with self._lock:
+            return {
+                "queries": self.queries,
+                "skipped": self.skipped,
+                "scored_pairs": self.scored_pairs,
+                "cached_pairs": self.cached_pairs,
+                "ms_per_pair": None if self.seconds_per_pair is None else self.seconds_per_pair * 1000,
+            }
+
+    def _over_budget(self, pairs: int) -> bool:
+        """Return whether scoring the given number of pairs is expected to exceed the latency budget."""
+        if self.latency_budget is None or self.seconds_per_pair is None:
+            return False
+        return pairs * self.seconds_per_pair > self.latency_budget
+
+    def _score(self, query: str, texts: List[str]) -> List[float]:
+        """Score (query, text) pairs in batches, updating the time per pair after every batch."""
+        # Batching texts of similar length keeps the padding, and so the wasted compute, small.
+        order = sorted(range(len(texts)), key=lambda i: len(texts[i]))
+        scores = np.empty(len(texts), dtype=np.float32)
+        for start in range(0, len(order), self.batch_size):
+            batch = order[start:start + self.batch_size]
+            batch_start = time.perf_counter()
+            predicted = self.model.predict([(query, texts[i]) for i in batch], batch_size=self.batch_size,
+                                           show_progress_bar=False, convert_to_numpy=True)
+            per_pair = (time.perf_counter() - batch_start) / len(batch)
+            scores[batch] = np.asarray(predicted, dtype=np.float32).ravel()
+            with self._lock:
+                self.scored_pairs += len(batch)
+                self.seconds_per_pair = per_pair if self.seconds_per_pair is None else 0.8 * self.seconds_per_pair + 0.2 * per_pair
+        return scores.tolist()
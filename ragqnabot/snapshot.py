@@ -0,0 +1,159 @@
+import os
+import json
+import shutil
+import hashlib
+import tempfile
+import numpy as np
+from typing import Any, Dict, List, Optional, Tuple
+from ragqnabot.configs import SNAPSHOT_DIR
+
+SNAPSHOT_VERSION = 2  # Bumped when the metadata of the chunks changes
+
+class SessionSnapshot:
+    """
+    Saves the chunks and embeddings of ingested documents to disk, so a later session can restore
+    them into a VectorStore instead of loading, splitting and embedding the document again.
+
+    A snapshot is keyed by the path and the content hash of the source file, the embedding model
+    and the splitter settings, so editing the file or changing the settings makes the old
+    snapshot miss; it is deleted when the new one is saved. Only local files are snapshotted.
+
+    Every snapshot is a directory holding `chunks.jsonl`, with one chunk per line, and
+    `embeddings.npy`, the float32 embedding matrix.
+    """
+
+    def __init__(self, path: str = SNAPSHOT_DIR):
+        """
+        Initialize the SessionSnapshot, creating the snapshot directory if needed.
+
+        Args:
+            path (str): The directory holding the snapshots. Defaults to SNAPSHOT_DIR.
+        """
+        os.makedirs(path, exist_ok=True)
+        self.path = path
+
+    def key(self, source: str, embedding_model_name: str, splitter=None) -> Optional[str]:
+        """
+        Return the key of the snapshot of a source.
+
+        Args:
+            source (str): The path of the source file.
+            embedding_model_name (str): The model the embeddings are computed with.
+            splitter (Optional[DocumentSplitter]): The splitter the chunks are split with.
+
+        Returns:
+            Optional[str]: The key, or None if the source is not a local file.
+        """
+        if not os.path.isfile(source):
+            return None
+        content = hashlib.blake2b(digest_size=20)
+        with open(source, 'rb') as file:
+            for block in iter(lambda: file.read(1 << 20), b''):
+                content.update(block)
+        settings = {"version": SNAPSHOT_VERSION, "content": content.hexdigest(), "model": embedding_model_name,
+                    "splitter": splitter.settings() if splitter is not None else None}
+        settings_hash = hashlib.blake2b(json.dumps(settings, sort_keys=True).encode('utf-8'), digest_size=10).hexdigest()
+        return f"{self._source_prefix(source)}-{settings_hash}"
+
+    def load(self, source: str, embedding_model_name: str, splitter=None) -> Optional[Tuple[List[Dict[str, Any]], np.ndarray]]:
+        """
+        Load the snapshot of a source, if there is one.
+
+        Args:
+            source (str): The path of the source file.
+            embedding_model_name (str): The model the embeddings are computed with.
+            splitter (Optional[DocumentSplitter]): The splitter the chunks are split with.
+
+        Returns:
+            Optional[Tuple[List[Dict[str, Any]], np.ndarray]]: The chunks and their embeddings, as taken by
+            VectorStore.add_embeddings, or None if there is no snapshot.
+        """
+        key = self.key(source, embedding_model_name, splitter)
+        directory = os.path.join(self.path, key) if key else None
+        if directory is None or not os.path.isdir(directory):
+            return None
+        try:
+            with open(os.path.join(directory, "chunks.jsonl"), 'r', encoding='utf-8') as file:
+                chunks = [json.loads(line) for line in file]
+            embeddings = np.load(os.path.join(directory, "embeddings.npy"))
+        except (OSError, ValueError):
+            return None  # A snapshot that cannot be read is rebuilt
+        return chunks, embeddings
+
+    def restore(self, store, source: str, splitter=None, doc_id: Optional[str] = None) -> bool:
+        """
+        Add the chunks and embeddings of a source to a vector store from its snapshot.
+
+        Args:
+            store (VectorStore): The store to add the chunks to.
+            source (str): The path of the source file.
+            splitter (Optional[DocumentSplitter]): The splitter the chunks are split with.
+            doc_id (Optional[str]): The document id of the chunks. Defaults to the source.
+
+        Returns:
+            bool: Whether a snapshot was found and restored.
+        """
+        snapshot = self.load(source, store.embedding_model_name, splitter)
+        if snapshot is None:
+            return False
+        chunks, embeddings = snapshot
+        store.add_embeddings(chunks, embeddings, doc_id=source if doc_id is None else doc_id)
+        return True
+
+    def save(self, store, source: str, splitter=None, doc_id: Optional[str] = None) -> Optional[str]:
+        """
+        Save the chunks and embeddings of a source in a vector store as its snapshot.
+
+        Earlier snapshots of the same source are deleted.
+
+        Args:
+            store (VectorStore): The store holding the chunks of the source.
+            source (str): The path of the source file.
+            splitter (Optional[DocumentSplitter]): The splitter the chunks were split with.
+            doc_id (Optional[str]): The document id of the chunks in the store. Defaults to the source.
+
+        Returns:
+            Optional[str]: The directory of the snapshot, or None if the source is not a local file.
+        """
+        key = self.key(source, store.embedding_model_name, splitter)
+        if key is None:
+            return None
+        chunks, embeddings = store.document_chunks(source if doc_id is None else doc_id)
+
+        # Written to a temporary directory first, so a crash never leaves a partial snapshot behind.
+        temporary = tempfile.mkdtemp(prefix=".tmp-", dir=self.path)
+        try:
+            with open(os.path.join(temporary, "chunks.jsonl"), 'w', encoding='utf-8') as file:
+                for chunk in chunks:
+                    file.write(json.dumps(chunk, ensure_ascii=False) + "\n")
+            np.save(os.path.join(temporary, "embeddings.npy"), np.ascontiguousarray(embeddings, dtype=np.float32))
+            self.delete(source)
+            directory = os.path.join(self.path, key)
+            os.replace(temporary, directory)
+        except BaseException:
+            shutil.rmtree(temporary, ignore_errors=True)
+            raise
+        return directory
+
+    def delete(self, source: str) -> int:
+        """
+        Delete the snapshots of a source.
+
+        Args:
+            source (str): The path of the source file.
+
+        Returns:
+            int: The number of deleted snapshots.
+        """
+        prefix = self._source_prefix(source) + "-"
+        deleted = 0
+        for name in os.listdir(self.path):
+            if name.startswith(prefix):
+                shutil.rmtree(os.path.join(self.path, name), ignore_errors=True)
+                deleted += 1
+        return deleted
+
+    @staticmethod
+    def _source_prefix(source: str) -> str:
+        """Return the part of the snapshot keys shared by every snapshot of a source."""
+        return hashlib.blake2b(os.path.abspath(source).encode('utf-8'), digest_size=8).hexdigest()
@@ -0,0 +1,463 @@
+import sys
+import json
+import math
+import time
+import random
+import pstats
+import cProfile
+import threading
+import contextvars
+from bisect import bisect_left
+from collections import deque
+from contextlib import contextmanager
+from functools import wraps
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, TextIO, Union
+from ragqnabot.configs import TELEMETRY_ENABLED, TELEMETRY_LOG
+
+# The upper bounds in seconds of the latency histogram buckets, from a cache hit to a slow LLM call
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+_current_span = contextvars.ContextVar("ragqnabot_current_span", default=None)
+
+
+class Histogram:
+    """
+    A latency histogram with fixed buckets, in the layout Prometheus expects, plus a window of the
+    most recent values for exact percentiles.
+    """
+
+    def __init__(self, buckets: Iterable[float] = DEFAULT_BUCKETS, window: int = 1024):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)  # The last bucket is +Inf
+        self.count = 0
+        self.sum = 0.0
+        self.errors = 0
+        self.recent = deque(maxlen=window)
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+        self.recent.append(value)
+
+    def percentile(self, q: float) -> float:
+        """Return the q-th percentile (nearest rank) of the recent values. The histogram must not be empty."""
+        values = sorted(self.recent)
+        return values[min(len(values) - 1, max(0, math.ceil(q / 100 * len(values)) - 1))]
+
+
+class Span:
+    """
+    A timed operation of the pipeline, e.g. one `encode` call or one Pinecone `query`.
+
+    Used as a context manager, the span is the parent of the spans started within it, also across
+    `await`s. Otherwise it ends when end() is called, which suits generators: a span kept open across
+    `yield`s must not become the parent of the consumer's spans.
+    """
+
+    __slots__ = ("name", "trace_id", "span_id", "parent_id", "attributes", "start_time", "end_time", "duration",
+                 "error", "_telemetry", "_start", "_token")
+
+    def __init__(self, telemetry: "Telemetry", name: str, attributes: Dict[str, Any]):
+        parent = _current_span.get()
+        self.name = name
+        self.trace_id = parent.trace_id if parent is not None else f"{random.getrandbits(128):032x}"
+        self.span_id = f"{random.getrandbits(64):016x}"
+        self.parent_id = parent.span_id if parent is not None else None
+        self.attributes = attributes
+        self.start_time = time.time_ns()
+        self.end_time = None
+        self.duration = None
+        self.error = None
+        self._telemetry = telemetry
+        self._start = time.perf_counter()
+        self._token = None
+
+    def __enter__(self) -> "Span":
+        self._token = _current_span.set(self)
+        return self
+
+    def __exit__(self, exc_type, exc, traceback) -> bool:
+        _current_span.reset(self._token)
+        if exc is not None:
+            self.record_exception(exc)
+        self.end()
+        return False
+
+    def set_attribute(self, key: str, value: Any) -> None:
+        self.attributes[key] = value
+
+    def record_exception(self, exception: BaseException) -> None:
+        """Mark the span as failed, e.g. when the exception is caught within it."""
+        self.error = f"{type(exception).__name__}: {exception}"
+
+    def end(self) -> None:
+        """End the span and record it. Ending a span twice has no effect."""
+        if self.duration is not None:
+            return
+        self.duration = time.perf_counter() - self._start
+        self.end_time = self.start_time + int(self.duration * 1e9)
+        self._telemetry._finish(self)
+
+    def to_dict(self) -> Dict[str, Any]:
+        """Return the span as a JSON-serializable dict, as written to the JSON log."""
+        return {
+            "name": self.name,
+            "trace_id": self.trace_id,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "start_time_unix_nano": self.start_time,
+            "duration_ms": None if self.duration is None else self.duration * 1000,
+            "attributes": self.attributes,
+            "error": self.error,
+        }
+
+
+class _NoopSpan:
+    """The span returned while telemetry is disabled. It records nothing."""
+
+    __slots__ = ()
+
+    def __enter__(self) -> "_NoopSpan":
+        return self
+
+    def __exit__(self, exc_type, exc, traceback) -> bool:
+        return False
+
+    def set_attribute(self, key: str, value: Any) -> None:
+        pass
+
+    def record_exception(self, exception: BaseException) -> None:
+        pass
+
+    def end(self) -> None:
+        pass
+
+
+NOOP_SPAN = _NoopSpan()
+
+
+class Telemetry:
+    """
+    Per-stage latency instrumentation of the RAG pipeline: load, split, embed, upsert, retrieve,
+    rerank, assemble and generate, and the steps within them such as the Pinecone round trips.
+
+    Every finished span is added to a latency histogram per span name and kept in a bounded buffer
+    of recent spans. The histograms export as Prometheus text, the spans as OTLP/JSON, which an
+    OpenTelemetry collector accepts on /v1/traces, and each span can also be appended to a JSON log
+    as it ends.
+
+    While disabled, span() returns a shared no-op span without reading the clock, so instrumented
+    code pays for one method call and one attribute check.
+    """
+
+    def __init__(self, enabled: bool = False, json_log: Optional[Union[str, TextIO]] = None, max_spans: int = 10000,
+                 buckets: Iterable[float] = DEFAULT_BUCKETS, service_name: str = "ragqnabot"):
+        """
+        Initialize the Telemetry.
+
+        Args:
+            enabled (bool): Whether to record spans. Default is False.
+            json_log (Optional[Union[str, TextIO]]): A file path or stream to append every finished span to,
+                                                     as one JSON object per line.
+            max_spans (int): The number of recent spans kept for export_otlp and spans. Default is 10000.
+            buckets (Iterable[float]): The upper bounds in seconds of the histogram buckets.
+            service_name (str): The service.name resource attribute of exported spans. Default is "ragqnabot".
+        """
+        self.enabled = enabled
+        self.buckets = tuple(buckets)
+        self.service_name = service_name
+        self._spans = deque(maxlen=max_spans)
+        self._histograms: Dict[str, Histogram] = {}
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._log = None
+        self._owns_log = False
+        self.set_json_log(json_log)
+
+    def enable(self, json_log: Optional[Union[str, TextIO]] = None) -> None:
+        """Start recording spans, optionally appending them to a JSON log."""
+        if json_log is not None:
+            self.set_json_log(json_log)
+        self.enabled = True
+
+    def disable(self) -> None:
+        """Stop recording spans. The recorded histograms and spans are kept."""
+        self.enabled = False
+
+    def set_json_log(self, json_log: Optional[Union[str, TextIO]]) -> None:
+        """Set the file path or stream finished spans are appended to, or None to stop logging."""
+        with self._lock:
+            if self._owns_log:
+                self._log.close()
+            self._owns_log = isinstance(json_log, str)
+            self._log = open(json_log, 'a', encoding='utf-8', buffering=1) if self._owns_log else json_log
+
+    def span(self, name: str, **attributes) -> Union[Span, _NoopSpan]:
+        """
+        Start a span.
+
+        Args:
+            name (str): The name of the span, e.g. "embed" or "retrieve.query". Spans of the same name share a histogram.
+            **attributes: Attributes of the span, e.g. the number of chunks.
+
+        Returns:
+            Union[Span, _NoopSpan]: The span, to use as a context manager or to end with end().
+        """
+        if not self.enabled:
+            return NOOP_SPAN
+        return Span(self, name, attributes)
+
+    def current_span(self) -> Union[Span, _NoopSpan]:
+        """Return the innermost span entered as a context manager, to add attributes to it."""
+        if not self.enabled:
+            return NOOP_SPAN
+        return _current_span.get() or NOOP_SPAN
+
+    def record(self, name: str, seconds: float, error: Optional[BaseException] = None, **attributes) -> None:
+        """
+        Record a span that ends now and lasted the given time, e.g. a duration measured in another process.
+
+        Args:
+            name (str): The name of the span.
+            seconds (float): The duration of the span.
+            error (Optional[BaseException]): The exception the operation failed with, if any.
+            **attributes: Attributes of the span.
+        """
+        if not self.enabled:
+            return
+        span = Span(self, name, attributes)
+        span.start_time -= int(seconds * 1e9)
+        span._start -= seconds
+        if error is not None:
+            span.record_exception(error)
+        span.end()
+
+    def traced(self, name: Optional[str] = None) -> Callable:
+        """
+        Decorate a function to run within a span.
+
+        Args:
+            name (Optional[str]): The name of the span. Defaults to the qualified name of the function.
+
+        Returns:
+            Callable: The decorator.
+        """
+        def decorator(function: Callable) -> Callable:
+            span_name = name or function.__qualname__
+
+            @wraps(function)
+            def wrapper(*args, **kwargs):
+                if not self.enabled:
+                    return function(*args, **kwargs)
+                with Span(self, span_name, {}):
+                    return function(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    def timed_iter(self, name: str, iterable: Iterable, **attributes) -> Iterable:
+        """
+        Measure the time an iterator, such as a lazy loading or splitting stage, spends producing its items.
+
+        The time the consumer spends between items is excluded, and so is the time spent in timed
+        iterators nested within this one: splitting the segments of a timed loader only counts the
+        splitting. One span is recorded when the iterator is exhausted or closed, with its active
+        time as duration and the number of "items" as attribute.
+
+        Args:
+            name (str): The name of the span.
+            iterable (Iterable): The items to time.
+            **attributes: Attributes of the span.
+
+        Returns:
+            Iterable: The iterable itself while disabled, otherwise an iterator over its items.
+        """
+        if not self.enabled:
+            return iterable
+        return self._timed_iter(name, iter(iterable), attributes)
+
+    def _timed_iter(self, name: str, iterator: Iterator, attributes: Dict[str, Any]) -> Iterator:
+        active, items, error = 0.0, 0, None
+        try:
+            while True:
+                # The time spent in nested timed iterators is added to the last entry of the stack.
+                stack = self._nested_times()
+                stack.append(0.0)
+                start = time.perf_counter()
+                try:
+                    item = next(iterator)
+                except StopIteration:
+                    return
+                except Exception as e:
+                    error = e
+                    raise
+                finally:
+                    elapsed = time.perf_counter() - start
+                    active += elapsed - stack.pop()
+                    if stack:
+                        stack[-1] += elapsed
+                items += 1
+                yield item
+        finally:
+            self.record(name, active, error=error, items=items, **attributes)
+
+    def _nested_times(self) -> List[float]:
+        stack = getattr(self._local, "stack", None)
+        if stack is None:
+            stack = self._local.stack = []
+        return stack
+
+    def _finish(self, span: Span) -> None:
+        """Add a finished span to its histogram and to the recent spans, and log it."""
+        with self._lock:
+            histogram = self._histograms.get(span.name)
+            if histogram is None:
+                histogram = self._histograms[span.name] = Histogram(self.buckets)
+            histogram.observe(span.duration)
+            if span.error is not None:
+                histogram.errors += 1
+            self._spans.append(span)
+            if self._log is not None:
+                self._log.write(json.dumps(span.to_dict(), default=str) + "\n")
+
+    def stats(self) -> Dict[str, Dict[str, Any]]:
+        """
+        Return the latency metrics of every span name.
+
+        Returns:
+            Dict[str, Dict[str, Any]]: Per span name, the "count", the number of "errors", the "total_seconds",
+            the "mean_ms", and the "p50_ms", "p95_ms" and "p99_ms" of the last 1024 spans.
+        """
+        with self._lock:
+            return {name: {
+                "count": histogram.count,
+                "errors": histogram.errors,
+                "total_seconds": histogram.sum,
+                "mean_ms": histogram.sum / histogram.count * 1000,
+                **{f"p{q}_ms": histogram.percentile(q) * 1000 for q in (50, 95, 99)},
+            } for name, histogram in sorted(self._histograms.items())}
+
+    def spans(self) -> List[Dict[str, Any]]:
+        """Return the recent finished spans, oldest first, as dicts."""
+        with self._lock:
+            return [span.to_dict() for span in self._spans]
+
+    def export_prometheus(self, prefix: str = "ragqnabot") -> str:
+        """
+        Export the latency histograms in the Prometheus text exposition format.
+
+        Args:
+            prefix (str): The prefix of the metric names. Default is "ragqnabot".
+
+        Returns:
+            str: A <prefix>_stage_duration_seconds histogram and a <prefix>_stage_errors_total counter,
+            both labeled by stage, i.e. span name.
+        """
+        duration, errors = f"{prefix}_stage_duration_seconds", f"{prefix}_stage_errors_total"
+        lines = [f"# HELP {duration} The duration of the RAG pipeline stages.", f"# TYPE {duration} histogram"]
+        error_lines = [f"# HELP {errors} The number of failed RAG pipeline stages.", f"# TYPE {errors} counter"]
+        with self._lock:
+            for name, histogram in sorted(self._histograms.items()):
+                stage = name.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+                cumulative = 0
+                for bound, count in zip(self.buckets + (float('inf'),), histogram.counts):
+                    cumulative += count
+                    le = "+Inf" if bound == float('inf') else repr(float(bound))
+                    lines.append(f'{duration}_bucket{{stage="{stage}",le="{le}"}} {cumulative}')
+                lines.append(f'{duration}_sum{{stage="{stage}"}} {histogram.sum!r}')
+                lines.append(f'{duration}_count{{stage="{stage}"}} {histogram.count}')
+                error_lines.append(f'{errors}{{stage="{stage}"}} {histogram.errors}')
+        return "\n".join(lines + error_lines) + "\n"
+
+    def export_otlp(self, clear: bool = False) -> Dict[str, Any]:
+        """
+        Export the recent spans in the OTLP/JSON format of OpenTelemetry.
+
+        The result can be posted as JSON to the /v1/traces endpoint of an OpenTelemetry collector.
+
+        Args:
+            clear (bool): Whether to remove the exported spans from the buffer, so they are not exported twice. Default is False.
+
+        Returns:
+            Dict[str, Any]: An ExportTraceServiceRequest holding the spans.
+        """
+        with self._lock:
+            spans = list(self._spans)
+            if clear:
+                self._spans.clear()
+        return {"resourceSpans": [{
+            "resource": {"attributes": _otlp_attributes({"service.name": self.service_name})},
+            "scopeSpans": [{
+                "scope": {"name": "ragqnabot"},
+                "spans": [{
+                    "traceId": span.trace_id,
+                    "spanId": span.span_id,
+                    **({"parentSpanId": span.parent_id} if span.parent_id else {}),
+                    "name": span.name,
+                    "kind": 1,  # SPAN_KIND_INTERNAL
+                    "startTimeUnixNano": str(span.start_time),
+                    "endTimeUnixNano": str(span.end_time),
+                    "attributes": _otlp_attributes(span.attributes),
+                    "status": {"code": 2, "message": span.error} if span.error else {"code": 1},
+                } for span in spans],
+            }],
+        }]}
+
+    def reset(self) -> None:
+        """Discard the recorded histograms and spans."""
+        with self._lock:
+            self._histograms.clear()
+            self._spans.clear()
+
+    def close(self) -> None:
+        """Close the JSON log if it was opened from a path."""
+        self.set_json_log(None)
+
+
+def _otlp_attributes(attributes: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """Convert attributes to OTLP key-value pairs."""
+    converted = []
+    for key, value in attributes.items():
+        if isinstance(value, bool):
+            value = {"boolValue": value}
+        elif isinstance(value, int):
+            value = {"intValue": str(value)}
+        elif isinstance(value, float):
+            value = {"doubleValue": value}
+        else:
+            value = {"stringValue": str(value)}
+        converted.append({"key": key, "value": value})
+    return converted
+
+
+@contextmanager
+def profile(path: Optional[str] = None, sort: str = "cumulative", limit: int = 30, stream: Optional[TextIO] = None):
+    """
+    Profile the enclosed code with cProfile, e.g. an ingestion run.
+
+    Only the current process is profiled: work done in worker processes, such as the parsing of
+    BulkLoader, shows up as time spent waiting for them.
+
+    Args:
+        path (Optional[str]): A file to save the profile to, for pstats or a viewer such as snakeviz.
+        sort (str): The sort key of the printed statistics. Default is "cumulative".
+        limit (int): The number of printed functions, or 0 to print nothing. Default is 30.
+        stream (Optional[TextIO]): Where to print the statistics. Defaults to sys.stderr.
+
+    Yields:
+        cProfile.Profile: The running profiler.
+    """
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        yield profiler
+    finally:
+        profiler.disable()
+        if path:
+            profiler.dump_stats(path)
+        if limit:
+            pstats.Stats(profiler, stream=stream or sys.stderr).sort_stats(sort).print_stats(limit)
+
+
+# The telemetry of the pipeline, enabled with the TELEMETRY environment variable or telemetry.enable()
+telemetry = Telemetry(enabled=TELEMETRY_ENABLED, json_log=TELEMETRY_LOG)
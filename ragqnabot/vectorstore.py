@@ -1,5 +1,16 @@
-from sentence_transformers import SentenceTransformer
-from typing import List, Dict, Union, Tuple
+import os
+import time
+import hashlib
+import threading
+import numpy as np
+from collections import OrderedDict
+from ragqnabot.embeddingcache import EmbeddingCache
+from ragqnabot.helpers import upsert_vectors
+from ragqnabot.lexicalindex import BM25Index
+from ragqnabot.metadatafilter import matches_filter
+from ragqnabot.modelregistry import get_model
+from ragqnabot.telemetry import telemetry
+from typing import Iterable, Iterator, List, Dict, Union, Tuple, Optional
 
 class VectorStore:
     """
@@ -7,44 +18,474 @@ class VectorStore:
     optimized for Retrieval-Augmented Generation (RAG).
     """
 
-    def __init__(self, embedding_model_name: str = 'all-MiniLM-L6-v2'):
+    def __init__(self, embedding_model_name: str = 'all-MiniLM-L6-v2', batch_size: int = 64, num_workers: int = 0, device: Optional[str] = None,
+                 metadata_cache_size: int = 10000, cache: Optional[EmbeddingCache] = None, lexical_index: Optional[BM25Index] = None):
         """
         Initialize the VectorStore.
 
         Args:
             embedding_model_name (str): The name of the sentence transformer model to use for embeddings.
+            batch_size (int): The number of chunks encoded per forward pass. Default is 64.
+            num_workers (int): The number of CPU processes used for encoding. 0 or 1 encodes in-process,
+                               -1 uses every available core. Default is 0.
+            device (Optional[str]): The device to run the model on. None lets SentenceTransformer pick one.
+            metadata_cache_size (int): The maximum number of fetched metadata entries kept by similarity_search. Default is 10000.
+            cache (Optional[EmbeddingCache]): A persistent embedding cache. Chunks whose content is already
+                                              cached are not re-encoded, and sync_index only upserts changed chunks.
+            lexical_index (Optional[BM25Index]): A BM25 index kept up to date with the added chunks, enabling
+                                                 the "hybrid" and "lexical" modes of similarity_search.
+
+        The model is taken from the process-wide model registry, so creating several
+        VectorStore objects does not reload it.
         """
-        self.vectors = []  # List of tuples (id, embedding, chunks)
-        self.model = SentenceTransformer(embedding_model_name)
+        self.model = get_model(embedding_model_name, device)
+        self.embedding_model_name = embedding_model_name
+        self.batch_size = batch_size
+        self.num_workers = num_workers
+        self.ids = []  # List of vector ids, aligned with the rows of self.embeddings
+        self.metadatas = []  # List of metadata dicts, aligned with the rows of self.embeddings
+        self.cache = cache
+        self.lexical_index = lexical_index
+        self._rows = {}  # Vector id -> row in self.embeddings, for the current chunks only
+        self._doc_rows = {}  # Document id -> rows of its current chunks; rows of replaced chunks are stale
+        # Grown geometrically, so that appending n embeddings copies O(n) rows in total; the rows past len(self.ids) are unused.
+        self._buffer = np.empty((0, self.model.get_sentence_embedding_dimension()), dtype=np.float32)
+        self._pool, self._pool_workers = None, 0  # The multi-process encoding pool, started on first use and reused
+        self.last_throughput = None  # Chunks per second of the most recent add_texts call
+        self.metadata_cache_size = metadata_cache_size
+        self._metadata_cache = OrderedDict()  # LRU cache of (index, namespace, vector id) -> metadata
+        self._metadata_lock = threading.Lock()  # similarity_search may be called from several threads
+
+    @property
+    def embeddings(self) -> np.ndarray:
+        """The embeddings of the stored chunks as one float32 matrix, one row per id. A view, which later adds do not extend."""
+        return self._buffer[:len(self.ids)]
 
-    def add_texts(self, chunks: List[Dict[str, Union[str, int]]]) -> None:
+    @property
+    def vectors(self) -> List[Tuple[str, List[float], Dict[str, Union[str, int]]]]:
         """
-        Add text chunks to the vector store.
+        The stored vectors in the (id, embedding, metadata) form expected by `index.upsert`.
+
+        The embeddings are kept as one float32 matrix; the per-vector lists are only built here.
+        """
+        return list(self.iter_vectors())
+
+    def iter_vectors(self) -> Iterator[Tuple[str, List[float], Dict[str, Union[str, int]]]]:
+        """Lazily yield the stored vectors as (id, embedding, metadata) tuples, e.g. for batched upserts. Stale rows are skipped."""
+        for row, (vector_id, embedding, metadata) in enumerate(zip(self.ids, self.embeddings, self.metadatas)):
+            if self._rows.get(vector_id) == row:
+                yield vector_id, embedding.tolist(), metadata
+
+    def add_texts(self, chunks: Iterable[Union[str, Dict[str, Union[str, int]]]], batch_size: Optional[int] = None, num_workers: Optional[int] = None,
+                  doc_id: str = "default") -> None:
+        """
+        Add text chunks of a document to the vector store.
+
+        Every chunk gets the stable id "<doc_id>#<hash of its text>", so re-adding unchanged content
+        yields the same ids and chunks already in the store are skipped. Adding a document again
+        replaces its chunks: those missing from the new version become stale, i.e. their rows stay in
+        `self.embeddings` but are no longer searchable locally, returned by document_chunks or
+        iter_vectors, and are removed from the lexical index once no index holds them. Besides the chunk's own keys,
+        its metadata holds the "doc_id" and the "ingested_at" time in seconds since the epoch, which
+        metadata filters can select on. Chunks found in the
+        embedding cache are not re-encoded. The rest are encoded in batches, optionally spread over
+        several CPU processes, and the resulting embeddings are appended to the contiguous float32
+        matrix `self.embeddings`. The processes are started on the first call and reused by later
+        calls until `close`. The embedding throughput is stored in `self.last_throughput` (chunks/sec).
+
+        The chunks may be a generator, e.g. DocumentSplitter.split_segments: they are consumed in
+        windows of a few batches, so encoding starts before the document is fully loaded.
 
         Args:
-            chunks (List[Dict[str, Union[str, int]]]): A list of text chunks with their metadata.
+            chunks (Iterable[Union[str, Dict[str, Union[str, int]]]]): The text chunks, as plain strings or as dictionaries
+                                                                       whose keys besides 'text' are kept as metadata.
+            batch_size (Optional[int]): Overrides the batch size given at initialization.
+            num_workers (Optional[int]): Overrides the number of encoding processes given at initialization.
+            doc_id (str): The id of the document the chunks belong to, e.g. its path. Default is "default".
         """
-        for i, chunk in enumerate(chunks):
-            embedding = self.model.encode(chunk['text'])
-            metadata  = {
-                "text" : chunk["text"]
-            }
-            self.vectors.append((str(i), embedding.tolist(), metadata))
+        batch_size = batch_size or self.batch_size
+        num_workers = self.num_workers if num_workers is None else num_workers
+        if num_workers < 0:
+            num_workers = os.cpu_count() or 1
+
+        pool = self._get_pool(num_workers)
+        ingested_at = int(time.time())
+        offset = len(self.ids)
+        new_ids, new_metadatas, doc_rows = [], [], []
+        seen = set()
+        embedded, elapsed = 0, 0.0
+        for window in self._windows(chunks, batch_size * max(num_workers, 1) * 8):
+            texts, hashes = [], []
+            for chunk in window:
+                if isinstance(chunk, str):
+                    chunk = {'text': chunk}
+                content_hash = self.content_hash(chunk['text'])
+                vector_id = f"{doc_id}#{content_hash[:32]}"
+                if vector_id in seen:
+                    continue
+                seen.add(vector_id)
+                if vector_id in self._rows:
+                    doc_rows.append(self._rows[vector_id])
+                    continue
+                doc_rows.append(offset + len(new_ids))
+                texts.append(chunk['text'])
+                hashes.append(content_hash)
+                new_ids.append(vector_id)
+                new_metadatas.append({"ingested_at": ingested_at, **{key: value for key, value in chunk.items() if key != 'text'},
+                                      "text": chunk['text'], "doc_id": doc_id})
+            if not texts:
+                continue
+
+            start_time = time.perf_counter()
+            with telemetry.span("embed", chunks=len(texts), workers=num_workers):
+                embeddings = self._embed(texts, hashes, batch_size, pool)
+            row = offset + embedded
+            self._reserve(row + len(texts))[row:row + len(texts)] = embeddings
+            elapsed += time.perf_counter() - start_time
+            embedded += len(texts)
+
+        self._append(doc_id, new_ids, new_metadatas, doc_rows)
+        if new_ids:
+            self.last_throughput = embedded / elapsed if elapsed > 0 else float('inf')
+
+    def add_embeddings(self, chunks: List[Union[str, Dict[str, Union[str, int]]]], embeddings: np.ndarray, doc_id: str = "default") -> None:
+        """
+        Add text chunks of a document together with their precomputed embeddings, e.g. from a SessionSnapshot.
+
+        The chunks get the same ids and metadata as with add_texts, chunks already in the store are
+        skipped and the chunks of an earlier version of the document become stale. An "ingested_at" time already in a chunk, e.g. from a snapshot, is kept.
+
+        Args:
+            chunks (List[Union[str, Dict[str, Union[str, int]]]]): The text chunks, as for add_texts.
+            embeddings (np.ndarray): The embeddings of the chunks, one row per chunk, from this store's model.
+            doc_id (str): The id of the document the chunks belong to. Default is "default".
 
-    def similarity_search(self, index, query: str, k: int = 5) -> List[Tuple[Dict[str, Union[str, int]], float]]:
+        Raises:
+            ValueError: If the number or dimension of the embeddings does not match.
+        """
+        if len(chunks) != len(embeddings) or (len(chunks) and embeddings.shape[1] != self.embeddings.shape[1]):
+            raise ValueError(f"Expected {len(chunks)} embeddings of dimension {self.embeddings.shape[1]}, got shape {embeddings.shape}")
+        ingested_at = int(time.time())
+        offset = len(self.ids)
+        new_ids, new_metadatas, rows, doc_rows = [], [], [], []
+        seen = set()
+        for row, chunk in enumerate(chunks):
+            if isinstance(chunk, str):
+                chunk = {'text': chunk}
+            vector_id = f"{doc_id}#{self.content_hash(chunk['text'])[:32]}"
+            if vector_id in seen:
+                continue
+            seen.add(vector_id)
+            if vector_id in self._rows:
+                doc_rows.append(self._rows[vector_id])
+                continue
+            doc_rows.append(offset + len(new_ids))
+            new_ids.append(vector_id)
+            new_metadatas.append({"ingested_at": ingested_at, **{key: value for key, value in chunk.items() if key != 'text'},
+                                  "text": chunk['text'], "doc_id": doc_id})
+            rows.append(row)
+        if new_ids:
+            self._reserve(offset + len(new_ids))[offset:offset + len(new_ids)] = np.asarray(embeddings, dtype=np.float32)[rows]
+        self._append(doc_id, new_ids, new_metadatas, doc_rows)
+
+    def _append(self, doc_id: str, new_ids: List[str], new_metadatas: List[Dict[str, Union[str, int]]], doc_rows: List[int]) -> None:
+        """
+        Append new chunks, whose embeddings are already in the buffer, and make doc_rows the chunks of the document.
+
+        The previous chunks of the document that are not in doc_rows become stale: they are dropped
+        from the id lookup and their rows are left unused. They are dropped from the lexical index too,
+        unless the cache records them as still stored in an index: sync_index removes those once it
+        deletes them from the index.
+        """
+        offset = len(self.ids)
+        self._rows.update((vector_id, offset + i) for i, vector_id in enumerate(new_ids))
+        self.ids.extend(new_ids)
+        self.metadatas.extend(new_metadatas)
+        if new_ids and self.lexical_index is not None:
+            self.lexical_index.add(new_ids, [metadata['text'] for metadata in new_metadatas])
+
+        current = set(doc_rows)
+        stale_ids = [self.ids[row] for row in self._doc_rows.get(doc_id, []) if row not in current]
+        for vector_id in stale_ids:
+            del self._rows[vector_id]
+        if stale_ids and self.lexical_index is not None:
+            recorded = self.cache.recorded_ids(None, stale_ids) if self.cache is not None else set()
+            self.lexical_index.delete(set(stale_ids).difference(recorded))
+        self._doc_rows[doc_id] = doc_rows
+
+    def document_chunks(self, doc_id: str = "default") -> Tuple[List[Dict[str, Union[str, int]]], np.ndarray]:
+        """
+        Return the chunks of a document in this store and their embeddings, in the form add_embeddings takes.
+
+        Args:
+            doc_id (str): The id of the document. Default is "default".
+
+        Returns:
+            Tuple[List[Dict[str, Union[str, int]]], np.ndarray]: The chunks, as dictionaries with their 'text' and
+            metadata, and their embeddings, one row per chunk.
+        """
+        rows = self._doc_rows.get(doc_id, [])
+        chunks = [{key: value for key, value in self.metadatas[row].items() if key != 'doc_id'} for row in rows]
+        return chunks, self.embeddings[rows]
+
+    def _reserve(self, rows: int) -> np.ndarray:
+        """Return the embedding buffer with room for at least rows rows, doubling its capacity when it is full."""
+        if rows > len(self._buffer):
+            buffer = np.empty((max(rows, 2 * len(self._buffer), 1024), self._buffer.shape[1]), dtype=np.float32)
+            buffer[:len(self._buffer)] = self._buffer
+            self._buffer = buffer
+        return self._buffer
+
+    def _get_pool(self, num_workers: int) -> Optional[Dict]:
+        """Return the multi-process encoding pool of num_workers processes, or None for in-process encoding."""
+        if num_workers <= 1:
+            return None
+        if self._pool is not None and self._pool_workers != num_workers:
+            self.close()
+        if self._pool is None:
+            self._pool = self.model.start_multi_process_pool(target_devices=["cpu"] * num_workers)
+            self._pool_workers = num_workers
+        return self._pool
+
+    def close(self) -> None:
+        """Stop the encoding processes started by add_texts, if any. A later add_texts starts them again."""
+        if self._pool is not None:
+            self.model.stop_multi_process_pool(self._pool)
+            self._pool, self._pool_workers = None, 0
+
+    @staticmethod
+    def _windows(items: Iterable, size: int) -> Iterator[List]:
+        """Group an iterable into lists of at most size items."""
+        window = []
+        for item in items:
+            window.append(item)
+            if len(window) >= size:
+                yield window
+                window = []
+        if window:
+            yield window
+
+    @staticmethod
+    def content_hash(text: str) -> str:
+        """Return the SHA-256 hex digest of a chunk text, used for chunk ids and cache keys."""
+        return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+    def sync_index(self, index, doc_id: str = "default", index_name: Optional[str] = None, namespace: Optional[str] = None,
+                   **upsert_kwargs) -> Dict[str, int]:
+        """
+        Bring the index up to date with the chunks of a document in this store.
+
+        With an embedding cache and an index_name, the chunk ids last upserted for the document are
+        read from the cache: only new chunks are upserted and chunks that disappeared are deleted.
+        They are deleted from the lexical index too, unless another namespace of the index still
+        holds them. Otherwise every chunk of the document is upserted.
+
+        Args:
+            index: The index to update, e.g. a Pinecone index or a LocalIndex.
+            doc_id (str): The id of the document to sync. Default is "default".
+            index_name (Optional[str]): The name under which the upserted ids are recorded in the cache.
+            namespace (Optional[str]): The namespace of the index to sync, e.g. the tenant's. Defaults to the default namespace.
+            **upsert_kwargs: Options passed to upsert_vectors, such as batch_size or progress_callback.
+
+        Returns:
+            Dict[str, int]: The number of "upserted", "deleted" and "unchanged" chunks.
+        """
+        rows = self._doc_rows.get(doc_id, [])
+        current_ids = [self.ids[row] for row in rows]
+        track = self.cache is not None and index_name is not None
+        # Every namespace is tracked on its own, as if it were a separate index.
+        scope = f"{index_name}/{namespace}" if namespace else index_name
+        previous_ids = self.cache.document_ids(scope, doc_id) if track else set()
+
+        new_rows = [row for row in rows if self.ids[row] not in previous_ids]
+        stale_ids = sorted(previous_ids.difference(current_ids))
+
+        upserted = upsert_vectors(index, ((self.ids[row], self.embeddings[row].tolist(), self.metadatas[row]) for row in new_rows),
+                                  total=len(new_rows), namespace=namespace, **upsert_kwargs)
+        # Pinecone accepts at most 1000 ids per delete request.
+        for start in range(0, len(stale_ids), 1000):
+            index.delete(ids=stale_ids[start:start + 1000], **({"namespace": namespace} if namespace else {}))
+        if track:
+            self.cache.set_document_ids(scope, doc_id, current_ids)
+            if self.lexical_index is not None and stale_ids:
+                # The lexical index is shared by every namespace of the index: ids still stored in another one are kept.
+                self.lexical_index.delete(set(stale_ids).difference(self.cache.recorded_ids(index_name, stale_ids)))
+        return {"upserted": upserted, "deleted": len(stale_ids), "unchanged": len(current_ids) - len(new_rows)}
+
+    def _embed(self, texts: List[str], hashes: List[str], batch_size: int, pool: Optional[Dict] = None) -> np.ndarray:
+        """Return the embeddings of the texts, taking cached ones from the cache and encoding the rest."""
+        if self.cache is None:
+            return self._encode(texts, batch_size, pool)
+
+        cached = self.cache.get_many(hashes)
+        missing = [i for i, content_hash in enumerate(hashes) if content_hash not in cached]
+        telemetry.current_span().set_attribute("cached", len(texts) - len(missing))
+        embeddings = np.empty((len(texts), self.embeddings.shape[1]), dtype=np.float32)
+        for i, content_hash in enumerate(hashes):
+            if content_hash in cached:
+                embeddings[i] = cached[content_hash]
+        if missing:
+            encoded = self._encode([texts[i] for i in missing], batch_size, pool)
+            embeddings[missing] = encoded
+            self.cache.put_many([hashes[i] for i in missing], encoded)
+        return embeddings
+
+    def _encode(self, texts: List[str], batch_size: int, pool: Optional[Dict] = None) -> np.ndarray:
+        """Encode texts into a contiguous float32 matrix, using the multi-process pool if one is given."""
+        if pool is not None:
+            embeddings = self.model.encode_multi_process(texts, pool, batch_size=batch_size)
+        else:
+            embeddings = self.model.encode(texts, batch_size=batch_size, convert_to_numpy=True)
+        return np.ascontiguousarray(embeddings, dtype=np.float32)
+
+    def similarity_search(self, index, query: str, k: int = 5, score_threshold: Optional[float] = None,
+                          query_embedding: Optional[np.ndarray] = None, mode: str = "dense", rrf_k: int = 60,
+                          filter: Optional[Dict] = None, namespace: Optional[str] = None) -> List[Tuple[Dict[str, Union[str, int]], float]]:
         """
         Perform a similarity search for the given query.
 
+        The metadata is requested together with the matches, so a search costs a single
+        `index.query` round trip. Only when the index does not return metadata for a match is it
+        fetched with `index.fetch`, and the fetched metadata is cached for later searches.
+
+        In "hybrid" mode, the top 4k matches of the vector index and of the lexical index are fused
+        by reciprocal rank fusion: every chunk scores the sum of 1 / (rrf_k + rank) over the two
+        rankings. Exact terms such as error codes, SKUs or names, which embeddings tend to blur,
+        are then still found.
+
+        A metadata filter, e.g. {"doc_id": "manual.pdf"} or {"page": {"$lt": 10}}, and a namespace
+        are pushed down into `index.query`, so the index only ranks the matching chunks. The lexical
+        index holds every chunk of this store, so its matches are over-fetched and then checked
+        against the filter and, for a namespace, looked up in that namespace of the index. The
+        over-fetch is widened until enough matches are in scope or the lexical matches run out.
+
         Args:
+            index: The vector index to search, e.g. a Pinecone index or a LocalIndex.
             query (str): The search query.
             k (int): The number of top results to return.
+            score_threshold (Optional[float]): If given, matches scoring below it are dropped.
+            query_embedding (Optional[np.ndarray]): The embedding of the query, if already computed,
+                                                    e.g. by SemanticAnswerCache.embed.
+            mode (str): "dense" searches the vector index, "lexical" the lexical index and "hybrid" both.
+                        Default is "dense".
+            rrf_k (int): The rank offset of reciprocal rank fusion in "hybrid" mode. Default is 60.
+            filter (Optional[Dict]): A metadata filter in Pinecone's filter language the results must match.
+            namespace (Optional[str]): The namespace of the index to search. Defaults to the default namespace.
 
         Returns:
-            List[Tuple[Dict[str, Union[str, int]], float]]: A list of tuples containing the top-k similar chunks and their similarity scores.
-        """
-        query_embedding = self.model.encode(query)
-        results = index.query(vector=query_embedding.tolist(), top_k=k)
-        ids_to_fetch = [match['id'] for match in results['matches']]
-        fetched_embeddings = index.fetch(ids=ids_to_fetch)
-        fetched_chunks = [data.get("metadata") for id,data in fetched_embeddings["vectors"].items()]
-        return [chunk for chunk in fetched_chunks]
\ No newline at end of file
+            List[Tuple[Dict[str, Union[str, int]], float]]: A list of tuples containing the top-k similar chunks and their scores,
+            highest score first. The scores are similarities in "dense" mode, BM25 scores in "lexical" mode and
+            fused scores in "hybrid" mode.
+
+        Raises:
+            ValueError: If the mode is not supported, or is "lexical" or "hybrid" without a lexical index, or the filter is malformed.
+        """
+        if mode not in ("dense", "hybrid", "lexical"):
+            raise ValueError(f"Unsupported search mode: {mode}")
+        if mode != "dense" and self.lexical_index is None:
+            raise ValueError(f"The {mode} search mode requires a lexical index")
+
+        # Only passed when given, so indexes without filters or namespaces keep working.
+        query_kwargs = {key: value for key, value in (("filter", filter), ("namespace", namespace)) if value}
+        with telemetry.span("retrieve", k=k, mode=mode, filtered=bool(filter)):
+            matches = []
+            if mode != "lexical":
+                if query_embedding is None:
+                    with telemetry.span("embed.query"):
+                        query_embedding = self.model.encode(query)
+                top_k = k if mode == "dense" else 4 * k
+                with telemetry.span("retrieve.query", top_k=top_k):
+                    results = index.query(vector=np.asarray(query_embedding).tolist(), top_k=top_k, include_metadata=True, **query_kwargs)
+                matches = [(match['id'], match.get('metadata'), match['score']) for match in results['matches']]
+                if score_threshold is not None:
+                    matches = [match for match in matches if match[2] >= score_threshold]
+
+            if mode != "dense":
+                lexical_k = k if mode == "lexical" else 4 * k
+                with telemetry.span("retrieve.lexical"):
+                    if query_kwargs:
+                        lexical_matches = self._scoped_lexical_search(index, query, lexical_k, filter, namespace)
+                    else:
+                        lexical_matches = self.lexical_index.search(query, lexical_k)
+            if mode == "lexical":
+                matches = [(vector_id, None, score) for vector_id, score in lexical_matches]
+            elif mode == "hybrid":
+                matches = self._fuse(matches, lexical_matches, k, rrf_k)
+            matches = [(vector_id, metadata or self._local_metadata(vector_id), score) for vector_id, metadata, score in matches]
+
+            metadata_by_id = {vector_id: metadata for vector_id, metadata, _ in matches if metadata}
+            missing_ids = [vector_id for vector_id, metadata, _ in matches if not metadata]
+            if missing_ids:
+                metadata_by_id.update(self._fetch_metadata(index, missing_ids, namespace))
+
+            return [(metadata_by_id[vector_id], score) for vector_id, _, score in matches if vector_id in metadata_by_id]
+
+    @staticmethod
+    def _fuse(dense_matches: List[Tuple[str, Optional[Dict], float]], lexical_matches: List[Tuple[str, float]], k: int,
+              rrf_k: int) -> List[Tuple[str, Optional[Dict], float]]:
+        """Fuse the dense and lexical rankings by reciprocal rank fusion, keeping the top k."""
+        scores, metadata_by_id = {}, {}
+        for rank, (vector_id, metadata, _) in enumerate(dense_matches):
+            scores[vector_id] = 1.0 / (rrf_k + rank + 1)
+            metadata_by_id[vector_id] = metadata
+        for rank, (vector_id, _) in enumerate(lexical_matches):
+            scores[vector_id] = scores.get(vector_id, 0.0) + 1.0 / (rrf_k + rank + 1)
+        best = sorted(scores.items(), key=lambda item: item[1], reverse=True)[:k]
+        return [(vector_id, metadata_by_id.get(vector_id), score) for vector_id, score in best]
+
+    def _scoped_lexical_search(self, index, query: str, top_k: int, filter: Optional[Dict],
+                               namespace: Optional[str]) -> List[Tuple[str, float]]:
+        """Search the lexical index for the top_k matches in scope, widening the over-fetch until enough are found."""
+        fetch_k = 5 * top_k
+        while True:
+            matches = self.lexical_index.search(query, fetch_k)
+            scoped = self._scope_lexical(index, matches, filter, namespace)
+            # Fewer matches than requested means every chunk containing a query term was checked.
+            if len(scoped) >= top_k or len(matches) < fetch_k:
+                return scoped[:top_k]
+            fetch_k *= 4
+
+    def _scope_lexical(self, index, matches: List[Tuple[str, float]], filter: Optional[Dict],
+                       namespace: Optional[str]) -> List[Tuple[str, float]]:
+        """Keep the lexical matches that match the filter and, for a namespace, are stored in that namespace of the index."""
+        if namespace:
+            metadata_by_id = self._fetch_metadata(index, [vector_id for vector_id, _ in matches], namespace)
+        else:
+            metadata_by_id = {vector_id: self._local_metadata(vector_id) for vector_id, _ in matches}
+        return [(vector_id, score) for vector_id, score in matches
+                if metadata_by_id.get(vector_id) is not None and matches_filter(metadata_by_id[vector_id], filter)]
+
+    def _local_metadata(self, vector_id: str) -> Optional[Dict[str, Union[str, int]]]:
+        """Return the metadata of a chunk added to this store, or None."""
+        row = self._rows.get(vector_id)
+        return self.metadatas[row] if row is not None else None
+
+    def _fetch_metadata(self, index, ids: List[str], namespace: Optional[str] = None) -> Dict[str, Dict[str, Union[str, int]]]:
+        """Return the metadata for the given ids in a namespace, fetching only those not in the metadata cache."""
+        metadata_by_id = {}
+        to_fetch = []
+        with self._metadata_lock:
+            for vector_id in ids:
+                key = (id(index), namespace or "", vector_id)
+                if key in self._metadata_cache:
+                    self._metadata_cache.move_to_end(key)
+                    metadata_by_id[vector_id] = self._metadata_cache[key]
+                else:
+                    to_fetch.append(vector_id)
+
+        if to_fetch:
+            with telemetry.span("retrieve.fetch", ids=len(to_fetch)):
+                fetched = index.fetch(ids=to_fetch, **({"namespace": namespace} if namespace else {}))
+            with self._metadata_lock:
+                for vector_id, data in fetched["vectors"].items():
+                    metadata = data.get("metadata")
+                    metadata_by_id[vector_id] = metadata
+                    self._metadata_cache[(id(index), namespace or "", vector_id)] = metadata
+                while len(self._metadata_cache) > self.metadata_cache_size:
+                    self._metadata_cache.popitem(last=False)
+        return metadata_by_id
+
+    def clear_cache(self) -> None:
+        """Clear the cache of fetched metadata, e.g. after the index has been re-populated."""
+        with self._metadata_lock:
+            self._metadata_cache.clear()
@@ -0,0 +1,55 @@
+import os
+import argparse
+from contextlib import nullcontext
+from ragqnabot import BulkLoader, DocumentSplitter, VectorStore, EmbeddingCache, BM25Index, get_index, telemetry, profile
+from ragqnabot.configs import EMBEDDING_CACHE_DIR, LEXICAL_INDEX_DIR
+
+
+def main() :
+    parser = argparse.ArgumentParser(description="Ingest files, directory trees and URLs into a Pinecone index.")
+    parser.add_argument("sources", nargs="*", help="Files, directories or URLs to ingest")
+    parser.add_argument("--manifest", help="A file listing one path or URL per line")
+    parser.add_argument("--index-name", required=True, help="The Pinecone index to ingest into")
+    parser.add_argument("--workers", type=int, default=None, help="The number of parsing processes (default: number of CPUs)")
+    parser.add_argument("--connections", type=int, default=16, help="The number of concurrent HTTP requests")
+    parser.add_argument("--profile", metavar="FILE", help="Profile the run with cProfile and save the profile to FILE")
+    parser.add_argument("--metrics", metavar="FILE", help="Record per-stage latencies and write them to FILE in the Prometheus text format")
+    args = parser.parse_args()
+
+    sources = list(args.sources)
+    if args.manifest :
+        sources += BulkLoader.from_manifest(args.manifest).sources
+    if not sources :
+        parser.error("no sources given")
+
+    if args.metrics :
+        telemetry.enable()
+    with profile(args.profile) if args.profile else nullcontext() :
+        ingest(args, sources)
+    if args.metrics :
+        with open(args.metrics, "w", encoding="utf-8") as file :
+            file.write(telemetry.export_prometheus())
+        for stage, stats in telemetry.stats().items() :
+            print(f"{stage:22s} {stats['count']:7d} x  p50 {stats['p50_ms']:9.1f} ms  p95 {stats['p95_ms']:9.1f} ms  total {stats['total_seconds']:8.1f} s")
+
+def ingest(args, sources) :
+    bulk_loader = BulkLoader(sources, max_workers=args.workers, max_connections=args.connections)
+    lexical_index = BM25Index.open(os.path.join(LEXICAL_INDEX_DIR, args.index_name))
+    vectstore = VectorStore(cache=EmbeddingCache(EMBEDDING_CACHE_DIR), lexical_index=lexical_index)
+    splitter = DocumentSplitter(mode="tokens")
+    index = get_index(args.index_name, create=True)
+
+    loaded = 0
+    for document in bulk_loader.iter_documents() :
+        vectstore.add_texts(splitter.split_segments(document["segments"]), doc_id=document["source"])
+        stats = vectstore.sync_index(index, doc_id=document["source"], index_name=args.index_name)
+        loaded += 1
+        print(f"{document['source']}: upserted {stats['upserted']}, deleted {stats['deleted']}, kept {stats['unchanged']} chunks")
+
+    lexical_index.save()
+    for error in bulk_loader.errors :
+        print(f"Failed {error['source']}: {error['error']}")
+    print(f"Loaded {loaded} sources, {len(bulk_loader.errors)} failed")
+
+if __name__ == "__main__" :
+    main()
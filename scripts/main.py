@@ -1,33 +1,102 @@
-from ragqnabot import DocumentLoader, DocumentSplitter, VectorStore, generate_answer, setup_pinecone
+import os
+import threading
+from ragqnabot import BulkLoader, DocumentLoader, DocumentSplitter, VectorStore, EmbeddingCache, SemanticAnswerCache, ContextBuilder, BM25Index, CrossEncoderReranker, SessionSnapshot, stream_answer, get_index, setup_local_index, warm_up_model, telemetry
+from ragqnabot.answergen import ErrorMessage
+from ragqnabot.configs import EMBEDDING_CACHE_DIR, LEXICAL_INDEX_DIR, RERANKER_MODEL, RERANK_LATENCY_BUDGET, LOCAL_INDEX_STORAGE
 
 
 def main() :
-    data_path = input("Enter Your Data Path : ")
-    loader = DocumentLoader(path=data_path)
-    data = loader.load_data()
+    # The embedding model loads while the data path is typed in; VectorStore waits for it if needed
+    threading.Thread(target=warm_up_model, daemon=True).start()
+    reranker = None
+    if RERANKER_MODEL :
+        reranker = CrossEncoderReranker(RERANKER_MODEL, latency_budget=RERANK_LATENCY_BUDGET)
+        reranker.warm_up()
 
-    splitter = DocumentSplitter(data=data)
-    chunks = splitter.split_data()
+    data_path = input("Enter Your Data Path (a file, URL or directory) : ")
+    splitter = DocumentSplitter(mode="tokens")
+    vectstore = VectorStore(cache=EmbeddingCache(EMBEDDING_CACHE_DIR))
 
-    vectstore = VectorStore()
-    vectstore.add_texts(chunks=chunks)
+    if os.path.isdir(data_path) :
+        result = BulkLoader([data_path]).ingest(vectstore, splitter)
+        doc_ids = result["documents"]
+        for error in result["errors"] :
+            print(f"Skipped {error['source']}: {error['error']}")
+    else :
+        # An unchanged file ingested before is restored from its snapshot, without loading, splitting or embedding it
+        snapshot = SessionSnapshot()
+        if snapshot.restore(vectstore, data_path, splitter) :
+            print(f"Restored {len(vectstore.ids)} chunks of {data_path} from its snapshot")
+        else :
+            loader = DocumentLoader(path=data_path)
+            segments = loader.iter_segments()
+            chunks = splitter.split_segments(segments)
+            vectstore.add_texts(chunks=chunks, doc_id=data_path)
+            snapshot.save(vectstore, data_path, splitter)
+        doc_ids = [data_path]
 
-    vectors = vectstore.vectors
-    index_name = input("Enter Index Name : ")
-    index = setup_pinecone(index_name, vectors)
+    index_name = input("Enter Index Name (leave empty for a local in-memory index) : ")
+    namespace = None
+    if index_name :
+        # Tenants share one Pinecone index, each in a namespace of its own
+        namespace = input("Enter Namespace (leave empty for the default namespace) : ") or None
+    answer_cache = SemanticAnswerCache()
+    context_builder = ContextBuilder()
+    scope = f"{index_name}/{namespace}" if namespace else index_name or "local"
+    # The lexical index of a Pinecone index is kept on disk, next to the embedding cache
+    vectstore.lexical_index = BM25Index.open(os.path.join(LEXICAL_INDEX_DIR, index_name)) if index_name else BM25Index()
+    vectstore.lexical_index.add(vectstore.ids, [metadata['text'] for metadata in vectstore.metadatas])
+    if index_name :
+        index = get_index(index_name, create=True)
+        for doc_id in doc_ids :
+            stats = vectstore.sync_index(index, doc_id=doc_id, index_name=index_name, namespace=namespace)
+            print(f"{doc_id}: upserted {stats['upserted']}, deleted {stats['deleted']}, kept {stats['unchanged']} chunks")
+            if stats['upserted'] or stats['deleted'] :
+                answer_cache.invalidate(scope)
+        vectstore.lexical_index.save()
+    else :
+        index = setup_local_index(vectstore.iter_vectors(), dimension=vectstore.embeddings.shape[1], storage=LOCAL_INDEX_STORAGE)
 
     while True :
         query = input("Ask a Query or type 'Quit' to Exit : ")
 
         if query == "Quit" :
+            stats = answer_cache.stats()
+            print(f"Answered {stats['hits']} of {stats['hits'] + stats['misses']} queries from the answer cache")
+            context_stats = context_builder.stats()
+            print(f"Context assembly saved {context_stats['saved_tokens']} of {context_stats['original_tokens']} prompt tokens")
+            if reranker is not None :
+                rerank_stats = reranker.stats()
+                print(f"Re-ranked {rerank_stats['queries'] - rerank_stats['skipped']} of {rerank_stats['queries']} queries")
+            if telemetry.enabled :
+                for stage, stage_stats in telemetry.stats().items() :
+                    print(f"{stage:22s} {stage_stats['count']:5d} x  p50 {stage_stats['p50_ms']:9.1f} ms  p95 {stage_stats['p95_ms']:9.1f} ms")
             break
 
         else :
-            relevant_chunks = vectstore.similarity_search(index, query, k=3)
+            query_embedding = answer_cache.embed(query)
+            cached = answer_cache.lookup(scope, query, query_embedding)
+            if cached is not None :
+                print(cached["answer"])
+                continue
+
+            mode = "hybrid" if len(vectstore.lexical_index) else "dense"
+            k = reranker.num_candidates if reranker is not None else 3
+            relevant_chunks = vectstore.similarity_search(index, query, k=k, query_embedding=query_embedding, mode=mode, namespace=namespace)
+            if reranker is not None :
+                relevant_chunks = reranker.rerank(query, relevant_chunks)
+
+            context = context_builder.build(relevant_chunks)
 
-            answer = generate_answer(query, relevant_chunks)
+            pieces = []
+            for piece in stream_answer(query, context["chunks"]) :
+                print(piece, end="", flush=True)
+                pieces.append(piece)
+            print()
 
-            print(answer)
+            # A failed stream ends with an ErrorMessage, possibly after part of the answer, which must not be cached
+            if not any(isinstance(piece, ErrorMessage) for piece in pieces) :
+                answer_cache.store(scope, query, "".join(pieces), query_embedding, sources=[chunk for chunk, _ in relevant_chunks])
 
 if __name__ == "__main__" :
     main()
\ No newline at end of file
@@ -1,7 +1,7 @@
 import streamlit as st
-from ragqnabot.configs import PINECONE_API_KEY
-from ragqnabot import DocumentLoader, DocumentSplitter, VectorStore, generate_answer, setup_pinecone, list_indexes
-from pinecone import Pinecone
+from ragqnabot import DocumentLoader, DocumentSplitter, VectorStore, EmbeddingCache, SemanticAnswerCache, ContextBuilder, BM25Index, CrossEncoderReranker, SessionSnapshot, stream_answer, get_index, list_indexes, warm_up_model, telemetry
+from ragqnabot.answergen import ErrorMessage
+from ragqnabot.configs import EMBEDDING_CACHE_DIR, LEXICAL_INDEX_DIR, RERANKER_MODEL, RERANK_LATENCY_BUDGET
 import os
 
 def extract_text(response):
@@ -11,6 +11,45 @@ def extract_text(response):
             return item.text
     return str(response)
 
+@st.cache_resource
+def get_answer_cache():
+    # Shared by all sessions, so a question asked by one user is answered from the cache for the others
+    return SemanticAnswerCache()
+
+@st.cache_resource
+def get_embedding_cache():
+    # Opened once and shared by all sessions, instead of opening the database again on every click
+    return EmbeddingCache(EMBEDDING_CACHE_DIR)
+
+@st.cache_resource
+def get_context_builder():
+    return ContextBuilder()
+
+@st.cache_resource
+def get_reranker():
+    # Shared by all sessions, together with its score cache; None unless RERANKER_MODEL is set
+    if not RERANKER_MODEL:
+        return None
+    reranker = CrossEncoderReranker(RERANKER_MODEL, latency_budget=RERANK_LATENCY_BUDGET)
+    reranker.warm_up()
+    return reranker
+
+@st.cache_resource
+def get_snapshot():
+    return SessionSnapshot()
+
+@st.cache_resource
+def get_lexical_index(index_name):
+    # Memory-mapped from disk and shared by all sessions; empty for indexes built elsewhere
+    return BM25Index.open(os.path.join(LEXICAL_INDEX_DIR, index_name))
+
+def answer_scope(document_only=False):
+    # Answers are cached per index, namespace and document filter, as they depend on the chunks searched
+    scope = st.session_state.active_index_name
+    if st.session_state.namespace:
+        scope = f"{scope}/{st.session_state.namespace}"
+    return f"{scope}#{st.session_state.doc_id}" if document_only else scope
+
 def initialize_session_state():
     if 'file_uploaded' not in st.session_state:
         st.session_state.file_uploaded = False
@@ -18,8 +57,21 @@ def initialize_session_state():
         st.session_state.indexed = False
     if 'index' not in st.session_state:
         st.session_state.index = None
+    # The index being searched; not "index_name", which is the key of the index name text input
+    if 'active_index_name' not in st.session_state:
+        st.session_state.active_index_name = None
+    if 'namespace' not in st.session_state:
+        st.session_state.namespace = None
     if 'chunks' not in st.session_state:
         st.session_state.chunks = None
+    if 'doc_id' not in st.session_state:
+        st.session_state.doc_id = None
+    if 'data_path' not in st.session_state:
+        st.session_state.data_path = None
+    if 'upload_key' not in st.session_state:
+        st.session_state.upload_key = None
+    if 'embeddings' not in st.session_state:
+        st.session_state.embeddings = None
     if 'qna_mode' not in st.session_state:
         st.session_state.qna_mode = False
     if 'chat_history' not in st.session_state:
@@ -27,36 +79,64 @@ def initialize_session_state():
 
 def handle_file_upload():
     uploaded_file = st.file_uploader("Upload a document file", type=["txt", "pdf", "docx"])
-    if uploaded_file is not None:
+    # Every rerun sees the uploaded file again; it is only processed once
+    if uploaded_file is not None and st.session_state.upload_key != (uploaded_file.name, uploaded_file.size):
         with st.spinner("Processing your document..."):
             data_path = os.path.join("./data", uploaded_file.name)
             with open(data_path, "wb") as f:
                 f.write(uploaded_file.getbuffer())
-            
-            loader = DocumentLoader(path=data_path)
-            data = loader.load_data()
 
-            splitter = DocumentSplitter(data=data)
-            chunks = splitter.split_data()
+            splitter = DocumentSplitter(mode="tokens")
+            # A document uploaded before is restored with its embeddings, instead of being loaded and split again
+            snapshot = get_snapshot().load(data_path, splitter.embedding_model_name, splitter)
+            if snapshot is not None:
+                chunks, embeddings = snapshot
+            else:
+                loader = DocumentLoader(path=data_path)
+                chunks, embeddings = list(splitter.split_segments(loader.iter_segments())), None
 
             st.session_state.chunks = chunks
+            st.session_state.embeddings = embeddings
+            st.session_state.data_path = data_path
+            st.session_state.doc_id = uploaded_file.name
+            st.session_state.upload_key = (uploaded_file.name, uploaded_file.size)
             st.session_state.file_uploaded = True
-            st.success(f"File successfully uploaded and split into {len(chunks)} chunks!")
+    if uploaded_file is not None and st.session_state.chunks:
+        st.success(f"File successfully uploaded and split into {len(st.session_state.chunks)} chunks!")
 
 def handle_indexing():
     if st.session_state.file_uploaded:
         with st.expander("Index your document", expanded=not st.session_state.indexed):
             index_name = st.text_input("Enter a name for your index", key="index_name")
+            namespace = st.text_input("Namespace, e.g. your team (optional)", key="index_namespace") or None
             index_button = st.button("Create Index", disabled=not index_name)
             
             if index_button and st.session_state.chunks:
                 with st.spinner("Indexing document... This may take a few moments."):
                     try:
-                        vecstore = VectorStore()
-                        vecstore.add_texts(chunks=st.session_state.chunks)
-                        vectors = vecstore.vectors
-                        index = setup_pinecone(index_name=index_name, vectors=vectors)
+                        lexical_index = get_lexical_index(index_name)
+                        vecstore = VectorStore(cache=get_embedding_cache(), lexical_index=lexical_index)
+                        if st.session_state.embeddings is not None:
+                            vecstore.add_embeddings(st.session_state.chunks, st.session_state.embeddings, doc_id=st.session_state.doc_id)
+                        else:
+                            vecstore.add_texts(chunks=st.session_state.chunks, doc_id=st.session_state.doc_id)
+                            get_snapshot().save(vecstore, st.session_state.data_path, DocumentSplitter(mode="tokens"), doc_id=st.session_state.doc_id)
+                        progress_bar = st.progress(0.0, text="Uploading vectors...")
+
+                        def show_progress(upserted, total, rate):
+                            progress_bar.progress(upserted / total, text=f"Uploaded {upserted}/{total} vectors ({rate:.0f} vectors/sec)")
+
+                        index = get_index(index_name, create=True)
+                        stats = vecstore.sync_index(index, doc_id=st.session_state.doc_id, index_name=index_name, namespace=namespace,
+                                                    progress_callback=show_progress)
+                        # Search the index and namespace just written to, and drop the answers given from their old contents
                         st.session_state.index = index
+                        st.session_state.active_index_name = index_name
+                        st.session_state.namespace = namespace
+                        if stats["upserted"] or stats["deleted"]:
+                            get_answer_cache().invalidate(answer_scope())
+                            get_answer_cache().invalidate(answer_scope(document_only=True))
+                        lexical_index.save()
                         st.session_state.indexed = True
                         st.session_state.qna_mode = True
                         st.success(f"Document successfully indexed as: {index_name}")
@@ -73,11 +153,13 @@ def handle_index_selection():
 
     if existing_indexes:
         selected_index = st.selectbox("Select an existing index:", existing_indexes)
+        namespace = st.text_input("Namespace (leave empty for the default namespace)", key="selected_namespace") or None
         if st.button("Use Selected Index"):
             try:
-                pinecone = Pinecone(api_key=PINECONE_API_KEY)
-                index = pinecone.Index(selected_index)
+                index = get_index(selected_index)
                 st.session_state.index = index
+                st.session_state.active_index_name = selected_index
+                st.session_state.namespace = namespace
                 st.session_state.indexed = True
                 st.session_state.qna_mode = True
                 st.success(f"Using existing index: {selected_index}")
@@ -101,25 +183,56 @@ def handle_qa_chat():
         # Chat input
         st.markdown("<br>", unsafe_allow_html=True)
         user_input = st.text_input("Ask a question about your document", key="user_input",  value="")
+        # The filter is evaluated by the index, so only the chunks of the document are ranked
+        document_only = st.session_state.doc_id is not None and st.checkbox(f"Only search {st.session_state.doc_id}", key="document_only")
         if st.button("Send", key="send_button"):
             if user_input:
-                with st.spinner("Thinking..."):
-                    try:
-                        vecstore_new = VectorStore()
-                        retrieved_docs = vecstore_new.similarity_search(index=st.session_state.index, query=user_input, k=3)
-                        if retrieved_docs:
-                            answer = generate_answer(query=user_input, retrieved_docs=retrieved_docs)
-                            response = extract_text(answer)
-                            
-                            # Add to chat history
-                            st.session_state.chat_history.append((user_input, response))
-                            
-                            # Rerun to update the chat display
-                            st.rerun()
-                        else:
-                            st.warning("No relevant information found in the document.")
-                    except Exception as e:
-                        st.error(f"Error during question answering: {str(e)}")
+                try:
+                    answer_cache = get_answer_cache()
+                    scope = answer_scope(document_only)
+                    query_embedding = answer_cache.embed(user_input)
+                    cached = answer_cache.lookup(scope, user_input, query_embedding)
+                    if cached is not None:
+                        st.session_state.chat_history.append((user_input, cached["answer"]))
+                        st.rerun()
+
+                    with st.spinner("Searching your document..."):
+                        lexical_index = get_lexical_index(st.session_state.active_index_name)
+                        reranker = get_reranker()
+                        vecstore_new = VectorStore(lexical_index=lexical_index)
+                        retrieved_docs = vecstore_new.similarity_search(index=st.session_state.index, query=user_input,
+                                                                        k=reranker.num_candidates if reranker else 3,
+                                                                        query_embedding=query_embedding,
+                                                                        mode="hybrid" if len(lexical_index) else "dense",
+                                                                        filter={"doc_id": st.session_state.doc_id} if document_only else None,
+                                                                        namespace=st.session_state.namespace)
+                        if reranker is not None:
+                            retrieved_docs = reranker.rerank(user_input, retrieved_docs)
+                    if retrieved_docs:
+                        message(user_input, is_user=True)
+                        st.markdown("<br>", unsafe_allow_html=True)
+                        # Render the answer piece by piece as it is generated
+                        context = get_context_builder().build(retrieved_docs)
+                        # Keep the pieces: a failed stream ends with an ErrorMessage, possibly after part of the answer
+                        pieces = []
+                        def answer_pieces():
+                            for piece in stream_answer(query=user_input, retrieved_docs=context["chunks"]):
+                                pieces.append(piece)
+                                yield piece
+                        response = extract_text(st.write_stream(answer_pieces()))
+                        if not any(isinstance(piece, ErrorMessage) for piece in pieces):
+                            answer_cache.store(scope, user_input, response, query_embedding,
+                                               sources=[doc for doc, _ in retrieved_docs])
+
+                        # Add to chat history
+                        st.session_state.chat_history.append((user_input, response))
+
+                        # Rerun to update the chat display
+                        st.rerun()
+                    else:
+                        st.warning("No relevant information found in the document.")
+                except Exception as e:
+                    st.error(f"Error during question answering: {str(e)}")
             else:
                 st.warning("Please enter a question.")
 
@@ -134,6 +247,7 @@ def main():
     st.title("📚 Smart Document Q&A System")
 
     initialize_session_state()
+    warm_up_model()
 
     st.sidebar.title("Navigation")
     app_mode = st.sidebar.radio("Choose a mode:", ["Upload & Index", "Use Existing Index", "Chat with Document"])
@@ -153,6 +267,18 @@ def main():
             st.warning("Please upload and index a document or select an existing index before starting a chat.")
 
     st.sidebar.markdown("---")
+    cache_stats = get_answer_cache().stats()
+    st.sidebar.caption(f"Answer cache: {cache_stats['entries']} answers, {cache_stats['hit_rate']:.0%} hit rate")
+    context_stats = get_context_builder().stats()
+    st.sidebar.caption(f"Context assembly: {context_stats['saved_tokens']} prompt tokens saved ({context_stats['saved_ratio']:.0%})")
+    reranker = get_reranker()
+    if reranker is not None:
+        rerank_stats = reranker.stats()
+        st.sidebar.caption(f"Re-ranking: {rerank_stats['queries'] - rerank_stats['skipped']} of {rerank_stats['queries']} queries re-ranked")
+    if telemetry.enabled:
+        with st.sidebar.expander("Stage latencies"):
+            st.table({stage: {"count": stats["count"], "p50 (ms)": round(stats["p50_ms"], 1), "p95 (ms)": round(stats["p95_ms"], 1)}
+                      for stage, stats in telemetry.stats().items()})
     st.sidebar.info("This app allows you to upload documents, index them, and chat about their content using AI.")
 
 if __name__ == "__main__":
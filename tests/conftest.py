@@ -0,0 +1,44 @@
+import re
+import zlib
+import numpy as np
+import pytest
+from ragqnabot.modelregistry import _registry
+
+DIMENSION = 384
+
+
+class FakeModel:
+    """
+    A stand-in for a SentenceTransformer: every word adds a fixed random vector, so texts sharing
+    words have similar embeddings. Registered in the model registry, so no model is downloaded.
+    """
+
+    max_seq_length = 256
+
+    def __init__(self):
+        self.encoded = 0
+
+    def get_sentence_embedding_dimension(self):
+        return DIMENSION
+
+    def encode(self, texts, batch_size=32, convert_to_numpy=True, **kwargs):
+        single = isinstance(texts, str)
+        embeddings = np.stack([self._embed(text) for text in ([texts] if single else texts)])
+        self.encoded += len(embeddings)
+        return embeddings[0] if single else embeddings
+
+    @staticmethod
+    def _embed(text):
+        embedding = np.zeros(DIMENSION, dtype=np.float32)
+        for word in re.findall(r'\w+', text.lower()) or [""]:
+            embedding += np.random.default_rng(zlib.crc32(word.encode('utf-8'))).standard_normal(DIMENSION).astype(np.float32)
+        return embedding / np.linalg.norm(embedding)
+
+
+@pytest.fixture(autouse=True)
+def fake_model():
+    """Register a FakeModel as the default embedding model for the duration of a test."""
+    model = FakeModel()
+    _registry._models[('all-MiniLM-L6-v2', None)] = model
+    yield model
+    _registry.evict()
@@ -0,0 +1,89 @@
+import pytest
+from ragqnabot.answercache import SemanticAnswerCache
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    """A settable time.time for the cache's entry ages."""
+    now = [1000.0]
+    monkeypatch.setattr("ragqnabot.answercache.time.time", lambda: now[0])
+    return now
+
+
+def test_similar_queries_hit_within_their_scope():
+    cache = SemanticAnswerCache(threshold=0.9)
+    cache.store("docs", "When are invoices paid?", "Within thirty days.", sources=[{"text": "Invoices are paid within thirty days."}])
+    hit = cache.lookup("docs", "when are invoices paid")
+    assert hit["answer"] == "Within thirty days." and hit["query"] == "When are invoices paid?"
+    assert hit["similarity"] == pytest.approx(1.0) and hit["sources"][0]["text"].startswith("Invoices")
+    assert cache.lookup("docs", "How long do refunds take?") is None
+    assert cache.lookup("other", "When are invoices paid?") is None
+    assert cache.stats()["hits"] == 1 and cache.stats()["misses"] == 2 and cache.stats()["hit_rate"] == pytest.approx(1 / 3)
+
+
+def test_precomputed_embeddings_are_used(fake_model):
+    cache = SemanticAnswerCache()
+    embedding = cache.embed("When are invoices paid?")
+    encoded = fake_model.encoded
+    cache.store("docs", "When are invoices paid?", "Within thirty days.", embedding=embedding)
+    assert cache.lookup("docs", "When are invoices paid?", embedding=embedding)["answer"] == "Within thirty days."
+    assert fake_model.encoded == encoded
+
+
+def test_entries_expire_after_the_ttl(clock):
+    cache = SemanticAnswerCache(ttl=60)
+    cache.store("docs", "When are invoices paid?", "Within thirty days.")
+    clock[0] += 59
+    assert cache.lookup("docs", "When are invoices paid?") is not None
+    clock[0] += 2
+    assert cache.lookup("docs", "When are invoices paid?") is None
+    assert cache.stats()["expirations"] == 1 and cache.stats()["entries"] == 0
+
+    cache.store("docs", "When are invoices paid?", "Net 30.")
+    assert cache.lookup("docs", "When are invoices paid?")["answer"] == "Net 30."
+
+
+def test_no_ttl_keeps_entries(clock):
+    cache = SemanticAnswerCache(ttl=None)
+    cache.store("docs", "When are invoices paid?", "Within thirty days.")
+    clock[0] += 10 ** 6
+    assert cache.lookup("docs", "When are invoices paid?") is not None
+
+
+def test_least_recently_used_entries_are_evicted():
+    cache = SemanticAnswerCache(max_entries=2)
+    cache.store("docs", "When are invoices paid?", "Within thirty days.")
+    cache.store("faq", "How long do refunds take?", "Five business days.")
+    # The lookup makes the invoice answer the most recently used, so the refund answer is evicted.
+    assert cache.lookup("docs", "When are invoices paid?") is not None
+    cache.store("docs", "Who approves purchase orders?", "The finance team.")
+    assert cache.lookup("faq", "How long do refunds take?") is None
+    assert cache.lookup("docs", "When are invoices paid?") is not None
+    assert cache.lookup("docs", "Who approves purchase orders?") is not None
+    assert cache.stats()["evictions"] == 1 and cache.stats()["entries"] == 2
+
+
+def test_many_entries_in_one_scope():
+    cache = SemanticAnswerCache(max_entries=100)
+    for i in range(40):
+        cache.store("docs", f"question number {i} about topic{i}", f"answer {i}")
+    assert cache.lookup("docs", "question number 33 about topic33")["answer"] == "answer 33"
+    assert cache.stats()["entries"] == 40
+
+
+def test_invalidate_drops_a_scope_or_every_scope():
+    cache = SemanticAnswerCache()
+    cache.store("docs", "When are invoices paid?", "Within thirty days.")
+    cache.store("docs#policy.txt", "When are invoices paid?", "Within thirty days.")
+    cache.store("faq", "How long do refunds take?", "Five business days.")
+
+    cache.invalidate("docs")
+    assert cache.lookup("docs", "When are invoices paid?") is None
+    assert cache.lookup("docs#policy.txt", "When are invoices paid?") is not None
+    assert cache.stats()["entries"] == 2 and cache.stats()["invalidations"] == 1
+
+    cache.invalidate("missing")
+    assert cache.stats()["invalidations"] == 1
+    cache.invalidate()
+    assert cache.lookup("faq", "How long do refunds take?") is None
+    assert cache.stats()["entries"] == 0 and cache.stats()["invalidations"] == 3
@@ -0,0 +1,79 @@
+import os
+import numpy as np
+import pytest
+import ragqnabot
+from ragqnabot import LocalIndex, SemanticAnswerCache
+
+streamlit = pytest.importorskip("streamlit")
+from streamlit.testing.v1 import AppTest
+
+APP = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "streamlit-ui", "app.py")
+
+
+@pytest.fixture
+def app(tmp_path, monkeypatch, fake_model):
+    """The Streamlit app with a local index in place of Pinecone, and its caches in a temporary directory."""
+    monkeypatch.chdir(tmp_path)
+    indexes = {}
+    monkeypatch.setattr(ragqnabot, "get_index", lambda name, create=False: indexes.setdefault(name, LocalIndex(dimension=384)),
+                        raising=False)
+    monkeypatch.setattr(ragqnabot, "list_indexes", lambda: [{"name": name} for name in indexes], raising=False)
+    streamlit.cache_resource.clear()
+    at = AppTest.from_file(APP, default_timeout=30)
+    at.run()
+    chunks = [{"text": "Invoices are paid within thirty days."}, {"text": "Refunds take five business days."}]
+    at.session_state["chunks"] = chunks
+    at.session_state["embeddings"] = fake_model.encode([chunk["text"] for chunk in chunks])
+    at.session_state["doc_id"] = "policy.txt"
+    at.session_state["data_path"] = str(tmp_path / "policy.txt")
+    at.session_state["file_uploaded"] = True
+    at.indexes = indexes
+    yield at
+    streamlit.cache_resource.clear()
+
+
+def create_index(at, index_name, namespace=""):
+    at.run()
+    at.text_input(key="index_name").input(index_name)
+    at.text_input(key="index_namespace").input(namespace)
+    at.run()
+    next(button for button in at.button if button.label == "Create Index").click()
+    at.run()
+
+
+def test_indexing_sets_the_active_index_and_namespace(app):
+    create_index(app, "docs", "team-a")
+
+    assert not app.exception
+    assert not app.error, [error.value for error in app.error]
+    assert app.session_state["indexed"] and app.session_state["qna_mode"]
+    assert app.session_state["active_index_name"] == "docs"
+    assert app.session_state["namespace"] == "team-a"
+    assert app.session_state["index"] is app.indexes["docs"]
+    stats = app.indexes["docs"].describe_index_stats()
+    assert stats["namespaces"]["team-a"]["vector_count"] == 2
+
+
+def test_reindexing_invalidates_cached_answers(app, monkeypatch):
+    invalidated = []
+    monkeypatch.setattr(SemanticAnswerCache, "invalidate", lambda self, scope=None: invalidated.append(scope))
+    create_index(app, "docs")
+
+    assert app.session_state["namespace"] is None
+    assert invalidated == ["docs", "docs#policy.txt"]
+
+
+def test_selecting_an_existing_index(app):
+    create_index(app, "docs", "team-a")
+    app.indexes["archive"] = LocalIndex(dimension=384)
+    app.sidebar.radio[0].set_value("Use Existing Index").run()
+    app.selectbox[0].set_value("archive")
+    app.text_input(key="selected_namespace").input("team-b")
+    app.run()
+    next(button for button in app.button if button.label == "Use Selected Index").click()
+    app.run()
+
+    # The active index is not kept under "index_name", the key of the index name input.
+    assert not app.exception
+    assert app.session_state["active_index_name"] == "archive" and app.session_state["namespace"] == "team-b"
+    assert app.session_state["index"] is app.indexes["archive"]
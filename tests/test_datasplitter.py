@@ -0,0 +1,39 @@
+import re
+import time
+from ragqnabot.datasplitter import SENTENCE_PATTERN, DocumentSplitter
+
+
+class WordTokenizer:
+    """A stand-in for a Hugging Face fast tokenizer with one token per run of non-space characters."""
+
+    def __call__(self, texts, add_special_tokens=False, return_offsets_mapping=False):
+        if return_offsets_mapping:
+            return {'offset_mapping': [match.span() for match in re.finditer(r'\S+', texts)]}
+        return {'input_ids': [re.findall(r'\S+', text) for text in texts]}
+
+
+def sentences(text):
+    return [match.group() for match in SENTENCE_PATTERN.finditer(text)]
+
+
+def test_sentences():
+    assert sentences("First one. Second?! Third...\n\nNew paragraph") == \
+        ["First one.", "Second?!", "Third...", "New paragraph"]
+    assert sentences("e.g.this is one. ?! Then") == ["e.g.this is one.", "?!", "Then"]
+
+
+def test_long_punctuation_run_is_linear():
+    for text in ("." * 40000, "a" + "!?" * 20000 + "b", ("." * 5000 + "a ") * 8):
+        start = time.perf_counter()
+        spans = [match.span() for match in SENTENCE_PATTERN.finditer(text)]
+        assert time.perf_counter() - start < 0.5
+        assert spans[0][0] == 0 and spans[-1][1] == len(text)
+
+
+def test_token_chunks_with_long_punctuation_run():
+    text = "Before. " + "." * 40000 + " After."
+    splitter = DocumentSplitter(text, mode="tokens", max_tokens=8, tokenizer=WordTokenizer())
+    start = time.perf_counter()
+    chunks = splitter.split_data()
+    assert time.perf_counter() - start < 0.5
+    assert [chunk['text'] for chunk in chunks] == ["Before. " + "." * 40000 + " After."]
@@ -0,0 +1,109 @@
+import threading
+import numpy as np
+import pytest
+from ragqnabot.localindex import LocalIndex
+
+DIMENSION = 64
+
+
+@pytest.fixture(scope="module")
+def data():
+    """Clustered vectors, as embeddings are, and queries near some of them."""
+    rng = np.random.default_rng(0)
+    centers = rng.standard_normal((50, DIMENSION)).astype(np.float32)
+    vectors = centers[rng.integers(0, 50, 6000)] + 0.5 * rng.standard_normal((6000, DIMENSION)).astype(np.float32)
+    queries = vectors[rng.choice(6000, 50, replace=False)] + 0.1 * rng.standard_normal((50, DIMENSION)).astype(np.float32)
+    return vectors, queries
+
+
+def build(vectors, **kwargs):
+    index = LocalIndex(dimension=DIMENSION, **kwargs)
+    index.upsert([(str(i), vector, {"group": i % 3}) for i, vector in enumerate(vectors)])
+    return index
+
+
+def recall(index, reference, queries, top_k=10, **kwargs):
+    found = 0
+    for query in queries:
+        expected = {match["id"] for match in reference.query(query, top_k=top_k, **kwargs)["matches"]}
+        found += len(expected & {match["id"] for match in index.query(query, top_k=top_k, **kwargs)["matches"]})
+    return found / (top_k * len(queries))
+
+
+def test_exact_search_matches_brute_force(data):
+    vectors, queries = data
+    index = build(vectors, mode="exact")
+    normalized = vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+    for query in queries[:5]:
+        scores = normalized @ (query / np.linalg.norm(query))
+        matches = index.query(query, top_k=5)["matches"]
+        assert [match["id"] for match in matches] == [str(row) for row in np.argsort(-scores)[:5]]
+        assert np.allclose([match["score"] for match in matches], np.sort(scores)[::-1][:5], atol=1e-5)
+
+
+def test_ivf_recall(data):
+    vectors, queries = data
+    exact = build(vectors, mode="exact")
+    ivf = build(vectors, mode="ivf", nprobe=8)
+    assert ivf.describe_index_stats()["mode"] == "ivf"
+    assert recall(ivf, exact, queries) >= 0.9
+    assert recall(ivf, exact, queries, filter={"group": 1}) >= 0.9
+
+
+# The product quantizer's 8 bytes per vector need a larger re-scoring pool than the scalar quantizers.
+@pytest.mark.parametrize("storage, rescore, minimum", [("float16", 4, 0.99), ("int8", 4, 0.97), ("int8", 0, 0.9), ("pq", 16, 0.95)])
+def test_quantized_recall(data, storage, rescore, minimum):
+    vectors, queries = data
+    exact = build(vectors, mode="exact")
+    quantized = build(vectors, mode="exact", storage=storage, rescore=rescore)
+    assert recall(quantized, exact, queries) >= minimum
+    assert quantized.memory_usage()["vectors"] == 0
+
+
+@pytest.mark.parametrize("storage", ["float32", "int8", "pq"])
+def test_fetch_returns_the_upserted_values(data, storage):
+    vectors, queries = data
+    index = build(vectors, storage=storage)
+    index.query(queries[0], top_k=1)
+    fetched = index.fetch(["0", "5999", "missing"])["vectors"]
+    assert set(fetched) == {"0", "5999"}
+    assert np.allclose(fetched["0"]["values"], vectors[0], atol=1e-5)
+    assert fetched["5999"]["metadata"] == {"group": 5999 % 3}
+
+
+def test_namespaces_and_deletes(data):
+    vectors, _ = data
+    index = build(vectors[:100], mode="exact")
+    index.upsert([("0", vectors[0])], namespace="team-a")
+    assert index.describe_index_stats()["namespaces"] == {"": {"vector_count": 100}, "team-a": {"vector_count": 1}}
+    assert [match["id"] for match in index.query(vectors[5], top_k=3, namespace="team-a")["matches"]] == ["0"]
+
+    index.delete(filter={"group": 0})
+    index.delete(ids=["1"])
+    assert len(index) == 100 - 34 - 1 + 1
+    assert index.query(vectors[3], top_k=1)["matches"][0]["id"] != "3"
+    assert "1" not in index.fetch(["1"])["vectors"] and "0" in index.fetch(["0"], namespace="team-a")["vectors"]
+
+
+@pytest.mark.parametrize("storage, mode", [("pq", "exact"), ("float32", "ivf")])
+def test_queries_during_upserts_and_training(data, storage, mode):
+    vectors, _ = data
+    index = build(vectors[:1000], storage=storage, mode=mode)
+    errors = []
+
+    def search():
+        try:
+            for row in range(0, 1000, 25):
+                matches = index.query(vectors[row], top_k=3)["matches"]
+                assert len(matches) == 3 and all(0 <= int(match["id"]) < 6000 for match in matches)
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=search) for _ in range(3)]
+    for thread in threads:
+        thread.start()
+    for start in range(1000, 6000, 500):
+        index.upsert([(str(i), vectors[i]) for i in range(start, start + 500)])
+    for thread in threads:
+        thread.join()
+    assert not errors and len(index) == 6000
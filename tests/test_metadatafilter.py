@@ -0,0 +1,93 @@
+import numpy as np
+import pytest
+from ragqnabot.metadatafilter import MetadataIndex, matches_filter
+
+METADATAS = [
+    {"doc_id": "manual.pdf", "page": 3, "tags": ["setup", "network"], "draft": False, "text": "Connect the cable."},
+    {"doc_id": "manual.pdf", "page": 12.5, "tags": ["billing"], "text": "Invoices are monthly."},
+    {"doc_id": "faq.md", "page": 1, "draft": True, "text": "Ask support."},
+    {"doc_id": "faq.md", "page": "2", "text": "Pages can be strings."},
+    {"owner": "ops", "text": "No document id."},
+    None,
+]
+
+FILTERS = [
+    {},
+    {"doc_id": "manual.pdf"},
+    {"doc_id": {"$ne": "manual.pdf"}},
+    {"page": {"$gte": 3, "$lt": 13}},
+    {"page": {"$gt": 1}},
+    {"page": {"$lte": 1}},
+    {"page": 1.0},
+    {"page": "2"},
+    {"tags": "network"},
+    {"tags": {"$in": ["billing", "hr"]}},
+    {"tags": {"$nin": ["billing"]}},
+    {"draft": False},
+    {"draft": {"$eq": 0}},
+    {"owner": {"$exists": True}},
+    {"owner": {"$exists": False}},
+    {"doc_id": {"$in": ["faq.md"]}, "page": {"$lt": 2}},
+    {"$or": [{"doc_id": "faq.md"}, {"page": {"$gt": 10}}]},
+    {"$and": [{"doc_id": "manual.pdf"}, {"$or": [{"tags": "setup"}, {"page": {"$gt": 12}}]}]},
+]
+
+
+def test_matches_filter():
+    assert matches_filter(METADATAS[0], {"doc_id": "manual.pdf", "page": {"$gte": 3}})
+    assert not matches_filter(METADATAS[0], {"doc_id": "manual.pdf", "page": {"$gt": 3}})
+    # Numbers compare by value, but booleans are not numbers.
+    assert matches_filter(METADATAS[2], {"page": 1.0}) and not matches_filter(METADATAS[2], {"draft": 1})
+    # A list matches when any of its elements does.
+    assert matches_filter(METADATAS[0], {"tags": "network"}) and matches_filter(METADATAS[0], {"tags": {"$in": ["x", "setup"]}})
+    assert not matches_filter(METADATAS[0], {"tags": {"$ne": "setup"}})
+    # Range operators never match strings.
+    assert not matches_filter(METADATAS[3], {"page": {"$gt": 0}})
+    # $ne and $nin match metadata without the field; the other operators do not.
+    assert matches_filter(METADATAS[4], {"doc_id": {"$ne": "faq.md"}}) and matches_filter(METADATAS[4], {"page": {"$nin": [1]}})
+    assert not matches_filter(METADATAS[4], {"doc_id": {"$in": ["faq.md"]}})
+    assert matches_filter(None, None) and matches_filter(None, {}) and not matches_filter(None, {"doc_id": "faq.md"})
+
+
+@pytest.mark.parametrize("filter", [
+    [("doc_id", "faq.md")],
+    {"page": {"$between": [1, 2]}},
+    {"page": {"$gt": "1"}},
+    {"tags": {"$in": "billing"}},
+    {"owner": {"$exists": 1}},
+    {"$or": {"doc_id": "faq.md"}},
+])
+def test_malformed_filters_raise(filter):
+    with pytest.raises(ValueError):
+        matches_filter(METADATAS[0], filter)
+
+
+@pytest.mark.parametrize("filter", FILTERS)
+def test_metadata_index_matches_matches_filter(filter):
+    index = MetadataIndex()
+    for row, metadata in enumerate(METADATAS):
+        index.add(row, metadata)
+    expected = [matches_filter(metadata, filter) for metadata in METADATAS]
+    assert index.evaluate(filter, len(METADATAS)).tolist() == expected
+
+
+def test_metadata_index_remove_and_remap():
+    index = MetadataIndex()
+    for row, metadata in enumerate(METADATAS):
+        index.add(row, metadata)
+    index.remove([0, 2], [METADATAS[0], METADATAS[2]])
+    assert index.evaluate({"doc_id": "manual.pdf"}, len(METADATAS)).tolist() == [False, True, False, False, False, False]
+
+    # Drop rows 0 and 2 and renumber the others, as LocalIndex does when it compacts.
+    index.remap(np.array([-1, 0, -1, 1, 2, 3]))
+    remaining = [METADATAS[1], METADATAS[3], METADATAS[4], METADATAS[5]]
+    for filter in FILTERS:
+        assert index.evaluate(filter, len(remaining)).tolist() == [matches_filter(metadata, filter) for metadata in remaining]
+
+
+def test_unindexed_fields_cannot_be_filtered():
+    index = MetadataIndex(fields=["doc_id"])
+    index.add(0, METADATAS[0])
+    assert index.indexed("doc_id") and not index.indexed("page") and not MetadataIndex().indexed("text")
+    with pytest.raises(ValueError):
+        index.evaluate({"page": 3}, 1)
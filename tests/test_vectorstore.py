@@ -0,0 +1,90 @@
+import pytest
+from ragqnabot.embeddingcache import EmbeddingCache
+from ragqnabot.lexicalindex import BM25Index
+from ragqnabot.localindex import LocalIndex
+from ragqnabot.vectorstore import VectorStore
+from conftest import DIMENSION
+
+
+@pytest.fixture
+def store(tmp_path):
+    store = VectorStore(cache=EmbeddingCache(str(tmp_path / "cache"), dimension=DIMENSION), lexical_index=BM25Index())
+    yield store
+    store.close()
+    store.cache.close()
+
+
+def test_ids_are_content_hashes():
+    first, second = VectorStore(), VectorStore()
+    first.add_texts(["Invoices are paid within thirty days.", "Refunds take five days."], doc_id="policy.txt")
+    second.add_texts([{"text": "Refunds take five days.", "page": 2}], doc_id="policy.txt")
+    assert second.ids[0] == first.ids[1] == f"policy.txt#{VectorStore.content_hash('Refunds take five days.')[:32]}"
+    assert second.metadatas[0]["page"] == 2 and second.metadatas[0]["doc_id"] == "policy.txt"
+
+
+def test_unchanged_chunks_are_skipped(fake_model):
+    store = VectorStore()
+    store.add_texts(["alpha", "beta", "alpha"], doc_id="a.txt")
+    assert len(store.ids) == 2 and fake_model.encoded == 2
+    store.add_texts(["alpha", "beta"], doc_id="a.txt")
+    assert len(store.ids) == 2 and fake_model.encoded == 2
+    store.add_texts(["alpha"], doc_id="b.txt")
+    assert len(store.ids) == 3
+
+
+def test_adding_a_document_again_replaces_its_chunks():
+    store = VectorStore(lexical_index=BM25Index())
+    store.add_texts(["alpha one", "beta two"], doc_id="a.txt")
+    stale = store.ids[1]
+    store.add_texts(["alpha one", "gamma three"], doc_id="a.txt")
+    chunks, embeddings = store.document_chunks("a.txt")
+    assert [chunk["text"] for chunk in chunks] == ["alpha one", "gamma three"] and len(embeddings) == 2
+    assert stale not in [vector_id for vector_id, _, _ in store.iter_vectors()]
+    assert stale not in store.lexical_index
+
+
+def test_cached_embeddings_are_not_encoded_again(store, fake_model):
+    store.add_texts(["alpha", "beta"], doc_id="a.txt")
+    VectorStore(cache=store.cache).add_texts(["alpha", "beta", "gamma"], doc_id="b.txt")
+    assert fake_model.encoded == 3
+
+
+def test_sync_index_upserts_new_chunks_and_deletes_stale_ones(store):
+    index = LocalIndex(dimension=DIMENSION)
+    store.add_texts(["alpha one", "beta two", "gamma three"], doc_id="a.txt")
+    assert store.sync_index(index, doc_id="a.txt", index_name="docs") == {"upserted": 3, "deleted": 0, "unchanged": 0}
+
+    stale = store.ids[1]
+    store.add_texts(["alpha one", "gamma three", "delta four"], doc_id="a.txt")
+    # The stale chunk stays searchable lexically until it is deleted from the index.
+    assert stale in store.lexical_index
+    assert store.sync_index(index, doc_id="a.txt", index_name="docs") == {"upserted": 1, "deleted": 1, "unchanged": 2}
+    assert stale not in index.fetch([stale])["vectors"] and len(index) == 3
+    assert stale not in store.lexical_index
+    assert store.sync_index(index, doc_id="a.txt", index_name="docs") == {"upserted": 0, "deleted": 0, "unchanged": 3}
+
+
+def test_stale_chunks_stay_lexical_while_another_namespace_holds_them(store):
+    index = LocalIndex(dimension=DIMENSION)
+    store.add_texts(["alpha one", "beta two"], doc_id="a.txt")
+    store.sync_index(index, doc_id="a.txt", index_name="docs", namespace="team-a")
+    store.sync_index(index, doc_id="a.txt", index_name="docs", namespace="team-b")
+    stale = store.ids[1]
+    store.add_texts(["alpha one"], doc_id="a.txt")
+    store.sync_index(index, doc_id="a.txt", index_name="docs", namespace="team-a")
+    assert stale in store.lexical_index
+    store.sync_index(index, doc_id="a.txt", index_name="docs", namespace="team-b")
+    assert stale not in store.lexical_index
+
+
+def test_scoped_lexical_search_returns_k_matches():
+    store = VectorStore(lexical_index=BM25Index())
+    # Other documents rank first for "widget" and fill the initial over-fetch.
+    store.add_texts([f"widget error {i}" for i in range(200)], doc_id="other.txt")
+    store.add_texts([f"widget note {i}" for i in range(5)], doc_id="mine.txt")
+    index = LocalIndex(dimension=DIMENSION)
+    store.sync_index(index, doc_id="other.txt")
+    store.sync_index(index, doc_id="mine.txt")
+    for mode in ("lexical", "hybrid"):
+        results = store.similarity_search(index, "widget", k=3, mode=mode, filter={"doc_id": "mine.txt"})
+        assert [metadata["doc_id"] for metadata, _ in results] == ["mine.txt"] * 3